@@ -0,0 +1,109 @@
+"""
+Microbenchmark of get_dynamic_element_keys against the former recursive implementation
+
+    python scripts/benchmark_dynamic_element_keys.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wagtailsnapshotpublisher.utils import get_dynamic_element_keys  # noqa: E402
+
+
+def recursive_get_dynamic_element_keys(data, keys=[], key=None, result=[]):
+    """ recursive_get_dynamic_element_keys, former implementation """
+    keys_cp = keys.copy()
+
+    if key is None:
+        result = list()
+
+    if key is not None and (
+            isinstance(data, dict) or isinstance(data, list) or isinstance(data, tuple)):
+        keys_cp.append(key)
+
+    if isinstance(data, dict):
+        for k, item in data.items():
+            recursive_get_dynamic_element_keys(item, keys_cp, k, result)
+    elif isinstance(data, list) or isinstance(data, tuple):
+        for i, item in enumerate(data):
+            recursive_get_dynamic_element_keys(item, keys_cp, i, result)
+    else:
+        if key == 'dynamic' and data:
+            result.append(keys_cp)
+
+    if key is None:
+        return result
+
+
+def get_dynamic_element(i):
+    """ get_dynamic_element """
+    return {
+        'type': 'cover',
+        'value': {
+            'app': 'test_page',
+            'class': 'TestModel',
+            'id': i,
+            'serializer': 'default',
+            'dynamic': True,
+        },
+    }
+
+
+def get_block(i):
+    """ get_block """
+    return {
+        'type': 'rich_text',
+        'id': str(i),
+        'value': {
+            'title': 'Block {}'.format(i),
+            'body': '<p>{}</p>'.format('lorem ipsum ' * 20),
+            'links': [{'url': '/page-{}/'.format(j), 'text': 'Link {}'.format(j)} for j in range(5)],
+        },
+    }
+
+
+def get_wide_document(size=2000, dynamic_every=50):
+    """ get_wide_document, a long StreamField with a few dynamic elements """
+    return {
+        'title': 'Wide',
+        'meta': {'full_path': '/wide/'},
+        'body': [
+            get_dynamic_element(i) if i % dynamic_every == 0 else get_block(i)
+            for i in range(size)
+        ],
+    }
+
+
+def get_deep_document(depth=200, width=5):
+    """ get_deep_document, nested StructBlocks with a dynamic element at each level """
+    document = {'title': 'Deep'}
+    node = document
+    for i in range(depth):
+        child = {}
+        node['children'] = [get_block(j) for j in range(width)] + [get_dynamic_element(i), child]
+        node = child
+    return document
+
+
+def run():
+    """ run """
+    documents = {
+        'wide': get_wide_document(),
+        'deep': get_deep_document(),
+    }
+    for name, document in documents.items():
+        assert sorted(map(str, get_dynamic_element_keys(document))) == \
+            sorted(map(str, recursive_get_dynamic_element_keys(document)))
+        for implementation in (recursive_get_dynamic_element_keys, get_dynamic_element_keys):
+            timer = timeit.Timer(lambda: implementation(document))
+            number, total = timer.autorange()
+            best = min(timer.repeat(repeat=5, number=number)) / number
+            print('{:<5} {:<35} {:>10.3f} ms'.format(name, implementation.__name__, best * 1000))
+
+
+if __name__ == '__main__':
+    sys.setrecursionlimit(10000)
+    run()
@@ -0,0 +1,220 @@
+"""
+.. module:: tests.tests_cache
+"""
+
+import json
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from djangosnapshotpublisher.publisher_api import PublisherAPI
+
+from wagtailsnapshotpublisher.cache import *
+from wagtailsnapshotpublisher.management.commands.golive_scheduled_releases import Command
+from wagtailsnapshotpublisher.models import WSSPContentRelease, write_release_documents
+
+
+@override_settings(WSSP_DOCUMENT_CACHE='default')
+class DocumentCacheTests(TestCase):
+    """ DocumentCacheTests """
+
+    def setUp(self):
+        """ setUp """
+        cache.clear()
+        self.release_uuid = '4736470b-5c03-4e48-929a-2a25e149e030'
+
+    def test_cache_document(self):
+        """ test_cache_document """
+        self.assertEqual(get_cached_document('site1', self.release_uuid, 'page', 3), None)
+        cache_document('site1', self.release_uuid, 'page', 3, {'title': 'Test1'})
+        self.assertEqual(
+            get_cached_document('site1', self.release_uuid, 'page', 3)['data'], {'title': 'Test1'})
+
+        invalidate_cached_document('site1', self.release_uuid, 'page', 3)
+        self.assertEqual(get_cached_document('site1', self.release_uuid, 'page', 3), None)
+
+    def test_invalidate_cached_release(self):
+        """ test_invalidate_cached_release """
+        generation = get_release_generation(self.release_uuid)
+        cache_document('site1', self.release_uuid, 'page', 3, {'title': 'Test1'}, dynamic=True,
+                       generation=generation)
+        cache_document('site1', self.release_uuid, 'cover', 4, {'title': 'Test2'})
+
+        invalidate_cached_release(self.release_uuid)
+        self.assertEqual(get_cached_document('site1', self.release_uuid, 'page', 3), None)
+        self.assertEqual(
+            get_cached_document('site1', self.release_uuid, 'cover', 4)['data'], {'title': 'Test2'})
+
+    @override_settings(WSSP_DOCUMENT_CACHE=None)
+    def test_cache_disabled(self):
+        """ test_cache_disabled """
+        cache_document('site1', self.release_uuid, 'page', 3, {'title': 'Test1'})
+        self.assertEqual(get_cached_document('site1', self.release_uuid, 'page', 3), None)
+
+    def test_skipped_publishes(self):
+        """ test_skipped_publishes """
+        self.assertEqual(get_skipped_publishes('site1'), 0)
+        increment_skipped_publishes('site1')
+        increment_skipped_publishes('site1')
+        self.assertEqual(get_skipped_publishes('site1'), 2)
+        self.assertEqual(get_skipped_publishes('site2'), 0)
+
+    def test_cache_comparison(self):
+        """ test_cache_comparison """
+        compare_to_uuid = 'b4c9a2f0-1d8e-4f4e-9f55-3c8d2b1a7e60'
+        release_uuids = [self.release_uuid, compare_to_uuid]
+        cache_key = get_comparison_cache_key(self.release_uuid, compare_to_uuid, release_uuids)
+        self.assertEqual(get_cached_comparison(cache_key), None)
+
+        comparison = [('Added', 'page', '3', 1, None)]
+        cache_comparison(cache_key, comparison)
+        self.assertEqual(get_cached_comparison(
+            get_comparison_cache_key(self.release_uuid, compare_to_uuid, release_uuids)), comparison)
+
+        invalidate_cached_document('site1', compare_to_uuid, 'page', 3)
+        self.assertEqual(get_cached_comparison(
+            get_comparison_cache_key(self.release_uuid, compare_to_uuid, release_uuids)), None)
+
+    def test_cache_document_loaded_before_invalidation(self):
+        """ test_cache_document_loaded_before_invalidation """
+        version = get_document_version('site1', self.release_uuid, 'page', 3)
+        invalidate_cached_document('site1', self.release_uuid, 'page', 3)
+        cache_document('site1', self.release_uuid, 'page', 3, {'title': 'Test1'}, version=version)
+        self.assertEqual(get_cached_document('site1', self.release_uuid, 'page', 3), None)
+
+        version = get_document_version('site1', self.release_uuid, 'page', 3)
+        cache_document('site1', self.release_uuid, 'page', 3, {'title': 'Test2'}, version=version)
+        self.assertEqual(
+            get_cached_documents('site1', self.release_uuid, [('page', 3)])[('page', 3)]['data'],
+            {'title': 'Test2'})
+
+    def test_invalidate_cached_documents(self):
+        """ test_invalidate_cached_documents """
+        generation = get_release_generation(self.release_uuid)
+        cache_document('site1', self.release_uuid, 'page', 3, {'title': 'Test1'}, dynamic=True,
+                       generation=generation)
+        cache_document('site1', self.release_uuid, 'page', 4, {'title': 'Test2'}, dynamic=True,
+                       generation=generation)
+
+        invalidate_cached_documents('site1', self.release_uuid, [('page', 4)])
+        self.assertEqual(
+            get_cached_document('site1', self.release_uuid, 'page', 3)['data'], {'title': 'Test1'})
+        self.assertEqual(get_cached_document('site1', self.release_uuid, 'page', 4), None)
+
+    def test_get_document_version(self):
+        """ test_get_document_version """
+        version = get_document_version('site1', self.release_uuid, 'page', 3)
+        self.assertNotEqual(version, None)
+        self.assertEqual(get_document_version('site1', self.release_uuid, 'page', 3), version)
+
+        invalidate_cached_document('site1', self.release_uuid, 'page', 3)
+        self.assertNotEqual(get_document_version('site1', self.release_uuid, 'page', 3), version)
+
+
+@override_settings(WSSP_DOCUMENT_CACHE='default')
+class ReleasePointerTests(TestCase):
+    """ ReleasePointerTests """
+
+    def setUp(self):
+        """ setUp """
+        cache.clear()
+        local_release_pointers.clear()
+
+    def test_refresh_release_pointer(self):
+        """ test_refresh_release_pointer, the pointer is kept until it is refreshed """
+        self.assertEqual(get_live_release('site1'), None)
+
+        live_release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        live_release.save()
+        PublisherAPI().set_live_content_release('site1', live_release.uuid)
+        next_release = WSSPContentRelease(
+            title='release2',
+            site_code='site1',
+            status=1,
+            publish_datetime=timezone.now() + timedelta(days=1),
+        )
+        next_release.save()
+        self.assertEqual(get_live_release('site1'), None)
+
+        pointer = refresh_release_pointer('site1')
+        self.assertEqual(pointer['live'], live_release)
+        self.assertEqual(pointer['valid_until'], next_release.publish_datetime)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_live_release('site1'), live_release)
+
+        # the pointer is built again once the next release reaches its publish datetime
+        local_release_pointers.clear()
+        cache.set(RELEASE_POINTER_CACHE_KEY.format(site_code='site1'),
+                  dict(pointer, valid_until=timezone.now() - timedelta(seconds=1)), timeout=None)
+        self.assertEqual(get_release_pointer('site1')['valid_until'], next_release.publish_datetime)
+
+
+@override_settings(WSSP_DOCUMENT_CACHE='default')
+class GoliveScheduledReleasesTests(TestCase):
+    """ GoliveScheduledReleasesTests """
+
+    def setUp(self):
+        """ setUp """
+        cache.clear()
+        local_release_pointers.clear()
+        self.live_release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        self.live_release.save()
+        PublisherAPI().set_live_content_release('site1', self.live_release.uuid)
+        self.next_release = WSSPContentRelease(
+            title='release2',
+            site_code='site1',
+            status=1,
+            publish_datetime=timezone.now() + timedelta(seconds=1),
+        )
+        self.next_release.save()
+        write_release_documents(self.next_release, [
+            ('page', '1', json.dumps({'title': 'Test1'}), {'content_hash': 'hash1'}),
+        ])
+
+    def test_get_scheduled_releases(self):
+        """ test_get_scheduled_releases, only the frozen releases within the lead time """
+        preview_release = WSSPContentRelease(
+            title='release3',
+            site_code='site1',
+            status=0,
+            publish_datetime=timezone.now() + timedelta(seconds=1),
+        )
+        preview_release.save()
+        command = Command()
+        self.assertEqual(command.get_scheduled_releases(None, 60), [self.next_release])
+        self.assertEqual(command.get_scheduled_releases(['site2'], 60), [])
+        self.assertEqual(command.get_scheduled_releases(None, 0), [])
+
+    def test_golive_scheduled_releases(self):
+        """
+        test_golive_scheduled_releases, the release is cached before its publish datetime and
+        the pointer is switched once it is live
+        """
+        self.assertEqual(refresh_release_pointer('site1')['live'], self.live_release)
+
+        stdout = StringIO()
+        call_command('golive_scheduled_releases', '--once', '--lead-time', '60', '--sleep', '0.5',
+                     stdout=stdout, stderr=StringIO())
+
+        self.assertIn('1 documents cached', stdout.getvalue())
+        self.assertEqual(
+            get_cached_document('site1', self.next_release.uuid, 'page', '1')['data'],
+            {'title': 'Test1'},
+        )
+        self.assertEqual(get_release_pointer('site1')['live'], self.next_release)
+        self.assertEqual(get_live_release('site1'), self.next_release)
+
+    def test_switch_rescheduled_release(self):
+        """ test_switch_rescheduled_release, the pointer isn't switched """
+        pointer = refresh_release_pointer('site1')
+        WSSPContentRelease.objects.filter(id=self.next_release.id).update(
+            publish_datetime=timezone.now() + timedelta(days=1))
+
+        command = Command(stdout=StringIO())
+        command.switch_release(self.next_release)
+        self.assertIn('was rescheduled', command.stdout.getvalue())
+        self.assertEqual(get_release_pointer('site1'), pointer)
@@ -0,0 +1,182 @@
+"""
+.. module:: tests.tests_diff
+"""
+
+import json
+
+from django.test import TestCase, override_settings
+
+from wagtailsnapshotpublisher.diff import (
+    compare_releases, diff_documents, diff_release_documents, get_comparison_items,
+    get_comparison_refs,
+)
+from wagtailsnapshotpublisher.models import WSSPContentRelease, write_release_documents
+
+
+class DiffFunctionsTests(TestCase):
+    """ DiffFunctionsTests """
+
+    def setUp(self):
+        self.document = {
+            'title': 'Test1',
+            'body': [
+                {'id': 'a1', 'type': 'text', 'value': 'Value1'},
+                {'id': 'b2', 'type': 'text', 'value': 'Value2'},
+            ],
+            'meta': {'full_path': '/test1/'},
+        }
+
+    def test_diff_documents_identical(self):
+        """ test_diff_documents_identical """
+        self.assertEqual(diff_documents(self.document, dict(self.document)), {
+            'changes': [],
+            'truncated': False,
+        })
+
+    def test_diff_documents(self):
+        """ test_diff_documents """
+        document_to = {
+            'title': 'Test2',
+            'body': [
+                {'id': 'b2', 'type': 'text', 'value': 'Value2'},
+                {'id': 'c3', 'type': 'text', 'value': 'Value3'},
+            ],
+            'meta': {'full_path': '/test1/'},
+        }
+        self.assertEqual(diff_documents(self.document, document_to)['changes'], [
+            {'path': ['title'], 'operation': 'changed', 'from': 'Test1', 'to': 'Test2'},
+            {'path': ['body', 0], 'operation': 'removed',
+             'from': {'id': 'a1', 'type': 'text', 'value': 'Value1'}},
+            {'path': ['body', 1], 'operation': 'added',
+             'to': {'id': 'c3', 'type': 'text', 'value': 'Value3'}},
+        ])
+
+    def test_diff_documents_truncated(self):
+        """ test_diff_documents_truncated """
+        document_to = {'title': 'Test2', 'body': [], 'meta': {}}
+        diff = diff_documents(self.document, document_to, max_changes=1)
+        self.assertEqual(len(diff['changes']), 1)
+        self.assertTrue(diff['truncated'])
+
+
+@override_settings(WSSP_OVERLAY_BASE_RELEASES=True)
+class CompareReleasesTests(TestCase):
+    """ CompareReleasesTests """
+
+    def setUp(self):
+        """ setUp """
+        self.base_release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        self.base_release.save()
+        self.write_documents(self.base_release, ['1', '2', '3'], 'hash1')
+
+        self.overlay_release = WSSPContentRelease(
+            title='release2',
+            site_code='site1',
+            status=0,
+            use_current_live_as_base_release=False,
+            base_release=self.base_release,
+        )
+        self.overlay_release.save()
+        self.write_documents(self.overlay_release, ['2', '3', '4'], 'hash2')
+        self.overlay_release.release_documents.filter(document_key='3').update(deleted=True)
+
+    def write_documents(self, content_release, keys, content_hash):
+        """ write_documents """
+        write_release_documents(content_release, [
+            ('page', key, json.dumps({'key': key}), {'content_hash': content_hash, 'title': key})
+            for key in keys
+        ])
+
+    def test_compare_overlay_release(self):
+        """ test_compare_overlay_release, the inherited documents aren't reported """
+        self.assertEqual(compare_releases(self.overlay_release, self.base_release, chunk_size=2), [
+            {
+                'document_key': '4',
+                'content_type': 'page',
+                'diff': 'Added',
+                'parameters': {'content_hash': 'hash2', 'title': '4'},
+            }, {
+                'document_key': '2',
+                'content_type': 'page',
+                'diff': 'Changed',
+                'parameters': {
+                    'release_from': {'content_hash': 'hash2', 'title': '2'},
+                    'release_compare_to': {'content_hash': 'hash1', 'title': '2'},
+                },
+            }, {
+                'document_key': '3',
+                'content_type': 'page',
+                'diff': 'Removed',
+                'parameters': {'content_hash': 'hash1', 'title': '3'},
+            },
+        ])
+
+    def test_compare_to_overlay_release(self):
+        """ test_compare_to_overlay_release, the inherited documents aren't reported """
+        self.assertEqual(
+            [
+                (item['diff'], item['document_key'])
+                for item in compare_releases(self.base_release, self.overlay_release)
+            ],
+            [('Added', '3'), ('Changed', '2'), ('Removed', '4')],
+        )
+
+    def test_comparison_page(self):
+        """ test_comparison_page, the items are built only for the refs of the page """
+        comparison_refs = get_comparison_refs(self.overlay_release, self.base_release)
+        self.assertEqual(
+            [comparison_ref[:3] for comparison_ref in comparison_refs],
+            [('Added', 'page', '4'), ('Changed', 'page', '2'), ('Removed', 'page', '3')],
+        )
+
+        with self.assertNumQueries(1):
+            items = get_comparison_items(comparison_refs[1:2])
+        self.assertEqual(items, [{
+            'document_key': '2',
+            'content_type': 'page',
+            'diff': 'Changed',
+            'parameters': {
+                'release_from': {'content_hash': 'hash2', 'title': '2'},
+                'release_compare_to': {'content_hash': 'hash1', 'title': '2'},
+            },
+        }])
+
+
+class DynamicDocumentsCompareTests(TestCase):
+    """ DynamicDocumentsCompareTests """
+
+    def setUp(self):
+        """ setUp """
+        self.release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        self.release.save()
+        self.release_compare_to = WSSPContentRelease(title='release2', site_code='site1', status=1)
+        self.release_compare_to.save()
+        for content_release, title in ((self.release, 'Test1'), (self.release_compare_to, 'Test2')):
+            write_release_documents(content_release, [
+                ('page', '1', json.dumps({'element': {'data': {'title': title}}}),
+                 {'content_hash': 'hash1', 'have_dynamic_elements': 'True'}),
+                ('page', '2', json.dumps({'title': title}), {'content_hash': 'hash2'}),
+            ])
+
+    def test_compare_resolved_elements(self):
+        """
+        test_compare_resolved_elements, the documents with dynamic elements are compared even
+        with the same content_hash
+        """
+        self.assertEqual(
+            [
+                comparison_ref[:3]
+                for comparison_ref in get_comparison_refs(self.release, self.release_compare_to)
+            ],
+            [('Changed', 'page', '1')],
+        )
+
+        response = diff_release_documents(self.release, self.release_compare_to, 'page', '1')
+        self.assertEqual(response['content']['changes'], [{
+            'path': ['element', 'data', 'title'],
+            'operation': 'changed',
+            'from': 'Test2',
+            'to': 'Test1',
+        }])
+        response = diff_release_documents(self.release, self.release_compare_to, 'page', '2')
+        self.assertEqual(response['content']['changes'], [])
@@ -2,13 +2,21 @@
 .. module:: tests.tests_models
 """
 
+import importlib
 import json
+from io import StringIO
+from unittest import mock
+
 from jsonschema import validate
 from jsonschema.exceptions import ValidationError as JsonSchemaValidationError
 
+from django.apps import apps
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
 from django.db.models import Q
-from django.test import Client
+from django.core.cache import cache
+from django.test import Client, TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 from django.urls import reverse
 
@@ -19,7 +27,18 @@ from wagtail.tests.utils import WagtailPageTests
 from djangosnapshotpublisher.models import ReleaseDocument
 from djangosnapshotpublisher.publisher_api import PublisherAPI
 
-from wagtailsnapshotpublisher.models import WithRelease, WSSPContentRelease
+from wagtailsnapshotpublisher.cache import (
+    cache_document, get_cached_document, get_document_version, get_release_watermark,
+)
+from wagtailsnapshotpublisher.models import (
+    ReleaseVersionCounter, WithRelease, WSSPContentRelease, allocate_version,
+    DynamicElementReference, get_dynamic_element_references, get_overlay_releases_based_on,
+    PublishJob, enqueue_publish_job, get_dependent_documents, invalidate_release_documents,
+    materialize_release, process_publish_job, publish_many_to_release,
+    rebuild_dynamic_element_references, refresh_changed_dynamic_elements,
+    refresh_dependent_documents,
+    unpublish_or_delete_many_from_release, write_release_documents,
+)
 
 from test_page.models import TestModel, TestPage, TestRelatedModel
 from test_page.wagtail_hooks import TestModelAdmin
@@ -92,6 +111,643 @@ class WithReleaseTests(WagtailPageTests):
 #         """ test_unpublish_or_delete_from_release """
 
 
+class LoadDynamicElementTests(TransactionTestCase):
+    """ LoadDynamicElementTests """
+
+    def setUp(self):
+        """ setUp """
+        patcher = mock.patch('wagtailsnapshotpublisher.models.refresh_changed_dynamic_elements')
+        self.refresh_changed_dynamic_elements = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.content_release = WSSPContentRelease(
+            title='release1',
+            site_code='site1',
+            status=1,
+            is_stage=True,
+        )
+        self.content_release.save()
+        self.refresh_changed_dynamic_elements.reset_mock()
+
+    def test_saves_coalesced(self):
+        """ test_saves_coalesced """
+        with transaction.atomic():
+            self.content_release.save()
+            self.content_release.save()
+            self.content_release.save()
+            self.refresh_changed_dynamic_elements.assert_not_called()
+        self.assertEqual(self.refresh_changed_dynamic_elements.call_count, 1)
+        self.assertEqual(
+            self.refresh_changed_dynamic_elements.call_args[0][0].pk, self.content_release.pk)
+
+    def test_save_after_rollback(self):
+        """ test_save_after_rollback """
+        try:
+            with transaction.atomic():
+                self.content_release.save()
+                raise ValueError()
+        except ValueError:
+            pass
+        self.refresh_changed_dynamic_elements.assert_not_called()
+
+        self.content_release.save()
+        self.assertEqual(self.refresh_changed_dynamic_elements.call_count, 1)
+
+    def test_not_stage_release(self):
+        """ test_not_stage_release """
+        content_release = WSSPContentRelease(title='release2', site_code='site1', status=0)
+        content_release.save()
+        self.refresh_changed_dynamic_elements.assert_not_called()
+
+
+class ReleaseVersionTests(TestCase):
+    """ ReleaseVersionTests """
+
+    def test_allocate_version(self):
+        """ test_allocate_version """
+        self.assertEqual(allocate_version('site1', 1), (0, 1))
+        self.assertEqual(allocate_version('site1', 1), (0, 2))
+        self.assertEqual(allocate_version('site1', 0), (1, 0))
+        self.assertEqual(allocate_version('site1', 1), (1, 1))
+        self.assertEqual(allocate_version('site2', 0), (1, 0))
+
+        counter = ReleaseVersionCounter.objects.get(site_code='site1')
+        self.assertEqual((counter.major, counter.minor), (1, 1))
+
+    def test_define_version(self):
+        """ test_define_version """
+        content_release = WSSPContentRelease(title='release1', site_code='site1', status=0)
+        content_release.save()
+        self.assertEqual(content_release.version, None)
+
+        content_release.status = 1
+        content_release.version_type = 0
+        content_release.save()
+        self.assertEqual(content_release.version, '1.0')
+        self.assertEqual((content_release.version_major, content_release.version_minor), (1, 0))
+
+        content_release = WSSPContentRelease(title='release2', site_code='site1', status=1)
+        content_release.save()
+        self.assertEqual(content_release.version, '1.1')
+
+    def test_set_version_numbers(self):
+        """ test_set_version_numbers from the 0010 migration """
+        migration = importlib.import_module(
+            'wagtailsnapshotpublisher.migrations.0010_release_version_numbers')
+
+        for site_code, version in (('site1', '1.2'), ('site1', '0.5'), ('site1', 'wrong'),
+                                   ('site2', '2.0')):
+            WSSPContentRelease(title=version, site_code=site_code, version=version,
+                               status=1).save()
+
+        migration.set_version_numbers(apps, None)
+
+        self.assertEqual(
+            {
+                release.title: (release.version_major, release.version_minor)
+                for release in WSSPContentRelease.objects.all()
+            },
+            {'1.2': (1, 2), '0.5': (0, 5), 'wrong': (None, None), '2.0': (2, 0)},
+        )
+        self.assertEqual(
+            {
+                counter.site_code: (counter.major, counter.minor)
+                for counter in ReleaseVersionCounter.objects.all()
+            },
+            {'site1': (1, 2), 'site2': (2, 0)},
+        )
+
+
+class ReleaseDocumentsInstance:
+    """ ReleaseDocumentsInstance, instance published as a page and a cover document """
+
+    def __init__(self, key):
+        self.key = key
+
+    def get_serializers(self):
+        """ get_serializers """
+        return {
+            'default': {'key': self.key, 'type': 'page'},
+            'cover': {'key': self.key, 'type': 'cover'},
+        }
+
+
+class ReleaseDocumentsTests(TestCase):
+    """ ReleaseDocumentsTests """
+
+    def setUp(self):
+        """ setUp """
+        self.content_release = WSSPContentRelease(title='release1', site_code='site1', status=0)
+        self.content_release.save()
+        self.other_content_release = WSSPContentRelease(
+            title='release2', site_code='site1', status=0)
+        self.other_content_release.save()
+
+    def write_documents(self, keys, content_hash='hash1', content_release=None):
+        """ write_documents, a page and a cover document per key """
+        return write_release_documents(content_release or self.content_release, [
+            (content_type, key, json.dumps({'key': key, 'hash': content_hash}),
+             {'content_hash': content_hash, 'title': key})
+            for key in keys
+            for content_type in ('page', 'cover')
+        ])
+
+    def get_document(self, content_type, key, content_release=None):
+        """ get_document """
+        return (content_release or self.content_release).release_documents.get(
+            content_type=content_type, document_key=key)
+
+    def test_write_create(self):
+        """ test_write_create """
+        self.assertEqual(
+            sorted(self.write_documents(['1', '2'])),
+            [('cover', '1'), ('cover', '2'), ('page', '1'), ('page', '2')],
+        )
+        self.assertEqual(self.content_release.release_documents.count(), 4)
+
+        release_document = self.get_document('page', '1')
+        self.assertEqual(json.loads(release_document.document_json), {'key': '1', 'hash': 'hash1'})
+        self.assertFalse(release_document.deleted)
+        self.assertEqual(
+            {parameter.key: parameter.content for parameter in release_document.parameters.all()},
+            {'content_hash': 'hash1', 'title': '1'},
+        )
+
+    def test_write_update(self):
+        """ test_write_update """
+        self.write_documents(['1'])
+        release_document = self.get_document('page', '1')
+
+        self.assertEqual(
+            sorted(self.write_documents(['1'], content_hash='hash2')),
+            [('cover', '1'), ('page', '1')],
+        )
+        updated_document = self.get_document('page', '1')
+        self.assertEqual(updated_document.id, release_document.id)
+        self.assertEqual(json.loads(updated_document.document_json), {'key': '1', 'hash': 'hash2'})
+        self.assertEqual(
+            {parameter.key: parameter.content for parameter in updated_document.parameters.all()},
+            {'content_hash': 'hash2', 'title': '1'},
+        )
+
+    def test_write_unchanged(self):
+        """ test_write_unchanged, the documents with the same content_hash are skipped """
+        self.write_documents(['1'])
+        self.assertEqual(self.write_documents(['1']), [])
+        self.assertEqual(sorted(self.write_documents(['1', '2'])), [('cover', '2'), ('page', '2')])
+
+        # an unpublished document is written again even with the same content_hash
+        ReleaseDocument.objects.filter(id=self.get_document('page', '1').id).update(deleted=True)
+        self.assertEqual(self.write_documents(['1']), [('page', '1')])
+        self.assertFalse(self.get_document('page', '1').deleted)
+
+    def test_write_shared(self):
+        """ test_write_shared, the documents shared with another release aren't changed """
+        self.write_documents(['1'], content_release=self.other_content_release)
+        shared_document = self.get_document('page', '1', self.other_content_release)
+        self.content_release.release_documents.add(shared_document)
+
+        self.assertEqual(
+            sorted(self.write_documents(['1'], content_hash='hash2')),
+            [('cover', '1'), ('page', '1')],
+        )
+
+        release_document = self.get_document('page', '1')
+        self.assertNotEqual(release_document.id, shared_document.id)
+        self.assertEqual(json.loads(release_document.document_json), {'key': '1', 'hash': 'hash2'})
+        shared_document = self.get_document('page', '1', self.other_content_release)
+        self.assertEqual(json.loads(shared_document.document_json), {'key': '1', 'hash': 'hash1'})
+        self.assertEqual(
+            {parameter.key: parameter.content for parameter in shared_document.parameters.all()},
+            {'content_hash': 'hash1', 'title': '1'},
+        )
+
+    def test_unpublish_recursively(self):
+        """ test_unpublish_recursively, a page and its descendants """
+        self.write_documents(['1', '2', '3'])
+        self.write_documents(['2'], content_release=self.other_content_release)
+        shared_document = self.get_document('page', '2', self.other_content_release)
+        ReleaseDocument.objects.filter(id=self.get_document('page', '2').id).delete()
+        self.content_release.release_documents.add(shared_document)
+
+        response = unpublish_or_delete_many_from_release(
+            [ReleaseDocumentsInstance('1'), ReleaseDocumentsInstance('2')], self.content_release)
+        self.assertEqual(response, {'status': 'success', 'content': {'documents': 4}})
+
+        for content_type in ('page', 'cover'):
+            self.assertFalse(self.content_release.release_documents.filter(
+                content_type=content_type, document_key__in=['1', '2'], deleted=False).exists())
+            self.assertFalse(self.get_document(content_type, '3').deleted)
+        self.assertFalse(self.get_document('page', '2', self.other_content_release).deleted)
+
+    def test_remove_recursively(self):
+        """ test_remove_recursively, a page and its descendants """
+        self.write_documents(['1', '2', '3'])
+        self.write_documents(['2'], content_release=self.other_content_release)
+        shared_document = self.get_document('page', '2', self.other_content_release)
+        ReleaseDocument.objects.filter(id=self.get_document('page', '2').id).delete()
+        self.content_release.release_documents.add(shared_document)
+        removed_document_id = self.get_document('page', '1').id
+
+        response = unpublish_or_delete_many_from_release(
+            [ReleaseDocumentsInstance('1'), ReleaseDocumentsInstance('2')], self.content_release,
+            delete=True)
+        self.assertEqual(response, {'status': 'success', 'content': {'documents': 4}})
+
+        self.assertEqual(
+            sorted(self.content_release.release_documents.values_list(
+                'content_type', 'document_key')),
+            [('cover', '3'), ('page', '3')],
+        )
+        self.assertFalse(ReleaseDocument.objects.filter(id=removed_document_id).exists())
+        self.assertEqual(self.get_document('page', '2', self.other_content_release).id,
+                         shared_document.id)
+
+
+@override_settings(WSSP_OVERLAY_BASE_RELEASES=True, WSSP_DOCUMENT_CACHE='default')
+class OverlayReleaseCacheTests(TestCase):
+    """ OverlayReleaseCacheTests """
+
+    def setUp(self):
+        """ setUp """
+        cache.clear()
+        self.base_release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        self.base_release.save()
+        self.overlay_release = WSSPContentRelease(
+            title='release2', site_code='site1', status=1, base_release=self.base_release)
+        self.overlay_release.save()
+        self.other_overlay_release = WSSPContentRelease(
+            title='release3', site_code='site1', status=1, base_release=self.overlay_release)
+        self.other_overlay_release.save()
+
+    def test_get_overlay_releases_based_on(self):
+        """ test_get_overlay_releases_based_on """
+        self.assertEqual(
+            [release.pk for release in get_overlay_releases_based_on(self.base_release)],
+            [self.overlay_release.pk, self.other_overlay_release.pk],
+        )
+        self.assertEqual(get_overlay_releases_based_on(self.other_overlay_release), [])
+
+    def test_invalidate_base_release_documents(self):
+        """ test_invalidate_base_release_documents, the overlay releases are invalidated too """
+        for release in (self.base_release, self.overlay_release, self.other_overlay_release):
+            cache_document('site1', release.uuid, 'page', '1', {'title': 'Test1'},
+                           version=get_document_version('site1', release.uuid, 'page', '1'))
+
+        invalidate_release_documents(self.base_release, [('page', '1')])
+        for release in (self.base_release, self.overlay_release, self.other_overlay_release):
+            self.assertEqual(get_cached_document('site1', release.uuid, 'page', '1'), None)
+
+
+@override_settings(WSSP_DOCUMENT_CACHE='default')
+class BaseReleaseCopyCacheTests(TestCase):
+    """ BaseReleaseCopyCacheTests """
+
+    def setUp(self):
+        """ setUp """
+        cache.clear()
+        self.base_release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        self.base_release.save()
+        write_release_documents(self.base_release, [
+            ('page', '1', json.dumps({'title': 'Test1'}), {'content_hash': 'hash1'}),
+        ])
+
+    def test_copy_invalidates_comparisons(self):
+        """ test_copy_invalidates_comparisons, the watermark of the release is replaced """
+        content_release = WSSPContentRelease(
+            title='release2',
+            site_code='site1',
+            status=0,
+            use_current_live_as_base_release=False,
+            base_release=self.base_release,
+        )
+        content_release.save()
+        watermark = get_release_watermark(content_release.uuid)
+
+        content_release.copy_document_release_ref_from_baserelease()
+        self.assertNotEqual(get_release_watermark(content_release.uuid), watermark)
+
+
+class DynamicElementReferencesTests(TestCase):
+    """ DynamicElementReferencesTests """
+
+    def setUp(self):
+        """ setUp """
+        self.content_release = WSSPContentRelease(title='release1', site_code='site1', status=0)
+        self.content_release.save()
+        self.test_model = TestModel(
+            name1='Test Name1',
+            name2='Test Name2',
+            content_release=self.content_release,
+        )
+        self.test_model.save()
+
+    def test_string_ids(self):
+        """ test_string_ids, the ids of the elements are converted to the type of the pk """
+        items = [
+            {'app': 'test_page', 'class': 'TestModel', 'id': self.test_model.id,
+             'serializer': 'default'},
+            {'app': 'test_page', 'class': 'TestModel', 'id': str(self.test_model.id),
+             'serializer': 'cover'},
+            {'app': 'test_page', 'class': 'TestModel', 'id': 'not-an-id',
+             'serializer': 'default'},
+        ]
+        with self.assertNumQueries(1):
+            references = get_dynamic_element_references(items)
+        self.assertEqual(references, {
+            ('test_page', 'TestModel', self.test_model.id, 'default'): ['test_model', 'test_model'],
+            ('test_page', 'TestModel', str(self.test_model.id), 'cover'): ['cover', 'test_model'],
+        })
+
+
+class DynamicElementsTests(TestCase):
+    """ DynamicElementsTests """
+
+    def setUp(self):
+        """ setUp """
+        self.content_release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        self.content_release.save()
+        self.test_model = TestModel(
+            name1='Test Name1',
+            name2='Test Name2',
+            content_release=self.content_release,
+        )
+        self.test_model.save()
+        self.write_test_model({'name1': 'Test Name1'}, 'hash1')
+        write_release_documents(self.content_release, [
+            ('page', '1', json.dumps({'body': [{'value': {
+                'dynamic': True,
+                'app': 'test_page',
+                'class': 'TestModel',
+                'id': self.test_model.id,
+                'serializer': 'default',
+            }}]}), {
+                'content_hash': 'hash2',
+                'have_dynamic_elements': 'True',
+                'dynamic_element_keys': json.dumps([['body', 0, 'value']]),
+            }),
+        ])
+
+    def write_test_model(self, data, content_hash):
+        """ write_test_model """
+        write_release_documents(self.content_release, [
+            ('test_model', 'test_model', json.dumps(data), {'content_hash': content_hash}),
+        ])
+
+    def get_references(self):
+        """ get_references """
+        return list(self.content_release.dynamic_element_references.values_list(
+            'content_type', 'document_key', 'reference_content_type', 'reference_document_key',
+            'reference_document_id', 'outdated',
+        ))
+
+    def get_test_model_id(self):
+        """ get_test_model_id """
+        return self.content_release.release_documents.get(content_type='test_model').id
+
+    @override_settings(WSSP_MATERIALIZE_DYNAMIC_ELEMENTS=True)
+    def test_materialize_release(self):
+        """ test_materialize_release, the dynamic elements are resolved and indexed """
+        materialize_release(self.content_release)
+
+        materialized_document = self.content_release.materialized_documents.get(
+            content_type='page', document_key='1')
+        self.assertEqual(json.loads(materialized_document.document_json)['body'][0]['data'],
+                         {'name1': 'Test Name1'})
+        self.assertEqual(self.get_references(), [
+            ('page', '1', 'test_model', 'test_model', self.get_test_model_id(), False),
+        ])
+
+    def test_copy_from_base_release(self):
+        """
+        test_copy_from_base_release, the dynamic documents of the base release are written to
+        the release with their elements resolved against the documents of the release
+        """
+        content_release = WSSPContentRelease(
+            title='release2',
+            site_code='site1',
+            status=0,
+            use_current_live_as_base_release=False,
+            base_release=self.content_release,
+        )
+        content_release.save()
+        write_release_documents(content_release, [
+            ('test_model', 'test_model', json.dumps({'name1': 'Test Name2'}),
+             {'content_hash': 'hash3'}),
+        ])
+
+        content_release.copy_document_release_ref_from_baserelease()
+
+        release_document = content_release.release_documents.get(
+            content_type='page', document_key='1')
+        self.assertNotEqual(
+            release_document.id,
+            self.content_release.release_documents.get(content_type='page', document_key='1').id,
+        )
+        self.assertEqual(json.loads(release_document.document_json)['body'][0]['data'],
+                         {'name1': 'Test Name2'})
+        self.assertEqual(
+            release_document.parameters.get(key='dynamic_element_keys').content,
+            json.dumps([['body', 0, 'value']]),
+        )
+        # the document of the base release isn't changed
+        self.assertNotIn('data', json.loads(self.content_release.release_documents.get(
+            content_type='page', document_key='1').document_json)['body'][0])
+
+    def test_refresh_dependent_documents(self):
+        """
+        test_refresh_dependent_documents, the documents embedding a changed document of the
+        staged release are resolved again
+        """
+        rebuild_dynamic_element_references(self.content_release)
+        self.assertEqual(self.get_references(), [
+            ('page', '1', 'test_model', 'test_model', self.get_test_model_id(), False),
+        ])
+        self.assertEqual(
+            get_dependent_documents(self.content_release, [('test_model', 'test_model')]),
+            [('page', '1')],
+        )
+        self.assertEqual(get_dependent_documents(self.content_release, [('page', '1')]), [])
+
+        self.write_test_model({'name1': 'Test Name2'}, 'hash3')
+        self.content_release.is_stage = True
+        refresh_dependent_documents(self.content_release, [('test_model', 'test_model')])
+
+        page_document = self.content_release.release_documents.get(content_type='page')
+        self.assertEqual(json.loads(page_document.document_json)['body'][0]['data'],
+                         {'name1': 'Test Name2'})
+        self.assertEqual(self.get_references(), [
+            ('page', '1', 'test_model', 'test_model', self.get_test_model_id(), False),
+        ])
+
+
+class PublishToReleaseTests(TestCase):
+    """ PublishToReleaseTests """
+
+    def setUp(self):
+        """ setUp """
+        self.content_release = WSSPContentRelease(title='release1', site_code='site1', status=0)
+        self.content_release.save()
+        self.test_model = TestModel(
+            name1='Test Name1',
+            name2='Test Name2',
+            content_release=self.content_release,
+        )
+        self.test_model.save()
+        self.test_model.publish_to_release()
+
+    def get_cover_document(self):
+        """ get_cover_document """
+        return self.content_release.release_documents.get(content_type='cover')
+
+    def test_publish_unchanged(self):
+        """ test_publish_unchanged, the documents with the same content_hash are skipped """
+        content_hash = self.get_cover_document().parameters.get(key='content_hash').content
+        with mock.patch.object(PublisherAPI, 'publish_document_to_content_release') as publish:
+            self.test_model.publish_to_release()
+        publish.assert_not_called()
+
+        self.test_model.name1 = 'Test Name3'
+        self.test_model.publish_to_release()
+        self.assertEqual(json.loads(self.get_cover_document().document_json),
+                         {'name1': 'Test Name3'})
+        self.assertNotEqual(
+            self.get_cover_document().parameters.get(key='content_hash').content, content_hash)
+
+
+class PublishManyToReleaseTests(TestCase):
+    """ PublishManyToReleaseTests """
+
+    def setUp(self):
+        """ setUp """
+        self.content_release = WSSPContentRelease(title='release1', site_code='site1', status=0)
+        self.content_release.save()
+        self.test_model = TestModel(name1='Test Name1', name2='Test Name2')
+        self.test_model.save()
+
+    def test_publish_many_to_release(self):
+        """ test_publish_many_to_release, the unchanged documents are skipped """
+        response = publish_many_to_release([self.test_model], self.content_release)
+        self.assertEqual(response, {'status': 'success', 'content': {'published': 2, 'skipped': 0}})
+        self.assertEqual(
+            sorted(self.content_release.release_documents.values_list('content_type', 'document_key')),
+            [('cover', 'test_model'), ('test_model', 'test_model')],
+        )
+
+        response = publish_many_to_release([self.test_model], self.content_release)
+        self.assertEqual(response, {'status': 'success', 'content': {'published': 0, 'skipped': 2}})
+
+        # name2 is only in the default document
+        self.test_model.name2 = 'Test Name3'
+        response = publish_many_to_release([self.test_model], self.content_release)
+        self.assertEqual(response, {'status': 'success', 'content': {'published': 1, 'skipped': 1}})
+        self.assertEqual(json.loads(self.content_release.release_documents.get(
+            content_type='test_model').document_json)['name2'], 'Test Name3')
+
+
+class PublishQueueTests(TestCase):
+    """ PublishQueueTests """
+
+    def setUp(self):
+        """ setUp """
+        self.content_release = WSSPContentRelease(title='release1', site_code='site1', status=0)
+        self.content_release.save()
+        # the revisions of a Page without release can't be published
+        self.page = Page.get_first_root_node().add_child(instance=Page(title='Page', slug='page'))
+        self.job = enqueue_publish_job(self.page, self.page.save_revision(), self.content_release)
+
+    def process_publish_queue(self, **options):
+        """ process_publish_queue, return the seconds waited between the batches """
+        with mock.patch('time.sleep') as sleep:
+            call_command('process_publish_queue', once=True, stdout=StringIO(), **options)
+        return [call[0][0] for call in sleep.call_args_list]
+
+    def test_enqueue_publish_job(self):
+        """ test_enqueue_publish_job, there is one job per page and release """
+        self.job.attempts = 2
+        self.job.save()
+        revision = self.page.save_revision()
+        job = enqueue_publish_job(self.page, revision, self.content_release)
+        self.assertEqual(job.id, self.job.id)
+        self.assertEqual((job.revision_id, job.attempts), (revision.id, 0))
+
+    def test_process_publish_job_failed(self):
+        """ test_process_publish_job_failed, the job is kept with its error """
+        self.assertFalse(process_publish_job(self.job))
+        job = PublishJob.objects.get(id=self.job.id)
+        self.assertEqual(job.attempts, 1)
+        self.assertNotEqual(job.last_error, '')
+        self.assertGreater(job.updated_at, self.job.updated_at)
+
+    @mock.patch('wagtailsnapshotpublisher.management.commands.process_publish_queue.process_publish_job')
+    def test_process_publish_queue(self, process_publish_job):
+        """ test_process_publish_queue, the published jobs are removed """
+        process_publish_job.side_effect = lambda job: PublishJob.objects.filter(id=job.id).delete()
+        self.assertEqual(self.process_publish_queue(), [])
+        self.assertEqual(process_publish_job.call_count, 1)
+        self.assertFalse(PublishJob.objects.exists())
+
+    def test_process_publish_queue_back_off(self):
+        """
+        test_process_publish_queue_back_off, the wait is doubled after each batch which failed
+        until the jobs reach the max attempts
+        """
+        self.assertEqual(
+            self.process_publish_queue(batch_size=1, max_attempts=4, sleep=1, max_sleep=3),
+            [1, 2, 3, 3],
+        )
+        self.assertEqual(PublishJob.objects.get(id=self.job.id).attempts, 4)
+
+
+class OutdatedReferencesTests(TestCase):
+    """ OutdatedReferencesTests """
+
+    def setUp(self):
+        """ setUp """
+        self.content_release = WSSPContentRelease(title='release1', site_code='site1', status=0)
+        self.content_release.save()
+        write_release_documents(self.content_release, [
+            ('page', '1', json.dumps({'title': 'Test1'}),
+             {'content_hash': 'hash1', 'dynamic_element_keys': '[]'}),
+            ('cover', '2', json.dumps({'title': 'Test2'}), {'content_hash': 'hash2'}),
+        ])
+        for reference_document_key in ('2', '3'):
+            DynamicElementReference(
+                content_release=self.content_release,
+                content_type='page',
+                document_key='1',
+                reference_content_type='cover',
+                reference_document_key=reference_document_key,
+            ).save()
+
+    def get_references(self):
+        """ get_references """
+        return list(self.content_release.dynamic_element_references.order_by(
+            'reference_document_key',
+        ).values_list('reference_document_key', 'reference_document_id', 'outdated'))
+
+    @mock.patch('wagtailsnapshotpublisher.models.refresh_dynamic_documents')
+    def test_refresh_outdated_references(self, refresh_dynamic_documents):
+        """ test_refresh_outdated_references, only the outdated references are refreshed """
+        self.assertEqual(refresh_changed_dynamic_elements(self.content_release), 0)
+
+        refresh_dependent_documents(self.content_release, [('cover', '2')])
+        refresh_dynamic_documents.assert_not_called()
+        self.assertEqual(self.get_references(), [('2', None, True), ('3', None, False)])
+
+        self.content_release.is_stage = True
+        self.assertEqual(refresh_changed_dynamic_elements(self.content_release), 1)
+        self.assertEqual([
+            (release_document.content_type, release_document.document_key, content, keys)
+            for release_document, content, keys in refresh_dynamic_documents.call_args[0][1]
+        ], [('page', '1', {'title': 'Test1'}, [])])
+
+        cover_id = self.content_release.release_documents.get(content_type='cover').id
+        self.assertEqual(self.get_references(), [('2', cover_id, False), ('3', None, False)])
+        self.assertEqual(refresh_changed_dynamic_elements(self.content_release), 0)
+        self.assertEqual(refresh_dynamic_documents.call_count, 1)
+
+
 # class ModelWithReleaseTests(WagtailPageTests):
 #     """ ModelWithReleaseTests """
 
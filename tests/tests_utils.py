@@ -25,6 +25,40 @@ class UtilsFunctionsTests(TestCase):
             'test5': 'Value3',
         }
 
+    def test_get_content_hash(self):
+        """ test_get_content_hash """
+        self.assertEqual(
+            get_content_hash({'test5': 'Value3', 'test1': [1, 2]}),
+            get_content_hash({'test1': [1, 2], 'test5': 'Value3'}),
+        )
+        self.assertNotEqual(
+            get_content_hash({'test1': [1, 2]}),
+            get_content_hash({'test1': [2, 1]}),
+        )
+
+    def test_get_dynamic_element_keys(self):
+        """ test_get_dynamic_element_keys """
+        data = {
+            'title': 'Page',
+            'body': [
+                {'type': 'text', 'value': 'Text'},
+                {'type': 'cover', 'value': {'app': 'test_page', 'id': 1, 'dynamic': True}},
+                {'type': 'list', 'value': [{'dynamic': False}, {'id': 2, 'dynamic': True}]},
+            ],
+            'footer': {'dynamic': True},
+            'empty': [],
+        }
+        self.assertEqual(get_dynamic_element_keys(data), [
+            ['body', 1, 'value'],
+            ['body', 2, 'value', 1],
+            ['footer'],
+        ])
+        self.assertEqual(get_dynamic_element_keys({'dynamic': True}), [[]])
+        self.assertEqual(get_dynamic_element_keys('dynamic'), [])
+
+        dynamic_element_keys = iter_dynamic_element_keys(data)
+        self.assertEqual(next(dynamic_element_keys), ['body', 1, 'value'])
+
     # def test_get_from_dict(self):
     #     """ test_get_from_dict """
     #     self.assertEqual(get_from_dict(self.test_d, ['test1', 'test2', 1, 'test4']), 'Value2')
@@ -2,21 +2,28 @@
 .. module:: tests.tests_views
 """
 
+import json
 import os
 import uuid
+from unittest import mock
 
 from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
 from django.core.management import call_command
 from django.http import Http404
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.test.client import RequestFactory
 from django.urls import reverse
 
+from wagtail.core.models import Page
+
 from djangosnapshotpublisher.models import ReleaseDocument, ContentRelease
 from djangosnapshotpublisher.publisher_api import PublisherAPI, DATETIME_FORMAT
 
-from wagtailsnapshotpublisher.models import WSSPContentRelease
+from wagtailsnapshotpublisher.cache import invalidate_cached_document
+from wagtailsnapshotpublisher.models import WSSPContentRelease, write_release_documents
 from wagtailsnapshotpublisher.views import *
 from wagtailsnapshotpublisher.wagtail_hooks import ReleaseAdmin
 
@@ -927,3 +934,198 @@ class WagtailSnapshotPublisherViewTests(TestCase):
     #     self.assertEqual(content[0]['uuid'], str(content_release.uuid))
 
 
+
+
+class GetComparisonRowsTests(TestCase):
+    """ GetComparisonRowsTests """
+
+    def test_missing_revisions(self):
+        """ test_missing_revisions, the rows are kept without their revisions """
+        added_pages, changed_pages, removed_pages, extra_contents = get_comparison_rows([
+            {
+                'document_key': '3',
+                'content_type': 'page',
+                'diff': 'Added',
+                'parameters': {'revision_id': '999', 'title': 'Title3'},
+            }, {
+                'document_key': '4',
+                'content_type': 'page',
+                'diff': 'Changed',
+                'parameters': {
+                    'release_from': {'revision_id': '998', 'title': 'Title4'},
+                    'release_compare_to': {'revision_id': '997'},
+                },
+            }, {
+                'document_key': '5',
+                'content_type': 'page',
+                'diff': 'Removed',
+                'parameters': {},
+            },
+        ])
+
+        self.assertEqual([(item['title'], item['page_revision']) for item in added_pages],
+                         [('Title3', None)])
+        self.assertEqual(
+            [
+                (item['title'], item['page_revision_from'], item['page_revision_compare_to'])
+                for item in changed_pages
+            ],
+            [('Title4', None, None)],
+        )
+        self.assertEqual([(item['title'], item['page_revision']) for item in removed_pages],
+                         [('5', None)])
+        self.assertEqual(extra_contents, [])
+
+
+class DocumentEtagTests(TestCase):
+    """ DocumentEtagTests """
+
+    def setUp(self):
+        """ setUp """
+        self.factory = RequestFactory()
+        self.content_release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        self.content_release.save()
+        write_release_documents(self.content_release, [
+            ('page', '1', json.dumps({'title': 'Test1'}), {'content_hash': 'hash1'}),
+        ])
+
+    def get_document(self, **headers):
+        """ get_document """
+        request = self.factory.get('/', **headers)
+        return get_document_release(request, 'site1', str(self.content_release.uuid), 'page', '1')
+
+    def test_not_modified_without_cache(self):
+        """ test_not_modified_without_cache, the ETag is built from the published content_hash """
+        response = self.get_document()
+        self.assertEqual(response.status_code, 200)
+        etag = '"{}-hash1"'.format(self.content_release.uuid)
+        self.assertEqual(response['ETag'], etag)
+
+        with mock.patch.object(PublisherAPI, 'get_document_from_content_release') as get_document:
+            response = self.get_document(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        get_document.assert_not_called()
+
+        response = self.get_document(HTTP_IF_NONE_MATCH='"{}-hash0"'.format(
+            self.content_release.uuid))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(WSSP_DOCUMENT_CACHE='default')
+    def test_not_modified_with_cache(self):
+        """ test_not_modified_with_cache, the ETag changes when the document is invalidated """
+        cache.clear()
+        response = self.get_document()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'title': 'Test1'})
+        etag = response['ETag']
+
+        with mock.patch.object(PublisherAPI, 'get_document_from_content_release') as get_document:
+            response = self.get_document(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        get_document.assert_not_called()
+
+        invalidate_cached_document('site1', self.content_release.uuid, 'page', '1')
+        response = self.get_document(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ReleaseDocumentDiffTests(TestCase):
+    """ ReleaseDocumentDiffTests """
+
+    def test_permission_denied(self):
+        """ test_permission_denied, the diff needs the access_dev permission """
+        content_release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        content_release.save()
+        request = RequestFactory().get('/')
+        request.user = get_user_model().objects.create_user('editor', None, 'password')
+        with self.assertRaises(PermissionDenied):
+            release_document_diff(
+                request, content_release.id, content_release.id, 'page', '1')
+
+
+class PageChildrenTests(TestCase):
+    """ PageChildrenTests """
+
+    def setUp(self):
+        """ setUp """
+        self.client = Client()
+        self.client.force_login(get_user_model().objects.create_superuser('admin', None, 'password'))
+        self.parent_page = Page.get_first_root_node().add_child(
+            instance=Page(title='Parent', slug='parent'))
+        for title in ('Child1', 'Child2'):
+            self.parent_page.add_child(instance=Page(title=title, slug=title.lower()))
+
+    def test_page_children(self):
+        """ test_page_children, the children are returned a page at a time """
+        url = reverse('wagtailsnapshotpublisher_admin:page_children', args=[self.parent_page.id])
+        with mock.patch('wagtailsnapshotpublisher.views.CHILD_PAGES_PAGE_SIZE', 1):
+            content = self.client.get(url).json()['content']
+            self.assertEqual([page['title'] for page in content['pages']], ['Child1'])
+            self.assertEqual(content['next_page'], 2)
+
+            content = self.client.get(url, {'p': 2}).json()['content']
+            self.assertEqual([page['title'] for page in content['pages']], ['Child2'])
+            self.assertEqual(content['next_page'], None)
+
+
+class DocumentsApiTests(TestCase):
+    """ DocumentsApiTests """
+
+    def setUp(self):
+        """ setUp """
+        self.client = Client()
+        self.content_release = WSSPContentRelease(title='release1', site_code='site1', status=1)
+        self.content_release.save()
+        write_release_documents(self.content_release, [
+            ('page', '1', json.dumps({'title': 'Test1'}), {'content_hash': 'hash1'}),
+            ('page', '2', json.dumps({'title': 'Test2'}), {'content_hash': 'hash2'}),
+        ])
+
+    def test_get_documents_release(self):
+        """ test_get_documents_release, the documents are returned in the requested order """
+        url = reverse('wagtailsnapshotpublisher_api:documents_release',
+                      args=['site1', self.content_release.uuid])
+        response = self.client.get(url, {'document': ['page:2', 'page:3', 'page:1']})
+        content = response.json()
+        self.assertEqual(content['status'], 'success')
+        self.assertEqual(
+            [
+                (document['content_key'], document['status'], document.get('content'))
+                for document in content['content']
+            ],
+            [('2', 'success', {'title': 'Test2'}), ('3', 'error', None),
+             ('1', 'success', {'title': 'Test1'})],
+        )
+        self.assertEqual(content['content'][1]['error_code'], 'release_document_does_not_exist')
+
+    def test_get_documents_release_wrong_parameters(self):
+        """ test_get_documents_release_wrong_parameters """
+        url = reverse('wagtailsnapshotpublisher_api:documents_release',
+                      args=['site1', self.content_release.uuid])
+        self.assertEqual(self.client.get(url, {'document': 'page'}).json()['error_code'],
+                         'wrong_document_parameter')
+        self.assertEqual(self.client.get(url).json()['error_code'], 'wrong_number_of_documents')
+        with self.settings(WSSP_BATCH_MAX_DOCUMENTS=1):
+            self.assertEqual(
+                self.client.get(url, {'document': ['page:1', 'page:2']}).json()['error_code'],
+                'wrong_number_of_documents',
+            )
+
+    def test_export_release(self):
+        """ test_export_release, the documents are streamed one NDJSON line each """
+        url = reverse('wagtailsnapshotpublisher_api:release_export',
+                      args=['site1', self.content_release.uuid])
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(sorted(
+            (document['type'], document['key'], document['document'], document['parameters'])
+            for document in map(json.loads, lines)
+        ), [
+            ('page', '1', {'title': 'Test1'}, {'content_hash': 'hash1'}),
+            ('page', '2', {'title': 'Test2'}, {'content_hash': 'hash2'}),
+        ])
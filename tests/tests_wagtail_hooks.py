@@ -2,12 +2,16 @@
 .. module:: tests.tests_wagtail_hooks
 """
 
+import json
+
 from django.contrib.auth.models import User
 from django.test import Client, TestCase
 from django.test.client import RequestFactory
 from django.urls import reverse
 
-from wagtailsnapshotpublisher.models import WSSPContentRelease
+from djangosnapshotpublisher.models import ReleaseDocument
+
+from wagtailsnapshotpublisher.models import WSSPContentRelease, write_release_documents
 from wagtailsnapshotpublisher.wagtail_hooks import ReleaseButtonHelper, ReleaseAdmin
 
 
@@ -76,3 +80,102 @@ class AdminStreamFieldMetaClassTests(TestCase):
             status_code=200,
             html=True,
         )
+
+
+class ReleaseAdminTests(TestCase):
+    """ ReleaseAdminTests """
+
+    def setUp(self):
+        """ setUp """
+        self.admin_user = User.objects.create_superuser('admin', None, 'password')
+        self.client = Client()
+        self.client.force_login(self.admin_user)
+
+        for version_major, version_minor in ((1, 10), (2, 0), (1, 9)):
+            WSSPContentRelease(
+                title='release{}.{}'.format(version_major, version_minor),
+                site_code='site1',
+                version='{}.{}'.format(version_major, version_minor),
+                version_major=version_major,
+                version_minor=version_minor,
+                status=1,
+            ).save()
+
+    def test_order_by_version(self):
+        """ test_order_by_version, the versions are sorted as numbers """
+        url = reverse('wagtailsnapshotpublisher_wsspcontentrelease_modeladmin_index')
+        column = ReleaseAdmin.list_display.index('version_number')
+
+        response = self.client.get(url, {'o': str(column)})
+        self.assertEqual(
+            [release.version for release in response.context['object_list']],
+            ['1.9', '1.10', '2.0'],
+        )
+
+        response = self.client.get(url, {'o': '-{}'.format(column)})
+        self.assertEqual(
+            [release.version for release in response.context['object_list']],
+            ['2.0', '1.10', '1.9'],
+        )
+
+    def test_document_counts(self):
+        """
+        test_document_counts, the listing counts the documents of the releases and the pages
+        which aren't shared with the base release
+        """
+        base_release = WSSPContentRelease(title='base', site_code='site2', version='1.0', status=1)
+        base_release.save()
+        write_release_documents(base_release, [
+            ('page', '1', json.dumps({'title': 'Test1'}), {'content_hash': 'hash1'}),
+            ('page', '2', json.dumps({'title': 'Test2'}), {'content_hash': 'hash2'}),
+            ('test_model', '1', json.dumps({'name1': 'Test1'}), {'content_hash': 'hash3'}),
+        ])
+        content_release = WSSPContentRelease(
+            title='release',
+            site_code='site2',
+            version='1.1',
+            status=0,
+            use_current_live_as_base_release=False,
+            base_release=base_release,
+        )
+        content_release.save()
+        content_release.copy_document_release_ref_from_baserelease()
+        write_release_documents(content_release, [
+            ('page', '2', json.dumps({'title': 'Test2 changed'}), {'content_hash': 'hash4'}),
+            ('page', '3', json.dumps({'title': 'Test3'}), {'content_hash': 'hash5'}),
+            ('page', '4', json.dumps({'title': 'Test4'}), {'content_hash': 'hash6'}),
+        ])
+        ReleaseDocument.objects.filter(
+            id=content_release.release_documents.get(content_type='page', document_key='4').id,
+        ).update(deleted=True)
+
+        url = reverse('wagtailsnapshotpublisher_wsspcontentrelease_modeladmin_index')
+        response = self.client.get(url, {'site_code': 'site2'})
+        releases = {release.title: release for release in response.context['object_list']}
+        self.assertEqual(releases['base'].document_count, 3)
+        self.assertEqual(releases['release'].document_count, 4)
+        # page 2 changed, pages 3 and 4 added, even if page 4 is deleted
+        self.assertEqual(releases['release'].pages_changed, 3)
+
+    def test_stage_releases_loaded_once(self):
+        """ test_stage_releases_loaded_once, the listing doesn't query the stage release per site """
+        stage_releases = {}
+        for site_code in ('site2', 'site3'):
+            stage_releases[site_code] = WSSPContentRelease(
+                title='stage {}'.format(site_code),
+                site_code=site_code,
+                version='1.0',
+                status=1,
+                is_stage=True,
+            )
+            stage_releases[site_code].save()
+
+        url = reverse('wagtailsnapshotpublisher_wsspcontentrelease_modeladmin_index')
+        response = self.client.get(url)
+        view = response.context['view']
+
+        with self.assertNumQueries(0):
+            button_helper = ReleaseButtonHelper(view, response.wsgi_request)
+            self.assertEqual(button_helper.get_stage_release('site2'), stage_releases['site2'])
+            self.assertEqual(button_helper.get_stage_release('site3'), stage_releases['site3'])
+            self.assertIsNone(button_helper.get_stage_release('site1'))
@@ -8,6 +8,19 @@ from . import views
 
 app_name = 'wagtailsnapshotpublisher_api'
 urlpatterns = [
+    path('<slug:site_code>/documents/', views.get_documents_release,
+         name='live_documents_release'),
+    path('<slug:site_code>/<uuid:content_release_uuid>/documents/', views.get_documents_release,
+         name='documents_release'),
+    path('<slug:site_code>/export/', views.export_release, name='live_release_export'),
+    path('<slug:site_code>/stats/', views.get_publish_stats, name='publish_stats'),
+    path('<slug:site_code>/<uuid:content_release_uuid>/export/', views.export_release,
+         name='release_export'),
+    path('<slug:site_code>/<uuid:content_release_uuid>/diff/<slug:content_type>/<slug:content_key>/',
+         views.get_document_diff, name='live_document_diff'),
+    path('<slug:site_code>/<uuid:content_release_uuid>/diff/<uuid:compare_to_uuid>/'
+         '<slug:content_type>/<slug:content_key>/',
+         views.get_document_diff, name='document_diff'),
     path('<slug:site_code>/<slug:content_type>/<slug:content_key>/', views.get_document_release,
          name='live_document_release_page'),
     path('<slug:site_code>/<uuid:content_release_uuid>/<slug:content_type>/<slug:content_key>/',
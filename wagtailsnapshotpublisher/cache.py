@@ -0,0 +1,435 @@
+"""
+.. module:: wagtailsnapshotpublisher.cache
+"""
+
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+
+DOCUMENT_CACHE_KEY = 'wssp:document:{site_code}:{release_uuid}:{content_type}:{content_key}'
+DOCUMENT_VERSION_CACHE_KEY = 'wssp:document_version:{site_code}:{release_uuid}:{content_type}:{content_key}'
+RELEASE_GENERATION_CACHE_KEY = 'wssp:release:{release_uuid}:generation'
+RELEASE_WATERMARK_CACHE_KEY = 'wssp:release:{release_uuid}:watermark'
+RELEASE_POINTER_CACHE_KEY = 'wssp:release_pointer:{site_code}'
+SKIPPED_PUBLISH_CACHE_KEY = 'wssp:skipped_publish:{site_code}'
+COMPARISON_CACHE_KEY = 'wssp:comparison_refs:{release_uuid}:{compare_to_uuid}:{watermark}'
+DEFAULT_DOCUMENT_CACHE_TIMEOUT = 60 * 60 * 24
+DEFAULT_RELEASE_POINTER_LOCAL_TIMEOUT = 5
+
+# site_code => (expire time, release pointer)
+local_release_pointers = {}
+
+# site_code => number of unchanged documents not published again by this process
+local_skipped_publishes = {}
+
+
+def get_document_cache():
+    """ get_document_cache, return None if the document cache is disabled """
+    alias = getattr(settings, 'WSSP_DOCUMENT_CACHE', None)
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def get_document_cache_key(site_code, release_uuid, content_type, content_key):
+    """ get_document_cache_key """
+    return DOCUMENT_CACHE_KEY.format(
+        site_code=site_code,
+        release_uuid=release_uuid,
+        content_type=content_type,
+        content_key=content_key,
+    )
+
+
+def get_document_version_cache_key(site_code, release_uuid, content_type, content_key):
+    """ get_document_version_cache_key """
+    return DOCUMENT_VERSION_CACHE_KEY.format(
+        site_code=site_code,
+        release_uuid=release_uuid,
+        content_type=content_type,
+        content_key=content_key,
+    )
+
+
+def get_release_generation(release_uuid):
+    """
+    get_release_generation
+    Token shared by all the cached documents with dynamic elements of a release, replacing it
+    invalidates all of them at once.
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return None
+
+    key = RELEASE_GENERATION_CACHE_KEY.format(release_uuid=release_uuid)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def get_release_watermark(release_uuid):
+    """
+    get_release_watermark
+    Token replaced each time a document is published, unpublished or removed from the release
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return None
+
+    key = RELEASE_WATERMARK_CACHE_KEY.format(release_uuid=release_uuid)
+    watermark = cache.get(key)
+    if watermark is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        watermark = cache.get(key)
+    return watermark
+
+
+def get_document_version(site_code, release_uuid, content_type, content_key):
+    """
+    get_document_version
+    Version of the document replaced each time it is invalidated, to read before loading the
+    document and to pass to cache_document. It is created if missing so a version evicted from
+    the cache is never reused.
+    """
+    return get_document_versions(site_code, release_uuid, [(content_type, content_key)]).get(
+        (content_type, content_key))
+
+
+def get_document_versions(site_code, release_uuid, document_refs):
+    """
+    get_document_versions
+    document_refs is a list of (content_type, content_key), return a dict with their version
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return {}
+
+    version_keys = {
+        get_document_version_cache_key(site_code, release_uuid, content_type, content_key): (
+            content_type, content_key)
+        for content_type, content_key in document_refs
+    }
+    values = cache.get_many(list(version_keys))
+    missing_keys = [key for key in version_keys if values.get(key) is None]
+    if missing_keys:
+        for key in missing_keys:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+        values.update(cache.get_many(missing_keys))
+    return {document_ref: values.get(key) for key, document_ref in version_keys.items()}
+
+
+def is_cached_document_valid(entry, version, generation):
+    """
+    is_cached_document_valid
+    The entries cached before an invalidation have an older version, the ones with dynamic
+    elements also need the current generation of the release
+    """
+    if entry is None or entry.get('version') != version:
+        return False
+    return not entry['dynamic'] or entry['generation'] == generation
+
+
+def get_cached_document(site_code, release_uuid, content_type, content_key):
+    """ get_cached_document """
+    cache = get_document_cache()
+    if cache is None:
+        return None
+
+    document_key = get_document_cache_key(site_code, release_uuid, content_type, content_key)
+    version_key = get_document_version_cache_key(
+        site_code, release_uuid, content_type, content_key)
+    generation_key = RELEASE_GENERATION_CACHE_KEY.format(release_uuid=release_uuid)
+    values = cache.get_many([document_key, version_key, generation_key])
+
+    entry = values.get(document_key)
+    if not is_cached_document_valid(entry, values.get(version_key), values.get(generation_key)):
+        return None
+    return entry
+
+
+def get_cached_documents(site_code, release_uuid, document_refs):
+    """
+    get_cached_documents
+    document_refs is a list of (content_type, content_key), return a dict of the cached ones
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return {}
+
+    document_keys = {
+        (content_type, content_key): (
+            get_document_cache_key(site_code, release_uuid, content_type, content_key),
+            get_document_version_cache_key(site_code, release_uuid, content_type, content_key),
+        )
+        for content_type, content_key in document_refs
+    }
+    generation_key = RELEASE_GENERATION_CACHE_KEY.format(release_uuid=release_uuid)
+    values = cache.get_many(
+        [key for keys in document_keys.values() for key in keys] + [generation_key])
+
+    cached_documents = {}
+    for document_ref, (document_key, version_key) in document_keys.items():
+        entry = values.get(document_key)
+        if is_cached_document_valid(entry, values.get(version_key), values.get(generation_key)):
+            cached_documents[document_ref] = entry
+    return cached_documents
+
+
+def cache_document(site_code, release_uuid, content_type, content_key, data, dynamic=False,
+                   generation=None, version=None):
+    """
+    cache_document
+    generation and version must be read before loading the document, a document loaded before
+    an invalidation is then never served from the cache
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return None
+
+    entry = {
+        'data': data,
+        'dynamic': dynamic,
+        'generation': generation,
+        'version': version,
+    }
+    cache.set(
+        get_document_cache_key(site_code, release_uuid, content_type, content_key),
+        entry,
+        timeout=getattr(settings, 'WSSP_DOCUMENT_CACHE_TIMEOUT', DEFAULT_DOCUMENT_CACHE_TIMEOUT),
+    )
+    return entry
+
+
+def invalidate_cached_release(release_uuid):
+    """ invalidate_cached_release, drop every cached document with dynamic elements """
+    cache = get_document_cache()
+    if cache is None:
+        return
+
+    cache.set(
+        RELEASE_GENERATION_CACHE_KEY.format(release_uuid=release_uuid),
+        uuid.uuid4().hex,
+        timeout=None,
+    )
+
+
+def invalidate_cached_document(site_code, release_uuid, content_type, content_key):
+    """ invalidate_cached_document """
+    invalidate_cached_documents(site_code, release_uuid, [(content_type, content_key)])
+
+
+def invalidate_cached_documents(site_code, release_uuid, document_refs):
+    """
+    invalidate_cached_documents
+    document_refs is a list of (content_type, content_key), the version of each document is
+    replaced so the entries cached by the requests still loading them are ignored
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return
+
+    cache.set_many({
+        get_document_version_cache_key(site_code, release_uuid, content_type, content_key):
+            uuid.uuid4().hex
+        for content_type, content_key in document_refs
+    }, timeout=None)
+    cache.delete_many([
+        get_document_cache_key(site_code, release_uuid, content_type, content_key)
+        for content_type, content_key in document_refs
+    ])
+    invalidate_cached_comparisons(release_uuid)
+
+
+def invalidate_cached_comparisons(release_uuid):
+    """
+    invalidate_cached_comparisons
+    replace the watermark of the release, the comparisons with the release are built again
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return
+
+    cache.set(
+        RELEASE_WATERMARK_CACHE_KEY.format(release_uuid=release_uuid),
+        uuid.uuid4().hex,
+        timeout=None,
+    )
+
+
+def get_comparison_cache_key(release_uuid, compare_to_uuid, release_uuids):
+    """
+    get_comparison_cache_key
+    The key includes the watermark of all the release_uuids (the compared releases and the base
+    releases they read through), publishing, unpublishing or removing a document from one of
+    them changes the key. return None if the document cache is disabled.
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return None
+
+    watermarks = [
+        '{}:{}'.format(uuid_, get_release_watermark(uuid_)) for uuid_ in sorted(map(str, release_uuids))]
+    return COMPARISON_CACHE_KEY.format(
+        release_uuid=release_uuid,
+        compare_to_uuid=compare_to_uuid,
+        watermark=hashlib.sha1(','.join(watermarks).encode('utf-8')).hexdigest(),
+    )
+
+
+def get_cached_comparison(cache_key):
+    """ get_cached_comparison """
+    cache = get_document_cache()
+    if cache is None or cache_key is None:
+        return None
+    return cache.get(cache_key)
+
+
+def cache_comparison(cache_key, comparison):
+    """ cache_comparison """
+    cache = get_document_cache()
+    if cache is None or cache_key is None:
+        return
+    cache.set(
+        cache_key,
+        comparison,
+        timeout=getattr(settings, 'WSSP_DOCUMENT_CACHE_TIMEOUT', DEFAULT_DOCUMENT_CACHE_TIMEOUT),
+    )
+
+
+def build_release_pointer(site_code):
+    """
+    build_release_pointer
+    The pointer is valid until the next frozen release of the site reaches its publish datetime.
+    """
+    from .models import WSSPContentRelease
+
+    pointer = {
+        'live': None,
+        'stage': None,
+        'valid_until': WSSPContentRelease.objects.filter(
+            site_code=site_code,
+            status=1,
+            publish_datetime__gt=timezone.now(),
+        ).order_by('publish_datetime').values_list('publish_datetime', flat=True).first(),
+    }
+    pointer['live'] = load_live_release(site_code)
+    pointer['stage'] = load_stage_release(site_code)
+    return pointer
+
+
+def load_live_release(site_code):
+    """ load_live_release, from the database, return None if the site doesn't have any """
+    from .models import WSSPContentRelease
+
+    try:
+        return WSSPContentRelease.objects.live(site_code=site_code)
+    except WSSPContentRelease.DoesNotExist:
+        return None
+
+
+def load_stage_release(site_code):
+    """ load_stage_release, from the database, return None if the site doesn't have any """
+    from .models import WSSPContentRelease
+
+    try:
+        return WSSPContentRelease.objects.stage(site_code=site_code)
+    except WSSPContentRelease.DoesNotExist:
+        return None
+
+
+def is_release_pointer_valid(pointer):
+    """ is_release_pointer_valid """
+    return pointer['valid_until'] is None or pointer['valid_until'] > timezone.now()
+
+
+def set_local_release_pointer(site_code, pointer):
+    """ set_local_release_pointer """
+    local_timeout = getattr(settings, 'WSSP_RELEASE_POINTER_LOCAL_TIMEOUT',
+                            DEFAULT_RELEASE_POINTER_LOCAL_TIMEOUT)
+    local_release_pointers[site_code] = (time.monotonic() + local_timeout, pointer)
+
+
+def get_release_pointer(site_code):
+    """
+    get_release_pointer
+    return a dict with the live and stage releases of the site (None if there isn't any), kept
+    in process for WSSP_RELEASE_POINTER_LOCAL_TIMEOUT seconds and in the document cache. The
+    releases are shared between the requests and must not be modified. Without document cache
+    the releases are loaded from the database each time.
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return {
+            'live': load_live_release(site_code),
+            'stage': load_stage_release(site_code),
+            'valid_until': None,
+        }
+
+    expire_time, pointer = local_release_pointers.get(site_code, (0, None))
+    if pointer is not None and expire_time > time.monotonic() and \
+            is_release_pointer_valid(pointer):
+        return pointer
+
+    pointer = cache.get(RELEASE_POINTER_CACHE_KEY.format(site_code=site_code))
+    if pointer is None or not is_release_pointer_valid(pointer):
+        return refresh_release_pointer(site_code)
+    set_local_release_pointer(site_code, pointer)
+    return pointer
+
+
+def get_live_release(site_code):
+    """
+    get_live_release
+    return the live release of the site (None if there isn't any) from the release pointer, only
+    the live release is loaded when the document cache is disabled
+    """
+    if get_document_cache() is None:
+        return load_live_release(site_code)
+    return get_release_pointer(site_code)['live']
+
+
+def refresh_release_pointer(site_code):
+    """ refresh_release_pointer, to call when the live or stage release of the site changed """
+    pointer = build_release_pointer(site_code)
+    cache = get_document_cache()
+    if cache is not None:
+        cache.set(RELEASE_POINTER_CACHE_KEY.format(site_code=site_code), pointer, timeout=None)
+        set_local_release_pointer(site_code, pointer)
+    return pointer
+
+
+def increment_skipped_publishes(site_code):
+    """
+    increment_skipped_publishes
+    Count the unchanged documents not published again, in process and in the document cache
+    """
+    local_skipped_publishes[site_code] = local_skipped_publishes.get(site_code, 0) + 1
+
+    cache = get_document_cache()
+    if cache is None:
+        return
+    key = SKIPPED_PUBLISH_CACHE_KEY.format(site_code=site_code)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def get_skipped_publishes(site_code):
+    """
+    get_skipped_publishes
+    return the number of unchanged documents of the site not published again, for all the
+    processes when the document cache is enabled
+    """
+    cache = get_document_cache()
+    if cache is None:
+        return local_skipped_publishes.get(site_code, 0)
+    return cache.get(SKIPPED_PUBLISH_CACHE_KEY.format(site_code=site_code), 0)
@@ -10,6 +10,11 @@ from . import views
 # Override Wagtail paths
 app_name = 'wagtailsnapshotpublisher_admin'
 urlpatterns = [
+    path('pages/publish/<int:release_id>/', views.publish_pages,
+         name='publish_pages_to_release'),
+    path('pages/<int:page_id>/children/', views.page_children, name='page_children'),
+    path('pages/<int:page_id>/publish/<int:release_id>/recursively/',
+         views.publish_recursively_page, name='publish_recursively_page_to_release'),
     path('pages/<int:page_id>/unpublish/<int:release_id>/', views.unpublish_page,
          name='unpublish_page_from_release'),
     path('pages/<int:page_id>/unpublish/<int:release_id>/recursively/',
@@ -28,6 +33,12 @@ urlpatterns = [
 
     path('wagtailsnapshotpublisher/wsspcontentrelease/details/<int:release_id>/',
          views.release_detail, name='release_detail'),
+    path('wagtailsnapshotpublisher/wsspcontentrelease/details/<int:release_id>/compare/'
+         '<int:release_id_to_compare_to>/<slug:content_type>/<str:document_key>/',
+         views.release_compare_document, name='release_compare_document'),
+    path('wagtailsnapshotpublisher/wsspcontentrelease/details/<int:release_id>/diff/'
+         '<int:release_id_to_compare_to>/<slug:content_type>/<str:document_key>/',
+         views.release_document_diff, name='release_document_diff'),
     path('wagtailsnapshotpublisher/wsspcontentrelease/reindex/<int:release_id>/',
          views.release_reindex, name='reindex'),
     path('wagtailsnapshotpublisher/wsspcontentrelease/setstage/<int:release_id>/',
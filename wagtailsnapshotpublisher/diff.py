@@ -0,0 +1,364 @@
+"""
+.. module:: wagtailsnapshotpublisher.diff
+"""
+
+import hashlib
+import json
+
+from django.utils.translation import ugettext_lazy as _
+
+from djangosnapshotpublisher.models import ReleaseDocument
+
+from .models import (
+    DOCUMENT_REFS_CHUNK_SIZE, get_documents_filter, get_overlay_documents, is_materialized_release,
+    is_overlay_release, iter_release_document_ids,
+)
+from .utils import chunked
+
+
+DEFAULT_MAX_CHANGES = 200
+
+
+def get_subtree_hashes(data):
+    """
+    get_subtree_hashes
+    return a dict id(node) => hash for all the dicts and lists of data, the hash of a node is
+    built from the hashes of its children so each node is hashed once
+    """
+    hashes = {}
+
+    def get_hash(node):
+        """ get_hash """
+        if isinstance(node, dict):
+            digest = hashlib.sha1(b'{')
+            for key in sorted(node):
+                digest.update(json.dumps(key).encode('utf-8'))
+                digest.update(get_hash(node[key]))
+        elif isinstance(node, (list, tuple)):
+            digest = hashlib.sha1(b'[')
+            for value in node:
+                digest.update(get_hash(value))
+        else:
+            return hashlib.sha1(json.dumps(node).encode('utf-8')).digest()
+        hashes[id(node)] = digest.digest()
+        return hashes[id(node)]
+
+    get_hash(data)
+    return hashes
+
+
+def is_block_list(node):
+    """ is_block_list, StreamField blocks are matched by id rather than by position """
+    return bool(node) and all(isinstance(value, dict) and 'id' in value for value in node)
+
+
+class DocumentDiff:
+    """
+    DocumentDiff
+    Structural diff of two documents, the subtrees with the same hash are skipped. The changes
+    are dicts with the path of the value, the operation (added, removed or changed) and the
+    values before (from) and after (to).
+    """
+
+    def __init__(self, data_from, data_to, max_changes=DEFAULT_MAX_CHANGES):
+        self.hashes_from = get_subtree_hashes(data_from)
+        self.hashes_to = get_subtree_hashes(data_to)
+        self.max_changes = max_changes
+        self.changes = []
+        self.truncated = False
+        self.diff(data_from, data_to, [])
+
+    def add_change(self, path, operation, value_from=None, value_to=None):
+        """ add_change """
+        if len(self.changes) >= self.max_changes:
+            self.truncated = True
+            return
+        change = {'path': path, 'operation': operation}
+        if operation != 'added':
+            change['from'] = value_from
+        if operation != 'removed':
+            change['to'] = value_to
+        self.changes.append(change)
+
+    def diff(self, node_from, node_to, path):
+        """ diff """
+        if self.truncated:
+            return
+
+        hash_from = self.hashes_from.get(id(node_from))
+        if hash_from is not None and hash_from == self.hashes_to.get(id(node_to)):
+            return
+
+        if isinstance(node_from, dict) and isinstance(node_to, dict):
+            for key in node_from:
+                if key not in node_to:
+                    self.add_change(path + [key], 'removed', value_from=node_from[key])
+            for key, value in node_to.items():
+                if key not in node_from:
+                    self.add_change(path + [key], 'added', value_to=value)
+                else:
+                    self.diff(node_from[key], value, path + [key])
+        elif isinstance(node_from, list) and isinstance(node_to, list):
+            if is_block_list(node_from) and is_block_list(node_to):
+                self.diff_blocks(node_from, node_to, path)
+            else:
+                for index, value in enumerate(node_to):
+                    if index < len(node_from):
+                        self.diff(node_from[index], value, path + [index])
+                    else:
+                        self.add_change(path + [index], 'added', value_to=value)
+                for index in range(len(node_to), len(node_from)):
+                    self.add_change(path + [index], 'removed', value_from=node_from[index])
+        elif type(node_from) != type(node_to) or node_from != node_to:
+            self.add_change(path, 'changed', value_from=node_from, value_to=node_to)
+
+    def diff_blocks(self, blocks_from, blocks_to, path):
+        """ diff_blocks, the paths use the position of the blocks in the document to """
+        blocks_from_by_id = {block['id']: block for block in blocks_from}
+        block_ids_to = {block['id'] for block in blocks_to}
+        for index, block in enumerate(blocks_from):
+            if block['id'] not in block_ids_to:
+                self.add_change(path + [index], 'removed', value_from=block)
+        for index, block in enumerate(blocks_to):
+            block_from = blocks_from_by_id.get(block['id'])
+            if block_from is None:
+                self.add_change(path + [index], 'added', value_to=block)
+            else:
+                self.diff(block_from, block, path + [index])
+
+
+def diff_documents(data_from, data_to, max_changes=DEFAULT_MAX_CHANGES):
+    """ diff_documents, return a dict with the changes and if they have been truncated """
+    document_diff = DocumentDiff(data_from, data_to, max_changes)
+    return {
+        'changes': document_diff.changes,
+        'truncated': document_diff.truncated,
+    }
+
+
+def get_release_document_ids(content_release, document_refs):
+    """
+    get_release_document_ids
+    return a dict of (content_type, document_key) => id of the documents of document_refs in the
+    release, the documents aren't loaded
+    """
+    if is_overlay_release(content_release):
+        return {
+            document_ref: release_document.id
+            for document_ref, release_document in get_overlay_documents(
+                content_release, document_refs, prefetch_parameters=False, fields=()).items()
+        }
+    return {
+        (content_type, document_key): document_id
+        for content_type, document_key, document_id in content_release.release_documents.filter(
+            get_documents_filter(document_refs),
+            deleted=False,
+        ).values_list('content_type', 'document_key', 'id')
+    }
+
+
+def get_resolved_documents_json(content_release, document_ids):
+    """
+    get_resolved_documents_json
+    document_ids is a dict of (content_type, document_key) => id, return a dict of
+    (content_type, document_key) => document_json, read from the materialized documents of the
+    release if it has them
+    """
+    documents_json = {}
+    if is_materialized_release(content_release):
+        documents_json.update({
+            (content_type, document_key): document_json
+            for content_type, document_key, document_json in
+            content_release.materialized_documents.filter(
+                get_documents_filter(list(document_ids)),
+            ).values_list('content_type', 'document_key', 'document_json')
+        })
+
+    missing_ids = {
+        document_ref: document_id for document_ref, document_id in document_ids.items()
+        if document_ref not in documents_json
+    }
+    if missing_ids:
+        release_documents_json = dict(ReleaseDocument.objects.filter(
+            id__in=missing_ids.values(),
+        ).values_list('id', 'document_json'))
+        for document_ref, document_id in missing_ids.items():
+            documents_json[document_ref] = release_documents_json[document_id]
+    return documents_json
+
+
+def get_changed_document_refs(content_release, content_release_compare_to, document_pairs):
+    """
+    get_changed_document_refs
+    document_pairs is a dict of (content_type, document_key) => (id, id_compare_to), return the
+    refs of the documents which changed. The documents with different content_hash have changed.
+    The dynamic elements are resolved again (refresh_dynamic_documents, materialization) without
+    changing the content_hash, so the document_json of the documents with dynamic elements and
+    the same content_hash is compared.
+    """
+    materialized = is_materialized_release(content_release) or \
+        is_materialized_release(content_release_compare_to)
+    document_ids = {
+        document_id for document_pair in document_pairs.values() for document_id in document_pair}
+    parameters = {document_id: {} for document_id in document_ids}
+    for document_id, key, content in ReleaseDocument.objects.filter(
+            id__in=document_ids,
+            parameters__key__in=('content_hash', 'have_dynamic_elements'),
+    ).values_list('id', 'parameters__key', 'parameters__content'):
+        parameters[document_id][key] = content
+
+    changed_refs = set()
+    dynamic_pairs = {}
+    for document_ref, (document_id, document_id_compare_to) in document_pairs.items():
+        # a document shared by both releases only differs by its materialized document
+        if document_id == document_id_compare_to and not materialized:
+            continue
+        content_hash = parameters[document_id].get('content_hash')
+        if document_id != document_id_compare_to and (
+                content_hash is None or
+                content_hash != parameters[document_id_compare_to].get('content_hash')):
+            changed_refs.add(document_ref)
+        elif parameters[document_id].get('have_dynamic_elements') == 'True':
+            dynamic_pairs[document_ref] = (document_id, document_id_compare_to)
+
+    if dynamic_pairs:
+        documents_json = get_resolved_documents_json(content_release, {
+            document_ref: document_id
+            for document_ref, (document_id, document_id_compare_to) in dynamic_pairs.items()
+        })
+        documents_json_compare_to = get_resolved_documents_json(content_release_compare_to, {
+            document_ref: document_id_compare_to
+            for document_ref, (document_id, document_id_compare_to) in dynamic_pairs.items()
+        })
+        changed_refs.update(
+            document_ref for document_ref in dynamic_pairs
+            if documents_json[document_ref] != documents_json_compare_to[document_ref]
+        )
+    return changed_refs
+
+
+def get_comparison_refs(content_release, content_release_compare_to,
+                        chunk_size=DOCUMENT_REFS_CHUNK_SIZE):
+    """
+    get_comparison_refs
+    Same comparison as PublisherAPI.compare_content_releases but the documents of both releases
+    are resolved through their chains, so the documents an overlay release inherits from its
+    base releases aren't reported as added or removed. Only the ids and the content_hash of the
+    documents (and the document_json of the documents with dynamic elements and the same
+    content_hash) are read, chunk_size documents at a time, return the (diff, content_type,
+    document_key, id, id_compare_to) of the documents added, changed and removed, the items of
+    the comparison are built with get_comparison_items.
+    """
+    added = []
+    changed = []
+    removed = []
+
+    for chunk in chunked(iter_release_document_ids(content_release, chunk_size), chunk_size):
+        document_ids_compare_to = get_release_document_ids(content_release_compare_to, [
+            (content_type, document_key) for content_type, document_key, document_id in chunk
+        ])
+        changed_refs = get_changed_document_refs(content_release, content_release_compare_to, {
+            (content_type, document_key): (
+                document_id, document_ids_compare_to[(content_type, document_key)])
+            for content_type, document_key, document_id in chunk
+            if (content_type, document_key) in document_ids_compare_to
+        })
+        for content_type, document_key, document_id in chunk:
+            document_id_compare_to = document_ids_compare_to.get((content_type, document_key))
+            if document_id_compare_to is None:
+                added.append(('Added', content_type, document_key, document_id, None))
+            elif (content_type, document_key) in changed_refs:
+                changed.append(
+                    ('Changed', content_type, document_key, document_id, document_id_compare_to))
+
+    for chunk in chunked(
+            iter_release_document_ids(content_release_compare_to, chunk_size), chunk_size):
+        document_ids = get_release_document_ids(content_release, [
+            (content_type, document_key) for content_type, document_key, document_id in chunk
+        ])
+        for content_type, document_key, document_id in chunk:
+            if (content_type, document_key) not in document_ids:
+                removed.append(('Removed', content_type, document_key, None, document_id))
+
+    return added + changed + removed
+
+
+def get_comparison_items(comparison_refs):
+    """
+    get_comparison_items
+    return the items of the comparison for comparison_refs (a page of get_comparison_refs),
+    only the parameters of these documents are loaded
+    """
+    document_ids = set()
+    for diff, content_type, document_key, document_id, document_id_compare_to in comparison_refs:
+        document_ids.update({document_id, document_id_compare_to} - {None})
+
+    parameters = {document_id: {} for document_id in document_ids}
+    for document_id, key, content in ReleaseDocument.objects.filter(
+            id__in=document_ids,
+            parameters__isnull=False,
+    ).values_list('id', 'parameters__key', 'parameters__content'):
+        parameters[document_id][key] = content
+
+    items = []
+    for diff, content_type, document_key, document_id, document_id_compare_to in comparison_refs:
+        item = {'document_key': document_key, 'content_type': content_type, 'diff': diff}
+        if diff == 'Added':
+            item['parameters'] = parameters[document_id]
+        elif diff == 'Removed':
+            item['parameters'] = parameters[document_id_compare_to]
+        else:
+            item['parameters'] = {
+                'release_from': parameters[document_id],
+                'release_compare_to': parameters[document_id_compare_to],
+            }
+        items.append(item)
+    return items
+
+
+def compare_releases(content_release, content_release_compare_to,
+                     chunk_size=DOCUMENT_REFS_CHUNK_SIZE):
+    """ compare_releases, return all the items of the comparison of the releases """
+    return get_comparison_items(
+        get_comparison_refs(content_release, content_release_compare_to, chunk_size))
+
+
+def diff_release_documents(content_release, content_release_compare_to, content_type,
+                           document_key, max_changes=DEFAULT_MAX_CHANGES):
+    """
+    diff_release_documents
+    Changes of a document from content_release_compare_to to content_release, the documents
+    which haven't changed (see get_changed_document_refs) are not parsed.
+    """
+    document_ref = (content_type, str(document_key))
+    document_ids_from = get_release_document_ids(content_release_compare_to, [document_ref])
+    document_ids_to = get_release_document_ids(content_release, [document_ref])
+    if not document_ids_from and not document_ids_to:
+        return {
+            'status': 'error',
+            'error_code': 'release_document_does_not_exist',
+            'error_msg': _('ReleaseDocument does not exist'),
+        }
+
+    content = {'changes': [], 'truncated': False}
+    if not document_ids_from:
+        content['changes'].append({
+            'path': [], 'operation': 'added', 'to': json.loads(get_resolved_documents_json(
+                content_release, document_ids_to)[document_ref])})
+    elif not document_ids_to:
+        content['changes'].append({
+            'path': [], 'operation': 'removed', 'from': json.loads(get_resolved_documents_json(
+                content_release_compare_to, document_ids_from)[document_ref])})
+    elif get_changed_document_refs(content_release, content_release_compare_to, {
+            document_ref: (document_ids_to[document_ref], document_ids_from[document_ref])}):
+        content = diff_documents(
+            json.loads(get_resolved_documents_json(
+                content_release_compare_to, document_ids_from)[document_ref]),
+            json.loads(get_resolved_documents_json(content_release, document_ids_to)[document_ref]),
+            max_changes,
+        )
+
+    return {
+        'status': 'success',
+        'content': content,
+    }
@@ -0,0 +1,42 @@
+"""
+.. module:: wagtailsnapshotpublisher.management.commands.export_release
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wagtailsnapshotpublisher.views import get_content_release, get_release_document_lines
+
+
+class Command(BaseCommand):
+    """ Command """
+    help = 'Export all the documents of a release as NDJSON'
+
+    def add_arguments(self, parser):
+        """ add_arguments """
+        parser.add_argument('site_code')
+        parser.add_argument(
+            'release_uuid',
+            nargs='?',
+            default=None,
+            help='Release to export, the live release if not set',
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write the documents to, stdout if not set',
+        )
+
+    def handle(self, *args, **options):
+        """ handle """
+        response = get_content_release(options['site_code'], options['release_uuid'])
+        if response['status'] == 'error':
+            raise CommandError(response['error_msg'])
+        if response['content'] is None:
+            raise CommandError('ContentRelease does not exist')
+
+        lines = get_release_document_lines(response['content'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
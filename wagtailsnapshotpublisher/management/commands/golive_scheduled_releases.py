@@ -0,0 +1,117 @@
+"""
+.. module:: wagtailsnapshotpublisher.management.commands.golive_scheduled_releases
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from wagtailsnapshotpublisher.cache import refresh_release_pointer
+from wagtailsnapshotpublisher.models import (
+    WSSPContentRelease, is_materialized_release, materialize_release,
+)
+from wagtailsnapshotpublisher.views import warm_release_cache
+
+
+class Command(BaseCommand):
+    """ Command """
+    help = 'Prepare the frozen releases before their publish datetime and switch the live ' \
+           'release pointer when they go live'
+
+    def add_arguments(self, parser):
+        """ add_arguments """
+        parser.add_argument(
+            '--site-code',
+            action='append',
+            dest='site_codes',
+            help='Site to watch, all the sites if not set (can be repeated)',
+        )
+        parser.add_argument(
+            '--lead-time',
+            type=float,
+            default=300,
+            help='Seconds before the publish datetime when a release is prepared',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help='Maximum number of seconds to wait between two checks',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Prepare the releases within the lead time, switch them live then exit',
+        )
+
+    def get_scheduled_releases(self, site_codes, lead_time):
+        """ get_scheduled_releases """
+        now = timezone.now()
+        releases = WSSPContentRelease.objects.filter(
+            status=1,
+            publish_datetime__gt=now,
+            publish_datetime__lte=now + timedelta(seconds=lead_time),
+        ).order_by('publish_datetime')
+        if site_codes:
+            releases = releases.filter(site_code__in=site_codes)
+        return list(releases)
+
+    def prepare_release(self, release):
+        """ prepare_release, materialize the release and warm the document cache """
+        if is_materialized_release(release) and not release.materialized_documents.exists():
+            materialize_release(release)
+        count = warm_release_cache(release)
+        self.stdout.write('release {} ({}) prepared, {} documents cached, live at {}'.format(
+            release.uuid, release.site_code, count, release.publish_datetime))
+
+    def switch_release(self, release):
+        """
+        switch_release
+        The live release is resolved from the database at query time, the pointer is built again
+        until the release is seen live and then shared with the other processes in one write.
+        """
+        try:
+            current = WSSPContentRelease.objects.get(id=release.id)
+        except WSSPContentRelease.DoesNotExist:
+            return
+        if current.status != 1 or current.publish_datetime != release.publish_datetime:
+            self.stdout.write('release {} was rescheduled'.format(release.uuid))
+            return
+
+        for attempt in range(10):
+            pointer = refresh_release_pointer(release.site_code)
+            if pointer['live'] is not None and pointer['live'].id == release.id:
+                self.stdout.write('release {} ({}) is live'.format(release.uuid, release.site_code))
+                return
+            time.sleep(0.1)
+        self.stderr.write('release {} ({}) is not live after its publish datetime'.format(
+            release.uuid, release.site_code))
+
+    def handle(self, *args, **options):
+        """ handle """
+        # (release id, publish datetime) => release prepared and waiting for its publish datetime
+        prepared_releases = {}
+        while True:
+            for release in self.get_scheduled_releases(options['site_codes'], options['lead_time']):
+                key = (release.id, release.publish_datetime)
+                if key not in prepared_releases:
+                    self.prepare_release(release)
+                    prepared_releases[key] = release
+
+            now = timezone.now()
+            for key, release in sorted(prepared_releases.items(), key=lambda item: item[0][1]):
+                if release.publish_datetime <= now:
+                    self.switch_release(release)
+                    del prepared_releases[key]
+
+            if options['once'] and not prepared_releases:
+                break
+
+            delay = options['sleep']
+            if prepared_releases:
+                next_publish_datetime = min(publish_datetime for release_id, publish_datetime in prepared_releases)
+                delay = min(delay, (next_publish_datetime - timezone.now()).total_seconds())
+            if delay > 0:
+                time.sleep(delay)
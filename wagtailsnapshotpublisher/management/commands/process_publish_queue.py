@@ -0,0 +1,77 @@
+"""
+.. module:: wagtailsnapshotpublisher.management.commands.process_publish_queue
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from wagtailsnapshotpublisher.models import PublishJob, process_publish_job
+
+
+class Command(BaseCommand):
+    """ Command """
+    help = 'Publish the page revisions waiting in the publish queue (WSSP_DEFERRED_PUBLISH)'
+
+    def add_arguments(self, parser):
+        """ add_arguments """
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the queue then exit instead of polling it',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help='Seconds to wait when the queue is empty',
+        )
+        parser.add_argument(
+            '--max-sleep',
+            type=float,
+            default=300,
+            help='Most seconds to wait when all the jobs of a batch failed, the wait is doubled '
+                 'after each batch which failed',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of jobs loaded at a time',
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=5,
+            help='Jobs which failed this number of times are left in the queue',
+        )
+
+    def handle(self, *args, **options):
+        """ handle """
+        failed_batches = 0
+        while True:
+            jobs = list(PublishJob.objects.filter(
+                attempts__lt=options['max_attempts'],
+            ).select_related(
+                'revision', 'content_release',
+            ).order_by('updated_at')[:options['batch_size']])
+
+            published = 0
+            for job in jobs:
+                if process_publish_job(job):
+                    published += 1
+                    self.stdout.write('revision {} published to {}'.format(
+                        job.revision_id, job.content_release))
+
+            if len(jobs) < options['batch_size'] and options['once']:
+                break
+
+            if jobs and not published:
+                # back off instead of retrying the failed jobs straight away
+                failed_batches += 1
+                time.sleep(min(options['sleep'] * 2 ** (failed_batches - 1), options['max_sleep']))
+                continue
+            failed_batches = 0
+
+            if len(jobs) < options['batch_size']:
+                time.sleep(options['sleep'])
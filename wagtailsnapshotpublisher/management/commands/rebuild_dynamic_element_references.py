@@ -0,0 +1,33 @@
+"""
+.. module:: wagtailsnapshotpublisher.management.commands.rebuild_dynamic_element_references
+"""
+
+from django.core.management.base import BaseCommand
+
+from wagtailsnapshotpublisher.models import (
+    WSSPContentRelease, rebuild_dynamic_element_references,
+)
+
+
+class Command(BaseCommand):
+    """ Command """
+    help = 'Index the dynamic element references of the documents of the releases'
+
+    def add_arguments(self, parser):
+        """ add_arguments """
+        parser.add_argument(
+            'site_code',
+            nargs='?',
+            default=None,
+            help='Site of the releases to index, all the sites if not set',
+        )
+
+    def handle(self, *args, **options):
+        """ handle """
+        content_releases = WSSPContentRelease.objects.exclude(status=3)
+        if options['site_code']:
+            content_releases = content_releases.filter(site_code=options['site_code'])
+
+        for content_release in content_releases:
+            rebuild_dynamic_element_references(content_release)
+            self.stdout.write('{} indexed'.format(content_release))
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailsnapshotpublisher', '0006_auto_20191022_1616'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterializedReleaseDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_key', models.CharField(max_length=250)),
+                ('content_type', models.CharField(max_length=100)),
+                ('document_json', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('content_release', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='materialized_documents', to='wagtailsnapshotpublisher.WSSPContentRelease')),
+            ],
+            options={
+                'unique_together': {('content_release', 'document_key', 'content_type')},
+            },
+        ),
+    ]
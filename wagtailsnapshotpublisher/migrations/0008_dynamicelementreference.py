@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-18 10:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailsnapshotpublisher', '0007_materializedreleasedocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DynamicElementReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_key', models.CharField(max_length=250)),
+                ('content_type', models.CharField(max_length=100)),
+                ('reference_document_key', models.CharField(max_length=250)),
+                ('reference_content_type', models.CharField(max_length=100)),
+                ('content_release', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dynamic_element_references', to='wagtailsnapshotpublisher.WSSPContentRelease')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dynamicelementreference',
+            index=models.Index(fields=['content_release', 'reference_content_type', 'reference_document_key'], name='wssp_dynamic_reference_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dynamicelementreference',
+            index=models.Index(fields=['content_release', 'content_type', 'document_key'], name='wssp_dynamic_document_idx'),
+        ),
+    ]
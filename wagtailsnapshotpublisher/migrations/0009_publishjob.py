@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcore', '0052_pagelogentry'),
+        ('wagtailsnapshotpublisher', '0008_dynamicelementreference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('content_release', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='publish_jobs', to='wagtailsnapshotpublisher.WSSPContentRelease')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='publish_jobs', to='wagtailcore.Page')),
+                ('revision', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.PageRevision')),
+            ],
+            options={
+                'unique_together': {('page', 'content_release')},
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+def parse_version(version):
+    """ parse_version, return (major, minor) or None """
+    try:
+        major, minor = version.split('.')
+        return int(major), int(minor)
+    except (AttributeError, ValueError):
+        return None
+
+
+def set_version_numbers(apps, schema_editor):
+    """ set_version_numbers from the version of the releases and counters per site """
+    WSSPContentRelease = apps.get_model('wagtailsnapshotpublisher', 'WSSPContentRelease')
+    ReleaseVersionCounter = apps.get_model('wagtailsnapshotpublisher', 'ReleaseVersionCounter')
+
+    last_versions = {}
+    for release in WSSPContentRelease.objects.exclude(version=None).only('site_code', 'version'):
+        version = parse_version(release.version)
+        if version is None:
+            continue
+        WSSPContentRelease.objects.filter(pk=release.pk).update(
+            version_major=version[0],
+            version_minor=version[1],
+        )
+        if version > last_versions.get(release.site_code, (0, 0)):
+            last_versions[release.site_code] = version
+
+    ReleaseVersionCounter.objects.bulk_create([
+        ReleaseVersionCounter(site_code=site_code, major=major, minor=minor)
+        for site_code, (major, minor) in last_versions.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailsnapshotpublisher', '0009_publishjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wsspcontentrelease',
+            name='version_major',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='wsspcontentrelease',
+            name='version_minor',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReleaseVersionCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('site_code', models.SlugField(max_length=100, unique=True)),
+                ('major', models.IntegerField(default=0)),
+                ('minor', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='wsspcontentrelease',
+            index=models.Index(fields=['version_major', 'version_minor'], name='wssp_release_version_idx'),
+        ),
+        migrations.RunPython(set_version_numbers, migrations.RunPython.noop),
+    ]
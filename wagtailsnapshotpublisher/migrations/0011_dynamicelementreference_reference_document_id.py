@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailsnapshotpublisher', '0010_release_version_numbers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dynamicelementreference',
+            name='reference_document_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dynamicelementreference',
+            name='outdated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='dynamicelementreference',
+            index=models.Index(fields=['content_release', 'outdated'], name='wssp_dynamic_outdated_idx'),
+        ),
+    ]
@@ -4,7 +4,12 @@
 
 import logging
 import json
+import operator
 import re
+import threading
+
+from functools import reduce
+from itertools import groupby
 
 from django import forms, dispatch
 
@@ -12,13 +17,14 @@ from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Q, Count, Min
+from django.db import connection, models, transaction
+from django.db.models import Q
 from django.db.models.query import QuerySet
 from django.db.models.signals import pre_save, post_save
 from django.dispatch import receiver
 from django.forms.models import model_to_dict
 from django.http import JsonResponse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from wagtail.admin.edit_handlers import FieldPanel, MultiFieldPanel, HelpPanel
@@ -27,14 +33,23 @@ from wagtail.core.models import Page, PageRevision
 from djangosnapshotpublisher.models import ContentRelease, ReleaseDocument
 from djangosnapshotpublisher.publisher_api import PublisherAPI
 
+from .cache import (
+    get_document_cache, get_live_release, increment_skipped_publishes,
+    invalidate_cached_comparisons, invalidate_cached_documents, invalidate_cached_release,
+)
 from .panels import ReadOnlyPanel
-from .utils import get_from_dict, set_in_dict, del_in_dict, get_dynamic_element_keys
-from .signals import content_was_published
+from .utils import (
+    chunked, get_content_hash, get_from_dict, set_in_dict, del_in_dict, get_dynamic_element_keys,
+)
+from .signals import content_was_published, contents_were_published, release_was_staged
 
 logger = logging.getLogger('django')
 
 site_code_widget = None
 
+# thread local dict of the releases with a dynamic element refresh waiting for a commit
+local_pending_dynamic_releases = threading.local()
+
 if settings.SITE_CODE_CHOICES:
     site_code_widget = forms.Select(
         choices=settings.SITE_CODE_CHOICES,
@@ -45,6 +60,9 @@ VERSION_TYPES = (
     (1, 'MINOR'),
 )
 
+CONTENT_HASH_IGNORED_PARAMETERS = ('revision_id', 'title', 'content_hash')
+DOCUMENT_REFS_CHUNK_SIZE = 500
+
 
 class WSSPContentRelease(ContentRelease):
     """ WSSPContentRelease """
@@ -61,6 +79,8 @@ class WSSPContentRelease(ContentRelease):
         related_name='release_publisher',
     )
     version_type = models.IntegerField(choices=VERSION_TYPES, default=1)
+    version_major = models.IntegerField(null=True, blank=True, editable=False)
+    version_minor = models.IntegerField(null=True, blank=True, editable=False)
     restored = models.BooleanField(default=False)
 
     structure_to_store = {
@@ -121,6 +141,9 @@ class WSSPContentRelease(ContentRelease):
     class Meta:
         """ Meta """
         verbose_name = 'Release'
+        indexes = [
+            models.Index(fields=['version_major', 'version_minor'], name='wssp_release_version_idx'),
+        ]
 
     @classmethod
     def get_panel_field(cls, field_name):
@@ -139,207 +162,1309 @@ class WSSPContentRelease(ContentRelease):
         return None
 
     def copy_document_release_ref_from_baserelease(self):
-        """ get parent release """
+        """
+        get parent release
+        The documents aren't copied for the overlay releases, only the base release is saved.
+        """
         if self.use_current_live_as_base_release:
             self.base_release = self.__class__.objects.filter(
                 publish_datetime__lt=self.publish_datetime, site_code=self.site_code).order_by(
                     '-publish_datetime').first()
 
+        if is_overlay_release(self):
+            self.__class__.objects.filter(pk=self.pk).update(base_release=self.base_release)
+            invalidate_cached_comparisons(self.uuid)
+            return
+
         if self.base_release:
-            publisher_api = PublisherAPI()
+            # dynamic documents of the base release which aren't in the release
             dynamic_documents = self.base_release.release_documents.filter(
                 parameters__key='have_dynamic_elements',
                 parameters__content='True',
-            )
+                deleted=False,
+            ).prefetch_related('parameters')
+            release_document_refs = set(self.release_documents.values_list(
+                'content_type', 'document_key'))
 
+            documents = []
             for dynamic_document in dynamic_documents:
-                dynamic_element_keys = None
-                try:
-                    self.release_documents.get(
-                        document_key=dynamic_document.document_key,
-                        content_type=dynamic_document.content_type,
-                    )
-                except ReleaseDocument.DoesNotExist:
-                    add_document_to_release = False
-                    dynamic_element_keys = json.loads(dynamic_document.parameters.get(key='dynamic_element_keys').content)
-                    content = json.loads(dynamic_document.document_json)
-
-                    for elt_list in dynamic_element_keys:
-                        item = get_from_dict(content, elt_list)
-                    
-                        elements_to_remove = []
-
-                        # try:
-                        model = apps.get_model(item['app'], item['class'])
-                        loaded_instance = model.objects.get(id=item['id'])
-                        item_serializer = loaded_instance.get_serializers()[item['serializer']]
-
-                        if self.release_documents.filter(document_key=item_serializer['key'], content_type=item_serializer['type']).exists():
-                            add_document_to_release = True
-                            break
-
-                    # load dynamic content
-                    data, updated = document_load_dynamic_elements(self, json.loads(dynamic_document.document_json), dynamic_element_keys)
- 
-                    # get extra paramaters
-                    parameters = None
-                    response = publisher_api.get_document_extra_from_content_release(
-                        self.site_code,
-                        self.base_release.uuid,
-                        dynamic_document.document_key,
-                        dynamic_document.content_type,
-                    )
-                    if response['status'] == 'success':
-                        parameters = {parameter.key: parameter.content for parameter in response['content']}
-
-                    # add content to release
-                    publisher_api.publish_document_to_content_release(
-                        self.site_code,
-                        self.uuid,
-                        json.dumps(data),
-                        dynamic_document.document_key,
-                        dynamic_document.content_type,
-                        parameters=parameters,
-                    )                    
+                if (dynamic_document.content_type, dynamic_document.document_key) in \
+                        release_document_refs:
+                    continue
+                parameters = {
+                    parameter.key: parameter.content
+                    for parameter in dynamic_document.parameters.all()
+                }
+                if 'dynamic_element_keys' not in parameters:
+                    continue
+                documents.append((
+                    dynamic_document,
+                    parameters,
+                    json.loads(dynamic_document.document_json),
+                    json.loads(parameters['dynamic_element_keys']),
+                ))
+
+            # load dynamic content against the documents of the release
+            loaded_documents = documents_load_dynamic_elements(self, [
+                (content, dynamic_element_keys)
+                for dynamic_document, parameters, content, dynamic_element_keys in documents
+            ])
+
+            # add content to release
+            written_refs = write_release_documents(self, [
+                (
+                    dynamic_document.content_type,
+                    dynamic_document.document_key,
+                    json.dumps(data),
+                    parameters,
+                )
+                for (dynamic_document, parameters, content, dynamic_element_keys), data in zip(
+                    documents, loaded_documents)
+            ])
 
         super(WSSPContentRelease, self).copy_document_release_ref_from_baserelease()
 
+        if self.base_release:
+            copy_dynamic_element_references(self.base_release, self)
+            # the documents embedding the documents the release overrides and the documents
+            # written above are resolved again at the next refresh of the release
+            mark_dependent_references_outdated(self, release_document_refs)
+            for chunk in chunked(written_refs, DOCUMENT_REFS_CHUNK_SIZE):
+                self.dynamic_element_references.filter(
+                    get_documents_filter(chunk),
+                ).update(outdated=True)
+
+        # the documents copied from the base release change the comparisons with the release
+        invalidate_cached_comparisons(self.uuid)
+
+
+
+class ReleaseVersionCounter(models.Model):
+    """ ReleaseVersionCounter, last version allocated to a release of the site """
+    site_code = models.SlugField(max_length=100, unique=True)
+    major = models.IntegerField(default=0)
+    minor = models.IntegerField(default=0)
+
+
+def allocate_version(site_code, version_type):
+    """
+    allocate_version
+    return the next (major, minor) version of the site, the counter of the site is locked until
+    the end of the transaction so concurrent releases get different versions
+    """
+    with transaction.atomic():
+        counter, created = ReleaseVersionCounter.objects.select_for_update().get_or_create(
+            site_code=site_code,
+        )
+        if version_type == 0:
+            counter.major += 1
+            counter.minor = 0
+        else:
+            counter.minor += 1
+        counter.save()
+    return counter.major, counter.minor
 
 
 @receiver(pre_save, sender=WSSPContentRelease)
 def define_version(sender, instance, *args, **kwargs):
     """ define_version """
     if not instance.version and instance.status != 0:
-        previous_version = '0.0'
+        instance.version_major, instance.version_minor = allocate_version(
+            instance.site_code, instance.version_type)
+        instance.version = '{}.{}'.format(instance.version_major, instance.version_minor)
+        return instance
 
-        # get previous release
-        content_releases = WSSPContentRelease.objects.filter(
-            site_code=instance.site_code,
-        ).exclude(
-            status=0,
-        ).exclude(
-            id=instance.id,
-        )
-        if instance.publish_datetime:
-            content_releases = content_releases.exclude(
-                publish_datetime=None,
-            ).exclude(
-                publish_datetime__gt=instance.publish_datetime,
-            )
 
-        content_releases = content_releases.order_by('-version')
+def get_pending_dynamic_releases():
+    """
+    get_pending_dynamic_releases
+    return the dict release id => token of the last dynamic element refresh waiting for the
+    transaction of this thread to be committed
+    """
+    if not hasattr(local_pending_dynamic_releases, 'releases'):
+        local_pending_dynamic_releases.releases = {}
+    return local_pending_dynamic_releases.releases
 
-        if content_releases.exists():
-            previous_version = content_releases.first().version
 
-        version_list = previous_version.split('.')
-        # i=0
-        for i, item in enumerate(version_list):
-            if i == instance.version_type:
-                version_list[i] = str(int(item) + 1)
-            if i > instance.version_type:
-                version_list[i] = '0'
+@receiver(post_save, sender=ContentRelease)
+@receiver(post_save, sender=WSSPContentRelease)
+def load_dynamic_element(sender, instance, *args, **kwargs):
+    """
+    load_dynamic_element
+    The documents of the staged release referencing documents which changed while it wasn't
+    staged are resolved again once the transaction is committed, the saves of the release in a
+    transaction are coalesced.
+    """
+    if not instance.is_stage:
+        return
+
+    # the last callback registered for the release in the transaction does the work, the ids
+    # of the releases of a rolled back transaction are replaced by their next save
+    token = object()
+    pending_dynamic_releases = get_pending_dynamic_releases()
+    pending_dynamic_releases[instance.pk] = token
+
+    def load_release_dynamic_elements():
+        """ load_release_dynamic_elements """
+        if pending_dynamic_releases.get(instance.pk) is not token:
+            return
+        del pending_dynamic_releases[instance.pk]
+        content_release = WSSPContentRelease.objects.filter(pk=instance.pk).first()
+        if content_release is not None and content_release.is_stage:
+            refresh_changed_dynamic_elements(content_release)
+
+    transaction.on_commit(load_release_dynamic_elements)
+
+
+@receiver(release_was_staged)
+def invalidate_staged_release_cache(sender, release, *args, **kwargs):
+    """ invalidate_staged_release_cache """
+    invalidate_cached_release(release.uuid)
+
+
+def document_load_dynamic_elements(content_release, content, dynamic_element_keys,
+                                   references=None, resolved_elements=None):
+    """
+    document_load_dynamic_elements
+    The [content_type, document_key] of the documents referenced by the dynamic elements are
+    appended to references if given, resolved_elements can be shared between several calls to
+    resolve each element once. The elements which can't be resolved are left as they are.
+    """
+    if resolved_elements is None:
+        resolved_elements = {}
+
+    items = [get_from_dict(content, elt_list) for elt_list in dynamic_element_keys]
+    load_dynamic_element_documents(content_release, items, resolved_elements)
+
+    for elt_list, item in zip(dynamic_element_keys, items):
+        try:
+            reference, document_json = resolved_elements[get_dynamic_element_key(item)]
+        except (KeyError, TypeError):
+            continue
+        if references is not None and reference is not None:
+            references.append(reference)
+        if document_json is not None:
+            set_in_dict(content, elt_list[:-1] + ['data'], json.loads(document_json))
+
+    return content
+
+
+def get_dynamic_element_key(item):
+    """ get_dynamic_element_key """
+    return (item['app'], item['class'], item['id'], item['serializer'])
+
+
+def get_dynamic_element_references(items):
+    """
+    get_dynamic_element_references
+    return a dict with the [content_type, document_key] of the documents referenced by the
+    dynamic elements, the instances of each model are loaded with one query
+    """
+    instance_ids = {}
+    for item in items:
+        try:
+            app, class_name, instance_id, serializer = get_dynamic_element_key(item)
+        except (KeyError, TypeError):
+            continue
+        instance_ids.setdefault((app, class_name), set()).add(instance_id)
 
-        next_version = '.'.join(version_list)
-        instance.version = next_version
-        return instance
+    instances = {}
+    for (app, class_name), ids in instance_ids.items():
+        try:
+            model = apps.get_model(app, class_name)
+        except LookupError:
+            continue
+        # the ids of the elements can be strings ("12"), in_bulk returns the instances by pk
+        pks = {}
+        for instance_id in ids:
+            try:
+                pks[instance_id] = model._meta.pk.to_python(instance_id)
+            except ValidationError:
+                continue
+        model_instances = model.objects.in_bulk(set(pks.values()))
+        for instance_id, pk in pks.items():
+            if pk in model_instances:
+                instances[(app, class_name, instance_id)] = model_instances[pk]
+
+    references = {}
+    instance_serializers = {}
+    for item in items:
+        try:
+            element_key = get_dynamic_element_key(item)
+        except (KeyError, TypeError):
+            continue
+        app, class_name, instance_id, serializer = element_key
+        instance = instances.get((app, class_name, instance_id))
+        if instance is None:
+            continue
+        if instance not in instance_serializers:
+            instance_serializers[instance] = instance.get_serializers()
+        try:
+            item_serializer = instance_serializers[instance][serializer]
+        except KeyError:
+            continue
+        references[element_key] = [item_serializer['type'], str(item_serializer['key'])]
+    return references
+
+
+def load_dynamic_element_documents(content_release, items, resolved_elements):
+    """
+    load_dynamic_element_documents
+    Add to resolved_elements the [content_type, document_key] reference of the dynamic elements
+    and the json of the document they reference in the release (None if it is not in the
+    release), the instances of each model and the documents are loaded with one query. The
+    elements which can't be resolved get a None reference.
+    """
+    items_to_load = {}
+    for item in items:
+        try:
+            element_key = get_dynamic_element_key(item)
+        except (KeyError, TypeError):
+            continue
+        if element_key not in resolved_elements:
+            items_to_load[element_key] = item
+
+    references = get_dynamic_element_references(list(items_to_load.values()))
+
+    documents = {}
+    if references and is_overlay_release(content_release):
+        documents = {
+            document_ref: release_document.document_json
+            for document_ref, release_document in get_overlay_documents(
+                content_release, {tuple(reference) for reference in references.values()},
+                prefetch_parameters=False,
+            ).items()
+        }
+    elif references:
+        release_documents = content_release.release_documents.filter(
+            content_type__in={content_type for content_type, document_key in references.values()},
+            document_key__in={document_key for content_type, document_key in references.values()},
+            deleted=False,
+        ).values_list('content_type', 'document_key', 'document_json')
+        documents = {
+            (content_type, document_key): document_json
+            for content_type, document_key, document_json in release_documents
+        }
+
+    for element_key in items_to_load:
+        reference = references.get(element_key)
+        if reference is None:
+            resolved_elements[element_key] = (None, None)
+        else:
+            resolved_elements[element_key] = (reference, documents.get(tuple(reference)))
+    return resolved_elements
+
+
+def documents_load_dynamic_elements(content_release, documents):
+    """
+    documents_load_dynamic_elements
+    documents is a list of (content, dynamic_element_keys), the dynamic elements of all the
+    documents are resolved together
+    """
+    documents = [
+        (content, dynamic_element_keys, [get_from_dict(content, elt_list) for elt_list in dynamic_element_keys])
+        for content, dynamic_element_keys in documents
+    ]
+    resolved_elements = load_dynamic_element_documents(
+        content_release,
+        [item for content, dynamic_element_keys, items in documents for item in items],
+        {},
+    )
+    return [
+        document_load_dynamic_elements(
+            content_release, content, dynamic_element_keys,
+            resolved_elements=resolved_elements)
+        for content, dynamic_element_keys, items in documents
+    ]
 
 
-@receiver(post_save, sender=WSSPContentRelease)
-def fix_versions_conflict(sender, instance, *args, **kwargs):
-    """ fix_versions_conflict """
-    duplicate_version = WSSPContentRelease.objects.filter(
-                site_code=instance.site_code,
-        ).values(
-            'version'
-        ).annotate(
-            count_same_version=Count('version')
-        ).exclude(count_same_version__lte=1)
+def iter_release_document_refs(content_release, chunk_size=500):
+    """ iter_release_document_refs, yield the (content_type, document_key) of the release """
+    for content_type, document_key, document_id in iter_release_document_ids(
+            content_release, chunk_size):
+        yield content_type, document_key
+
+
+def iter_release_documents(content_release, chunk_size=500):
+    """
+    iter_release_documents
+    yield (release_document, parameters, data) for the documents of the release with their
+    dynamic elements resolved, the documents are loaded chunk_size at a time.
+    """
+    document_ids = (
+        document_id for content_type, document_key, document_id in iter_release_document_ids(
+            content_release, chunk_size)
+    )
 
-    if duplicate_version:
-        # get min version from duplicate_version
-        min_version = duplicate_version.aggregate(Min('version'))['version__min']
+    materialized = is_materialized_release(content_release)
+    for chunk in chunked(document_ids, chunk_size):
+        release_documents = ReleaseDocument.objects.filter(
+            id__in=chunk,
+        ).order_by('id').prefetch_related('parameters')
+
+        materialized_documents = {}
+        if materialized:
+            materialized_documents = {
+                (content_type, document_key): document_json
+                for content_type, document_key, document_json in
+                content_release.materialized_documents.filter(
+                    document_key__in={release_document.document_key for release_document in release_documents},
+                ).values_list('content_type', 'document_key', 'document_json')
+            }
 
-        releases_to_update = WSSPContentRelease.objects.filter(
-            site_code=instance.site_code,
-            version__gte=min_version,
-        ).order_by('publish_datetime')
+        items = []
+        dynamic_items = []
+        for release_document in release_documents:
+            parameters = {parameter.key: parameter.content for parameter in release_document.parameters.all()}
+            document_json = materialized_documents.get(
+                (release_document.content_type, release_document.document_key),
+                release_document.document_json,
+            )
+            item = [release_document, parameters, json.loads(document_json)]
+            items.append(item)
+            if 'dynamic_element_keys' in parameters and \
+                    (release_document.content_type, release_document.document_key) not in materialized_documents:
+                dynamic_items.append(item)
 
-        # reset version
-        for release in releases_to_update:
-            content_release = ContentRelease.objects.get(id=release.id)
-            content_release.version = None
-            content_release.save()
+        loaded_documents = documents_load_dynamic_elements(content_release, [
+            (data, json.loads(parameters['dynamic_element_keys']))
+            for release_document, parameters, data in dynamic_items
+        ])
+        for item, data in zip(dynamic_items, loaded_documents):
+            item[2] = data
 
-        # update version
-        for release in releases_to_update:
-            release.version = None
-            release = define_version(WSSPContentRelease, release)
-            release.save()
+        for release_document, parameters, data in items:
+            yield release_document, parameters, data
 
 
-@receiver(post_save, sender=ContentRelease)
-@receiver(post_save, sender=WSSPContentRelease)
-def load_dynamic_element(sender, instance, *args, **kwargs):
-    """ load_dynamic_element """
-    if instance.is_stage:
-        publisher_api = PublisherAPI()
+class MaterializedReleaseDocument(models.Model):
+    """ MaterializedReleaseDocument, document of a release with its dynamic elements resolved """
+    content_release = models.ForeignKey(
+        WSSPContentRelease,
+        related_name='materialized_documents',
+        on_delete=models.CASCADE,
+    )
+    document_key = models.CharField(max_length=250)
+    content_type = models.CharField(max_length=100)
+    document_json = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
-        # get all ReleaseContent with dynamic element
-        release_documents = instance.release_documents.filter(
-            parameters__key='have_dynamic_elements',
-            parameters__content='True',
-            content_type='page',
-        )
+    class Meta:
+        """ Meta """
+        unique_together = ('content_release', 'document_key', 'content_type')
 
+
+class DynamicElementReference(models.Model):
+    """ DynamicElementReference, document of a release embedding another one as dynamic element """
+    content_release = models.ForeignKey(
+        WSSPContentRelease,
+        related_name='dynamic_element_references',
+        on_delete=models.CASCADE,
+    )
+    document_key = models.CharField(max_length=250)
+    content_type = models.CharField(max_length=100)
+    reference_document_key = models.CharField(max_length=250)
+    reference_content_type = models.CharField(max_length=100)
+    reference_document_id = models.IntegerField(null=True, blank=True)
+    outdated = models.BooleanField(default=False)
+
+    class Meta:
+        """ Meta """
+        indexes = [
+            models.Index(fields=['content_release', 'outdated'], name='wssp_dynamic_outdated_idx'),
+            models.Index(
+                fields=['content_release', 'reference_content_type', 'reference_document_key'],
+                name='wssp_dynamic_reference_idx',
+            ),
+            models.Index(
+                fields=['content_release', 'content_type', 'document_key'],
+                name='wssp_dynamic_document_idx',
+            ),
+        ]
+
+
+def get_documents_filter(document_refs):
+    """ get_documents_filter, Q matching the documents of a list of (content_type, document_key) """
+    return reduce(operator.or_, [
+        Q(content_type=content_type, document_key=str(document_key))
+        for content_type, document_key in document_refs
+    ])
+
+
+def is_overlay_release(content_release):
+    """
+    is_overlay_release
+    With WSSP_OVERLAY_BASE_RELEASES the documents of the base releases aren't copied, a release
+    only holds its own changes and the documents it doesn't hold are read from its base releases
+    """
+    return getattr(settings, 'WSSP_OVERLAY_BASE_RELEASES', False) and \
+        content_release is not None
+
+
+def get_base_release_id(content_release):
+    """ get_base_release_id, the current live release for the preview releases based on it """
+    if content_release.status == 0 and content_release.use_current_live_as_base_release:
+        live_release = get_live_release(content_release.site_code)
+        if live_release is None or live_release.pk == content_release.pk:
+            return None
+        return live_release.pk
+    return content_release.base_release_id
+
+
+def get_release_chain(content_release):
+    """
+    get_release_chain
+    return the ids of the release and of its base releases, the nearest first
+    """
+    chain = [content_release.pk]
+    base_release_id = get_base_release_id(content_release)
+    while base_release_id is not None and base_release_id not in chain:
+        chain.append(base_release_id)
+        base_release_id = ContentRelease.objects.filter(
+            pk=base_release_id,
+        ).values_list('base_release_id', flat=True).first()
+    return chain
+
+
+def get_release_documents_query_name():
+    """ get_release_documents_query_name, name of the ReleaseDocument => ContentRelease lookup """
+    return ContentRelease._meta.get_field('release_documents').related_query_name()
+
+
+def get_overlay_documents(content_release, document_refs, prefetch_parameters=True, fields=None):
+    """
+    get_overlay_documents
+    return a dict of (content_type, document_key) => ReleaseDocument with the documents of
+    document_refs held by the nearest release of the chain of the release. The documents
+    deleted in a release hide the ones of its base releases. Only the fields are loaded if
+    they are given.
+    """
+    chain = get_release_chain(content_release)
+    positions = {release_id: position for position, release_id in enumerate(chain)}
+    query_name = get_release_documents_query_name()
+
+    nearest_documents = {}
+    for chunk in chunked(list(document_refs), DOCUMENT_REFS_CHUNK_SIZE):
+        release_documents = ReleaseDocument.objects.filter(
+            get_documents_filter(chunk),
+            **{'{}__in'.format(query_name): chain},
+        ).annotate(
+            overlay_release_id=models.F(query_name),
+        )
+        if fields is not None:
+            release_documents = release_documents.only(
+                'id', 'content_type', 'document_key', 'deleted', *fields)
+        if prefetch_parameters:
+            release_documents = release_documents.prefetch_related('parameters')
         for release_document in release_documents:
-            response_extra = publisher_api.get_document_extra_from_content_release(
-                instance.site_code,
-                instance.uuid,
-                release_document.document_key,
-                release_document.content_type,
+            document_ref = (release_document.content_type, release_document.document_key)
+            nearest_document = nearest_documents.get(document_ref)
+            if nearest_document is None or positions[release_document.overlay_release_id] < \
+                    positions[nearest_document.overlay_release_id]:
+                nearest_documents[document_ref] = release_document
+
+    return {
+        document_ref: release_document
+        for document_ref, release_document in nearest_documents.items()
+        if not release_document.deleted
+    }
+
+
+def iter_release_document_ids(content_release, chunk_size=DOCUMENT_REFS_CHUNK_SIZE):
+    """
+    iter_release_document_ids
+    yield the (content_type, document_key, id) of the documents of the release ordered by
+    content_type and document_key, the documents of an overlay release are read from its chain
+    (the nearest release holding a document wins) one row at a time.
+    """
+    if not is_overlay_release(content_release):
+        yield from content_release.release_documents.filter(
+            deleted=False,
+        ).order_by('content_type', 'document_key').values_list(
+            'content_type', 'document_key', 'id',
+        ).iterator(chunk_size=chunk_size)
+        return
+
+    chain = get_release_chain(content_release)
+    positions = {release_id: position for position, release_id in enumerate(chain)}
+    query_name = get_release_documents_query_name()
+
+    release_documents = ReleaseDocument.objects.filter(
+        **{'{}__in'.format(query_name): chain},
+    ).order_by('content_type', 'document_key').values_list(
+        'content_type', 'document_key', 'id', 'deleted', query_name,
+    ).iterator(chunk_size=chunk_size)
+    for document_ref, rows in groupby(release_documents, key=operator.itemgetter(0, 1)):
+        content_type, document_key, document_id, deleted, release_id = min(
+            rows, key=lambda row: positions[row[4]])
+        if not deleted:
+            yield content_type, document_key, document_id
+
+
+def build_dynamic_element_references(content_release, content_type, document_key, references,
+                                     document_ids=None):
+    """
+    build_dynamic_element_references, doesn't save them
+    document_ids is a dict of (content_type, document_key) => id of the referenced documents
+    """
+    if document_ids is None:
+        document_ids = {}
+    return [
+        DynamicElementReference(
+            content_release=content_release,
+            document_key=str(document_key),
+            content_type=content_type,
+            reference_document_key=reference_document_key,
+            reference_content_type=reference_content_type,
+            reference_document_id=document_ids.get(
+                (reference_content_type, reference_document_key)),
+        )
+        for reference_content_type, reference_document_key in {
+            tuple(reference) for reference in references
+        }
+    ]
+
+
+def set_dynamic_element_references(content_release, document_references):
+    """
+    set_dynamic_element_references
+    document_references is a dict of (content_type, document_key) => list of the
+    [content_type, document_key] of the documents they reference, an empty list removes the
+    document from the index.
+    """
+    document_references = {
+        document_ref: [tuple(reference) for reference in references]
+        for document_ref, references in document_references.items()
+    }
+    document_ids = get_current_document_ids(content_release, {
+        reference for references in document_references.values() for reference in references
+    })
+    with transaction.atomic():
+        for document_refs in chunked(document_references, DOCUMENT_REFS_CHUNK_SIZE):
+            content_release.dynamic_element_references.filter(
+                get_documents_filter(document_refs)).delete()
+        DynamicElementReference.objects.bulk_create([
+            dynamic_element_reference
+            for (content_type, document_key), references in document_references.items()
+            for dynamic_element_reference in build_dynamic_element_references(
+                content_release, content_type, document_key, references, document_ids)
+        ], batch_size=DOCUMENT_REFS_CHUNK_SIZE)
+
+
+def rebuild_dynamic_element_references(content_release):
+    """
+    rebuild_dynamic_element_references
+    Index all the documents of the release, the references get the id of the current referenced
+    documents
+    """
+    release_documents = content_release.release_documents.filter(
+        parameters__key='have_dynamic_elements',
+        parameters__content='True',
+        deleted=False,
+    ).prefetch_related('parameters')
+
+    dynamic_element_references = []
+    for release_document in release_documents:
+        parameters = {parameter.key: parameter.content for parameter in release_document.parameters.all()}
+        if 'dynamic_element_keys' not in parameters:
+            continue
+        content = json.loads(release_document.document_json)
+        items = [
+            get_from_dict(content, elt_list)
+            for elt_list in json.loads(parameters['dynamic_element_keys'])
+        ]
+        dynamic_element_references.extend(build_dynamic_element_references(
+            content_release,
+            release_document.content_type,
+            release_document.document_key,
+            get_dynamic_element_references(items).values(),
+        ))
+
+    document_ids = get_current_document_ids(content_release, {
+        (reference.reference_content_type, reference.reference_document_key)
+        for reference in dynamic_element_references
+    })
+    for reference in dynamic_element_references:
+        reference.reference_document_id = document_ids.get(
+            (reference.reference_content_type, reference.reference_document_key))
+
+    with transaction.atomic():
+        content_release.dynamic_element_references.all().delete()
+        DynamicElementReference.objects.bulk_create(
+            dynamic_element_references, batch_size=DOCUMENT_REFS_CHUNK_SIZE)
+
+
+def copy_dynamic_element_references(base_release, content_release):
+    """
+    copy_dynamic_element_references
+    Index the documents the release shares with its base, they are resolved against the same
+    documents so the ids of the referenced documents are kept
+    """
+    indexed_documents = set(content_release.dynamic_element_references.values_list(
+        'content_type', 'document_key'))
+    DynamicElementReference.objects.bulk_create([
+        DynamicElementReference(
+            content_release=content_release,
+            document_key=reference.document_key,
+            content_type=reference.content_type,
+            reference_document_key=reference.reference_document_key,
+            reference_content_type=reference.reference_content_type,
+            reference_document_id=reference.reference_document_id,
+            outdated=reference.outdated,
+        )
+        for reference in base_release.dynamic_element_references.all()
+        if (reference.content_type, reference.document_key) not in indexed_documents
+    ], batch_size=DOCUMENT_REFS_CHUNK_SIZE)
+
+
+def get_dependent_documents(content_release, document_refs):
+    """
+    get_dependent_documents
+    return the (content_type, document_key) of the documents of the release embedding one of
+    the documents of document_refs
+    """
+    dependent_refs = set()
+    for chunk in chunked(document_refs, DOCUMENT_REFS_CHUNK_SIZE):
+        dependent_refs.update(content_release.dynamic_element_references.filter(
+            get_references_filter(chunk),
+        ).values_list('content_type', 'document_key'))
+    return list(dependent_refs)
+
+
+def get_overlay_releases_based_on(content_release):
+    """
+    get_overlay_releases_based_on
+    return the releases whose chain contains the release (its overlay releases, their overlay
+    releases and so on), they read the documents they don't hold from it
+    """
+    if not is_overlay_release(content_release):
+        return []
+
+    releases = []
+    release_ids = {content_release.pk}
+    base_release_ids = [content_release.pk]
+    while base_release_ids:
+        based_releases = list(WSSPContentRelease.objects.filter(
+            base_release_id__in=base_release_ids,
+        ).exclude(pk__in=release_ids))
+        releases.extend(based_releases)
+        base_release_ids = [release.pk for release in based_releases]
+        release_ids.update(base_release_ids)
+    return releases
+
+
+def invalidate_release_documents(content_release, document_refs):
+    """
+    invalidate_release_documents
+    Drop the cached documents of document_refs and the ones embedding them, all the cached
+    documents with dynamic elements are dropped if the release hasn't been indexed yet. The
+    overlay releases based on the release are invalidated the same way.
+    """
+    if get_document_cache() is None:
+        return
+
+    document_refs = [(content_type, str(document_key)) for content_type, document_key in document_refs]
+    for release in [content_release] + get_overlay_releases_based_on(content_release):
+        invalidate_cached_documents(
+            release.site_code,
+            release.uuid,
+            document_refs + get_dependent_documents(release, document_refs),
+        )
+        if not release.dynamic_element_references.exists():
+            invalidate_cached_release(release.uuid)
+
+
+def get_dynamic_release_documents(content_release, document_refs):
+    """
+    get_dynamic_release_documents
+    return a list of (release_document, content, dynamic_element_keys) for the documents of
+    document_refs with dynamic elements
+    """
+    release_documents = []
+    for chunk in chunked(list(document_refs), DOCUMENT_REFS_CHUNK_SIZE):
+        release_documents.extend(content_release.release_documents.filter(
+            get_documents_filter(chunk),
+            deleted=False,
+        ).prefetch_related('parameters'))
+
+    dynamic_documents = []
+    for release_document in release_documents:
+        parameters = {parameter.key: parameter.content for parameter in release_document.parameters.all()}
+        if 'dynamic_element_keys' not in parameters:
+            continue
+        dynamic_documents.append((
+            release_document,
+            json.loads(release_document.document_json),
+            json.loads(parameters['dynamic_element_keys']),
+        ))
+    return dynamic_documents
+
+
+def get_dependent_release_documents(content_release, document_refs):
+    """
+    get_dependent_release_documents
+    return a list of (release_document, content, dynamic_element_keys) for the documents of the
+    release embedding one of the documents of document_refs
+    """
+    return get_dynamic_release_documents(
+        content_release, get_dependent_documents(content_release, document_refs))
+
+
+def refresh_dynamic_documents(content_release, dynamic_documents):
+    """
+    refresh_dynamic_documents
+    Resolve again the dynamic elements of a list of (release_document, content,
+    dynamic_element_keys) and save them
+    """
+    if not dynamic_documents:
+        return
+
+    loaded_documents = documents_load_dynamic_elements(content_release, [
+        (content, dynamic_element_keys)
+        for release_document, content, dynamic_element_keys in dynamic_documents
+    ])
+    release_documents = []
+    for (release_document, content, dynamic_element_keys), data in zip(dynamic_documents, loaded_documents):
+        release_document.document_json = json.dumps(data)
+        release_documents.append(release_document)
+    ReleaseDocument.objects.bulk_update(
+        release_documents, ['document_json'], batch_size=DOCUMENT_REFS_CHUNK_SIZE)
+    invalidate_release_documents(content_release, [
+        (release_document.content_type, release_document.document_key)
+        for release_document in release_documents
+    ])
+
+
+def get_references_filter(document_refs):
+    """ get_references_filter, Q matching the references to a list of (content_type, document_key) """
+    return reduce(operator.or_, [
+        Q(reference_content_type=content_type, reference_document_key=str(document_key))
+        for content_type, document_key in document_refs
+    ])
+
+
+def mark_dependent_references_outdated(content_release, document_refs):
+    """
+    mark_dependent_references_outdated
+    The documents embedding one of the documents of document_refs are resolved again by the
+    next refresh of the release once it is staged
+    """
+    for chunk in chunked(list(document_refs), DOCUMENT_REFS_CHUNK_SIZE):
+        content_release.dynamic_element_references.filter(
+            get_references_filter(chunk),
+        ).update(outdated=True)
+
+
+def refresh_dependent_documents(content_release, document_refs):
+    """
+    refresh_dependent_documents
+    Resolve again the dynamic elements of the documents of the staged release embedding one of
+    the documents of document_refs, the other documents of the release are left untouched. The
+    references of the other releases are marked as outdated.
+    """
+    if not content_release.is_stage:
+        mark_dependent_references_outdated(content_release, document_refs)
+        return
+
+    refresh_dynamic_documents(
+        content_release, get_dependent_release_documents(content_release, document_refs))
+
+    document_ids = get_current_document_ids(content_release, document_refs)
+    for content_type, document_key in document_refs:
+        content_release.dynamic_element_references.filter(
+            reference_content_type=content_type,
+            reference_document_key=str(document_key),
+        ).update(
+            reference_document_id=document_ids.get((content_type, str(document_key))),
+            outdated=False,
+        )
+
+
+def get_current_document_ids(content_release, document_refs):
+    """
+    get_current_document_ids
+    return a dict of (content_type, document_key) => id of the document of the release
+    """
+    if is_overlay_release(content_release):
+        return {
+            document_ref: release_document.id
+            for document_ref, release_document in get_overlay_documents(
+                content_release, document_refs, prefetch_parameters=False).items()
+        }
+
+    document_ids = {}
+    for chunk in chunked(list(document_refs), DOCUMENT_REFS_CHUNK_SIZE):
+        document_ids.update({
+            (content_type, document_key): document_id
+            for content_type, document_key, document_id in
+            content_release.release_documents.filter(
+                get_documents_filter(chunk),
+                deleted=False,
+            ).values_list('content_type', 'document_key', 'id')
+        })
+    return document_ids
+
+
+def refresh_changed_dynamic_elements(content_release):
+    """
+    refresh_changed_dynamic_elements
+    Resolve again the documents of the release with a dynamic element referencing a document
+    which has been published, unpublished or removed while the release wasn't staged (their
+    references are marked as outdated), return the number of documents resolved. The releases
+    which have never been indexed are indexed by rebuild_dynamic_element_references.
+    """
+    references = list(content_release.dynamic_element_references.filter(
+        outdated=True,
+    ).values_list(
+        'id', 'content_type', 'document_key', 'reference_content_type', 'reference_document_key',
+    ))
+    if not references:
+        return 0
+
+    current_document_ids = get_current_document_ids(content_release, {
+        (reference_content_type, reference_document_key)
+        for reference_id, content_type, document_key, reference_content_type,
+        reference_document_key in references
+    })
+    dynamic_documents = get_dynamic_release_documents(content_release, {
+        (content_type, document_key)
+        for reference_id, content_type, document_key, reference_content_type,
+        reference_document_key in references
+    })
+    with transaction.atomic():
+        refresh_dynamic_documents(content_release, dynamic_documents)
+        DynamicElementReference.objects.bulk_update([
+            DynamicElementReference(
+                id=reference_id,
+                reference_document_id=current_document_ids.get(
+                    (reference_content_type, reference_document_key)),
+                outdated=False,
             )
-            if response_extra['status'] == 'success' and not release_document.deleted:
-                data = json.loads(release_document.document_json)
-                dynamic_element_keys = json.loads(response_extra['content'].get(key='dynamic_element_keys').content)
-                data, updated = document_load_dynamic_elements(instance, data, dynamic_element_keys)
-                if updated:
-                    release_document.document_json = json.dumps(data)
-                    release_document.save()
+            for reference_id, content_type, document_key, reference_content_type,
+            reference_document_key in references
+        ], ['reference_document_id', 'outdated'], batch_size=DOCUMENT_REFS_CHUNK_SIZE)
+    return len(dynamic_documents)
+
+
+def is_materialized_release(content_release):
+    """ is_materialized_release """
+    return getattr(settings, 'WSSP_MATERIALIZE_DYNAMIC_ELEMENTS', False) and \
+        content_release is not None and content_release.status != 0
+
+
+def materialize_document(content_release, content, document_key, content_type,
+                         dynamic_element_keys, references=None):
+    """ materialize_document, doesn't save it """
+    data = document_load_dynamic_elements(
+        content_release, content, dynamic_element_keys, references)
+    return MaterializedReleaseDocument(
+        content_release=content_release,
+        document_key=str(document_key),
+        content_type=content_type,
+        document_json=json.dumps(data),
+    )
 
 
-def document_load_dynamic_elements(content_release, content, dynamic_element_keys):
-    """ document_load_dynamic_elements """
-    updated = False
-    elements_to_remove = []
+def materialize_release(content_release):
+    """
+    materialize_release
+    Resolve the dynamic elements of all the documents of the release, the dynamic element
+    references of the release are indexed again on the way.
+    """
+    release_documents = content_release.release_documents.filter(
+        parameters__key='have_dynamic_elements',
+        parameters__content='True',
+        deleted=False,
+    ).prefetch_related('parameters')
+
+    materialized_documents = []
+    dynamic_element_references = []
+    for release_document in release_documents:
+        parameters = {parameter.key: parameter.content for parameter in release_document.parameters.all()}
+        if 'dynamic_element_keys' not in parameters:
+            continue
+        references = []
+        materialized_documents.append(materialize_document(
+            content_release,
+            json.loads(release_document.document_json),
+            release_document.document_key,
+            release_document.content_type,
+            json.loads(parameters['dynamic_element_keys']),
+            references,
+        ))
+        dynamic_element_references.extend(build_dynamic_element_references(
+            content_release,
+            release_document.content_type,
+            release_document.document_key,
+            references,
+        ))
+
+    document_ids = get_current_document_ids(content_release, {
+        (reference.reference_content_type, reference.reference_document_key)
+        for reference in dynamic_element_references
+    })
+    for reference in dynamic_element_references:
+        reference.reference_document_id = document_ids.get(
+            (reference.reference_content_type, reference.reference_document_key))
+
+    with transaction.atomic():
+        content_release.materialized_documents.all().delete()
+        MaterializedReleaseDocument.objects.bulk_create(materialized_documents)
+        content_release.dynamic_element_references.all().delete()
+        DynamicElementReference.objects.bulk_create(dynamic_element_references)
+
+    invalidate_cached_release(content_release.uuid)
+
+
+def update_materialized_documents(content_release, content_type, document_key, content=None,
+                                  dynamic_element_keys=None):
+    """
+    update_materialized_documents
+    Called when a document is published (with its content) or unpublished from the release, the
+    documents referencing it are materialized again.
+    """
+    document_key = str(document_key)
+    dependent_documents = get_dependent_release_documents(
+        content_release, [(content_type, document_key)])
+
+    materialized_documents = []
+    if content is not None and dynamic_element_keys:
+        materialized_documents.append(materialize_document(
+            content_release, content, document_key, content_type, dynamic_element_keys))
+
+    loaded_documents = documents_load_dynamic_elements(content_release, [
+        (content, dynamic_element_keys)
+        for release_document, content, dynamic_element_keys in dependent_documents
+    ])
+    for (release_document, content, dynamic_element_keys), data in zip(dependent_documents, loaded_documents):
+        materialized_documents.append(MaterializedReleaseDocument(
+            content_release=content_release,
+            document_key=release_document.document_key,
+            content_type=release_document.content_type,
+            document_json=json.dumps(data),
+        ))
+
+    document_refs = [(content_type, document_key)] + [
+        (release_document.content_type, release_document.document_key)
+        for release_document, content, dynamic_element_keys in dependent_documents
+    ]
+    with transaction.atomic():
+        content_release.materialized_documents.filter(
+            get_documents_filter(document_refs)).delete()
+        MaterializedReleaseDocument.objects.bulk_create(materialized_documents)
+
+
+@receiver(release_was_staged)
+def materialize_staged_release(sender, release, *args, **kwargs):
+    """ materialize_staged_release """
+    if is_materialized_release(release):
+        materialize_release(release)
+
+
+def get_document_content_hash(data, parameters):
+    """
+    get_document_content_hash
+    Hash of the serialized document and of its parameters, the CONTENT_HASH_IGNORED_PARAMETERS
+    (which change on each publish without changing the document) are left out.
+    """
+    return get_content_hash({
+        'data': data,
+        'parameters': {
+            key: str(value) for key, value in parameters.items()
+            if key not in CONTENT_HASH_IGNORED_PARAMETERS
+        },
+    })
+
+
+def is_document_unchanged(content_release, content_type, document_key, content_hash):
+    """ is_document_unchanged, the release already holds the document with the same hash """
+    return content_release.release_documents.filter(
+        content_type=content_type,
+        document_key=str(document_key),
+        deleted=False,
+        parameters__key='content_hash',
+        parameters__content=content_hash,
+    ).exists()
+
+
+def get_release_document_relations():
+    """
+    get_release_document_relations
+    return the model of the parameters of the release documents with the name of its foreign
+    key, the through model of ContentRelease.release_documents with the attnames of its foreign
+    keys to the release and to the document
+    """
+    parameters_relation = ReleaseDocument._meta.get_field('parameters')
+    release_documents_field = ContentRelease._meta.get_field('release_documents')
+    through = release_documents_field.remote_field.through
+    return (
+        parameters_relation.related_model,
+        parameters_relation.field.name,
+        through,
+        through._meta.get_field(release_documents_field.m2m_field_name()).attname,
+        through._meta.get_field(release_documents_field.m2m_reverse_field_name()).attname,
+    )
 
-    for elt_list in dynamic_element_keys:
-        item = get_from_dict(content, elt_list)
 
-        try:
-            model = apps.get_model(item['app'], item['class'])
-            loaded_instance = model.objects.get(id=item['id'])
-            item_serializer = loaded_instance.get_serializers()[item['serializer']]
+def get_shared_document_ids(content_release, document_ids):
+    """ get_shared_document_ids, ids of the documents of the release linked to other releases """
+    parameter_model, parameter_fk, through, release_fk, document_fk = \
+        get_release_document_relations()
+    shared_document_ids = set()
+    for chunk in chunked(document_ids, DOCUMENT_REFS_CHUNK_SIZE):
+        shared_document_ids.update(through.objects.filter(
+            **{'{}__in'.format(document_fk): chunk},
+        ).exclude(
+            **{release_fk: content_release.pk},
+        ).values_list(document_fk, flat=True))
+    return shared_document_ids
+
+
+def write_release_documents(content_release, documents):
+    """
+    write_release_documents
+    documents is a list of (content_type, document_key, document_json, parameters), they are
+    written to the release with a few batched queries in one transaction. The documents
+    identical to the ones already in the release are skipped, the documents the release shares
+    with other releases are replaced by new ones. return the (content_type, document_key) of the
+    written documents.
+    """
+    parameter_model, parameter_fk, through, release_fk, document_fk = \
+        get_release_document_relations()
+    documents = {
+        (content_type, str(document_key)): (document_json, parameters)
+        for content_type, document_key, document_json, parameters in documents
+    }
 
-            publisher_api = PublisherAPI()
-            response = publisher_api.get_document_from_content_release(
-                content_release.site_code,
-                content_release.uuid,
-                item_serializer['key'],
-                item_serializer['type'],
+    existing_documents = {}
+    for chunk in chunked(documents, DOCUMENT_REFS_CHUNK_SIZE):
+        for release_document in content_release.release_documents.filter(
+                get_documents_filter(chunk)).prefetch_related('parameters'):
+            existing_documents[(release_document.content_type, release_document.document_key)] = \
+                release_document
+
+    shared_document_ids = get_shared_document_ids(
+        content_release,
+        [release_document.id for release_document in existing_documents.values()],
+    )
+
+    documents_to_update = []
+    documents_to_create = []
+    unlinked_document_ids = []
+    for (content_type, document_key), (document_json, parameters) in documents.items():
+        release_document = existing_documents.get((content_type, document_key))
+        if release_document is not None and not release_document.deleted and {
+                parameter.key: parameter.content for parameter in release_document.parameters.all()
+        }.get('content_hash') == parameters.get('content_hash'):
+            increment_skipped_publishes(content_release.site_code)
+            continue
+
+        if release_document is None or release_document.id in shared_document_ids:
+            if release_document is not None:
+                unlinked_document_ids.append(release_document.id)
+            documents_to_create.append((ReleaseDocument(
+                document_key=document_key,
+                content_type=content_type,
+                document_json=document_json,
+            ), parameters))
+        else:
+            release_document.document_json = document_json
+            release_document.deleted = False
+            documents_to_update.append((release_document, parameters))
+
+    with transaction.atomic():
+        for chunk in chunked(unlinked_document_ids, DOCUMENT_REFS_CHUNK_SIZE):
+            through.objects.filter(
+                **{release_fk: content_release.pk, '{}__in'.format(document_fk): chunk},
+            ).delete()
+
+        ReleaseDocument.objects.bulk_update(
+            [release_document for release_document, parameters in documents_to_update],
+            ['document_json', 'deleted'],
+            batch_size=DOCUMENT_REFS_CHUNK_SIZE,
+        )
+        for chunk in chunked(documents_to_update, DOCUMENT_REFS_CHUNK_SIZE):
+            parameter_model.objects.filter(**{'{}__in'.format(parameter_fk): [
+                release_document for release_document, parameters in chunk
+            ]}).delete()
+
+        if connection.features.can_return_rows_from_bulk_insert:
+            ReleaseDocument.objects.bulk_create(
+                [release_document for release_document, parameters in documents_to_create],
+                batch_size=DOCUMENT_REFS_CHUNK_SIZE,
             )
+        else:
+            for release_document, parameters in documents_to_create:
+                release_document.save()
+        through.objects.bulk_create([
+            through(**{release_fk: content_release.pk, document_fk: release_document.pk})
+            for release_document, parameters in documents_to_create
+        ], batch_size=DOCUMENT_REFS_CHUNK_SIZE)
+
+        parameter_model.objects.bulk_create([
+            parameter_model(**{parameter_fk: release_document, 'key': key, 'content': str(value)})
+            for release_document, parameters in documents_to_update + documents_to_create
+            for key, value in parameters.items()
+        ], batch_size=DOCUMENT_REFS_CHUNK_SIZE)
+
+    return [
+        (release_document.content_type, release_document.document_key)
+        for release_document, parameters in documents_to_update + documents_to_create
+    ]
 
-            if response['status'] == 'success':
-                elt_list = elt_list[:-1]
-                elt_list.append('data')
-                set_in_dict(content, elt_list, json.loads(response['content'].document_json))
-            else:
-                raise Exception(response['error_msg'])
-        except:
-            elements_to_remove.append(elt_list[:-1])
-    updated = True
 
-    return content, updated
+def publish_many_to_release(instances, content_release, extra_parameters=None):
+    """
+    publish_many_to_release
+    Publish the documents of several instances (pages or models with release) to the release
+    with batched writes, content_was_published isn't sent for each page but
+    contents_were_published is sent once with all the published pages.
+    """
+    documents = []
+    dynamic_documents = {}
+    pages = {}
+    for instance in instances:
+        instance_parameters = dict(extra_parameters or {})
+        instance_parameters.update(instance.get_release_parameters())
+        for serializer_item, data, parameters, dynamic_element_keys in \
+                instance.serialize_for_release(instance_parameters):
+            document_ref = (serializer_item['type'], str(serializer_item['key']))
+            documents.append((
+                serializer_item['type'],
+                serializer_item['key'],
+                json.dumps(data),
+                parameters,
+            ))
+            dynamic_documents[document_ref] = [
+                get_from_dict(data, elt_list) for elt_list in dynamic_element_keys
+            ]
+            if serializer_item['type'] == 'page':
+                data['full_path'] = serializer_item['key']
+                pages[document_ref] = {
+                    'title': data.get('title'),
+                    'content': data,
+                    'page': instance,
+                }
+
+    document_refs = write_release_documents(content_release, documents)
+    if not document_refs:
+        return {
+            'status': 'success',
+            'content': {'published': 0, 'skipped': len(documents)},
+        }
+
+    invalidate_release_documents(content_release, document_refs)
+
+    references = get_dynamic_element_references([
+        item for document_ref in document_refs for item in dynamic_documents[document_ref]
+    ])
+    document_references = {}
+    for document_ref in document_refs:
+        document_references[document_ref] = []
+        for item in dynamic_documents[document_ref]:
+            try:
+                reference = references.get(get_dynamic_element_key(item))
+            except (KeyError, TypeError):
+                continue
+            if reference is not None:
+                document_references[document_ref].append(reference)
+    set_dynamic_element_references(content_release, document_references)
+    refresh_dependent_documents(content_release, document_refs)
+    if is_materialized_release(content_release):
+        materialize_release(content_release)
+
+    contents = [pages[document_ref] for document_ref in document_refs if document_ref in pages]
+    if contents:
+        contents_were_published.send(
+            sender=WSSPContentRelease,
+            site_id=content_release.site_code,
+            release_id=content_release.uuid,
+            contents=contents,
+        )
+
+    return {
+        'status': 'success',
+        'content': {
+            'published': len(document_refs),
+            'skipped': len(documents) - len(document_refs),
+        },
+    }
+
+
+def unpublish_or_delete_many_from_release(instances, content_release, delete=False):
+    """
+    unpublish_or_delete_many_from_release
+    Unpublish (or remove) the documents of several instances from the release with a few
+    UPDATE/DELETE queries. The documents the release shares with other releases and the
+    documents to unpublish which aren't in the release go through the PublisherAPI.
+    """
+    parameter_model, parameter_fk, through, release_fk, document_fk = \
+        get_release_document_relations()
+    document_refs = list({
+        (serializer_item['type'], str(serializer_item['key']))
+        for instance in instances
+        for serializer_item in instance.get_serializers().values()
+    })
+
+    release_documents = {}
+    for chunk in chunked(document_refs, DOCUMENT_REFS_CHUNK_SIZE):
+        for release_document in content_release.release_documents.filter(
+                get_documents_filter(chunk)).only('id', 'content_type', 'document_key'):
+            release_documents[(release_document.content_type, release_document.document_key)] = \
+                release_document
+    shared_document_ids = get_shared_document_ids(
+        content_release,
+        [release_document.id for release_document in release_documents.values()],
+    )
+    document_ids = [
+        release_document.id for release_document in release_documents.values()
+        if release_document.id not in shared_document_ids
+    ]
+
+    publisher_api_refs = []
+    with transaction.atomic():
+        if delete:
+            for chunk in chunked(
+                    [release_document.id for release_document in release_documents.values()],
+                    DOCUMENT_REFS_CHUNK_SIZE):
+                through.objects.filter(
+                    **{release_fk: content_release.pk, '{}__in'.format(document_fk): chunk},
+                ).delete()
+            for chunk in chunked(document_ids, DOCUMENT_REFS_CHUNK_SIZE):
+                ReleaseDocument.objects.filter(id__in=chunk).delete()
+        else:
+            for chunk in chunked(document_ids, DOCUMENT_REFS_CHUNK_SIZE):
+                ReleaseDocument.objects.filter(id__in=chunk).update(deleted=True)
+            publisher_api_refs = [
+                document_ref for document_ref in document_refs
+                if document_ref not in release_documents or
+                release_documents[document_ref].id in shared_document_ids
+            ]
+
+    publisher_api = PublisherAPI()
+    for content_type, document_key in publisher_api_refs:
+        response = publisher_api.unpublish_document_from_content_release(
+            site_code=content_release.site_code,
+            release_uuid=content_release.uuid,
+            document_key=document_key,
+            content_type=content_type,
+        )
+        if response['status'] != 'success':
+            raise Exception(response['error_msg'])
+
+    invalidate_release_documents(content_release, document_refs)
+    set_dynamic_element_references(
+        content_release, {document_ref: [] for document_ref in document_refs})
+    refresh_dependent_documents(content_release, document_refs)
+    if is_materialized_release(content_release):
+        materialize_release(content_release)
+
+    return {
+        'status': 'success',
+        'content': {
+            'documents': len(release_documents) if delete else len(document_refs),
+        },
+    }
 
 
 class WithRelease(models.Model):
@@ -361,9 +1486,12 @@ class WithRelease(models.Model):
     @property
     def live_release(self):
         """ live_release """
-        site_code = self.site_code if hasattr(self, 'site_code') else site_code
+        site_code = getattr(self, 'site_code', None)
         if site_code is not None:
-            return WSSPContentRelease.objects.live(site_code=site_code)
+            live_release = get_live_release(site_code)
+            if live_release is None:
+                raise WSSPContentRelease.DoesNotExist
+            return live_release
         return None
 
     def get_key(self):
@@ -379,17 +1507,21 @@ class WithRelease(models.Model):
         """ get_serializers """
         raise ValueError(_('get_serializers is not define'))
 
-    def publish_to_release(self, instance=None, content_release=None, extra_parameters={}):
-        """ publish_to_release """
-        if not instance:
-            instance = self
-
-        if not content_release:
-            content_release = self.content_release
-
+    def get_release_parameters(self):
+        """ get_release_parameters, extra parameters used by publish_many_to_release """
+        return {}
+
+    def serialize_for_release(self, extra_parameters=None):
+        """
+        serialize_for_release
+        return a list of (serializer_item, data, parameters, dynamic_element_keys) with a
+        document per serializer, the parameters include the content_hash of the document
+        """
+        documents = []
         serializers = self.get_serializers()
 
         for key, serializer_item in serializers.items():
+            parameters = dict(extra_parameters or {})
             have_dynamic_elements = False
             serialized_page = serializer_item['class'](instance=self)
             data = serialized_page.data
@@ -397,14 +1529,36 @@ class WithRelease(models.Model):
                 data['meta']['full_path'] = serializer_item['key']
             dynamic_element_keys = get_dynamic_element_keys(data)
             if dynamic_element_keys:
-                extra_parameters.update({
+                parameters.update({
                     'dynamic_element_keys': json.dumps(dynamic_element_keys),
                 })
                 have_dynamic_elements = True
 
-            extra_parameters.update({
+            parameters.update({
                 'have_dynamic_elements': have_dynamic_elements,
             })
+            parameters['content_hash'] = get_document_content_hash(data, parameters)
+            documents.append((serializer_item, data, parameters, dynamic_element_keys))
+        return documents
+
+    def publish_to_release(self, instance=None, content_release=None, extra_parameters=None):
+        """
+        publish_to_release
+        The documents identical to the ones already in the release are not published again.
+        """
+        if not instance:
+            instance = self
+
+        if not content_release:
+            content_release = self.content_release
+
+        documents = self.serialize_for_release(extra_parameters)
+
+        for serializer_item, data, parameters, dynamic_element_keys in documents:
+            if is_document_unchanged(content_release, serializer_item['type'],
+                                     serializer_item['key'], parameters['content_hash']):
+                increment_skipped_publishes(content_release.site_code)
+                continue
 
             publisher_api = PublisherAPI()
             json_data = json.dumps(data)
@@ -414,10 +1568,28 @@ class WithRelease(models.Model):
                 json_data,
                 serializer_item['key'],
                 serializer_item['type'],
-                extra_parameters,
+                parameters,
             )
 
             if response['status'] == 'success':
+                invalidate_release_documents(
+                    content_release, [(serializer_item['type'], serializer_item['key'])])
+                set_dynamic_element_references(content_release, {
+                    (serializer_item['type'], serializer_item['key']):
+                        get_dynamic_element_references([
+                            get_from_dict(data, elt_list) for elt_list in dynamic_element_keys
+                        ]).values(),
+                })
+                refresh_dependent_documents(
+                    content_release, [(serializer_item['type'], serializer_item['key'])])
+                if is_materialized_release(content_release):
+                    update_materialized_documents(
+                        content_release,
+                        serializer_item['type'],
+                        serializer_item['key'],
+                        json.loads(json_data),
+                        dynamic_element_keys,
+                    )
                 if serializer_item['type'] == 'page':
                     data['full_path'] = serializer_item['key']
                     content_was_published.send(sender=self.__class__, site_id=content_release.site_code, release_id=content_release.uuid, title=data.get("title"), content=data, page=self)
@@ -426,15 +1598,18 @@ class WithRelease(models.Model):
 
 
     def unpublish_or_delete_from_release(self, release_id, recursively=False, delete=False):
-        """ unpublish_or_delete_from_release """
-        if recursively:
-            for child_page in self.get_children():
-                try:
-                    child_page.specific.unpublish_or_delete_from_release(
-                        release_id, recursively, delete)
-                except AttributeError:
-                    pass
+        """
+        unpublish_or_delete_from_release
+        The page and its descendants are unpublished (or removed) at once when recursively is set.
+        """
         content_release = WSSPContentRelease.objects.get(id=release_id)
+        if recursively:
+            instances = [self] + [
+                page for page in self.get_descendants().specific()
+                if isinstance(page, WithRelease)
+            ]
+            return unpublish_or_delete_many_from_release(instances, content_release, delete)
+
         publisher_api = PublisherAPI()
 
         serializers = self.get_serializers()
@@ -452,6 +1627,15 @@ class WithRelease(models.Model):
                 response = publisher_api.unpublish_document_from_content_release(**paramaters)
             if response['status'] != 'success':
                 raise Exception(response['error_msg'])
+            invalidate_release_documents(
+                content_release, [(serializer_item['type'], serializer_item['key'])])
+            set_dynamic_element_references(
+                content_release, {(serializer_item['type'], serializer_item['key']): []})
+            refresh_dependent_documents(
+                content_release, [(serializer_item['type'], serializer_item['key'])])
+            if is_materialized_release(content_release):
+                update_materialized_documents(
+                    content_release, serializer_item['type'], serializer_item['key'])
         return response
 
 
@@ -485,12 +1669,15 @@ class ModelWithRelease(WithRelease):
         # get live release
         if self.publish_to_live_release:
             self.publish_to_live_release = False
-            publisher_api = PublisherAPI()
-            response = publisher_api.get_live_content_release(self.site_code)
-            if response['status'] == 'error':
-                raise ValidationError({'site_code': response['error_msg']})
+            live_release = get_live_release(self.site_code)
+            if live_release is None:
+                publisher_api = PublisherAPI()
+                response = publisher_api.get_live_content_release(self.site_code)
+                if response['status'] == 'error':
+                    raise ValidationError({'site_code': response['error_msg']})
+                live_release = WSSPContentRelease.objects.get(id=response['content'].id)
 
-            self.content_release = WSSPContentRelease.objects.get(id=response['content'].id)
+            self.content_release = live_release
 
 
     def save(self, *args, **kwargs):
@@ -526,6 +1713,30 @@ class PageWithRelease(Page, WithRelease):
         """ get_name_slug """
         return 'page'
 
+    def publish_recursively_to_release(self, content_release=None):
+        """
+        publish_recursively_to_release
+        Publish the page and all its descendants, the subtree is loaded with one query per page
+        type and published with publish_many_to_release.
+        """
+        if not content_release:
+            content_release = self.content_release
+
+        pages = [self] + [
+            page for page in self.get_descendants().specific()
+            if isinstance(page, WithRelease)
+        ]
+        return publish_many_to_release(pages, content_release)
+
+    def get_release_parameters(self):
+        """ get_release_parameters """
+        revision_id = self.live_revision_id
+        if revision_id is None:
+            revision_id = getattr(self.get_latest_revision(), 'id', None)
+        if revision_id is None:
+            return {'title': self.title}
+        return {'revision_id': revision_id, 'title': self.title}
+
     def serve_preview(self, request, mode_name='default', load_dynamic_element=False):
         """ serve_preview """
         request.is_preview = True
@@ -549,7 +1760,83 @@ class PageWithRelease(Page, WithRelease):
             # if submitted_for_moderation:
             #     pass
             # else:
-            page = revision.as_page_object()
-            self.publish_to_release(page, assigned_release, {'revision_id': revision.id})
+            if is_deferred_publish():
+                enqueue_publish_job(self, revision, assigned_release)
+            else:
+                page = revision.as_page_object()
+                self.publish_to_release(page, assigned_release, {
+                    'revision_id': revision.id,
+                    'title': page.title,
+                })
 
         return revision
+
+
+class PublishJob(models.Model):
+    """
+    PublishJob, page revision waiting to be published to a release by the process_publish_queue
+    command, there is at most one job per page and release
+    """
+    page = models.ForeignKey(Page, related_name='publish_jobs', on_delete=models.CASCADE)
+    revision = models.ForeignKey(PageRevision, related_name='+', on_delete=models.CASCADE)
+    content_release = models.ForeignKey(
+        WSSPContentRelease,
+        related_name='publish_jobs',
+        on_delete=models.CASCADE,
+    )
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        """ Meta """
+        unique_together = ('page', 'content_release')
+
+
+def is_deferred_publish():
+    """ is_deferred_publish """
+    return getattr(settings, 'WSSP_DEFERRED_PUBLISH', False)
+
+
+def enqueue_publish_job(page, revision, content_release):
+    """
+    enqueue_publish_job
+    A job already waiting for the page and the release is updated to the new revision
+    """
+    job, created = PublishJob.objects.update_or_create(
+        page_id=page.id,
+        content_release=content_release,
+        defaults={
+            'revision': revision,
+            'attempts': 0,
+            'last_error': '',
+        },
+    )
+    return job
+
+
+def process_publish_job(job):
+    """
+    process_publish_job
+    Publish the revision of the job, the job is removed unless a newer revision has been
+    enqueued in the meantime. return True if the revision has been published.
+    """
+    try:
+        page = job.revision.as_page_object()
+        page.publish_to_release(page, job.content_release, {
+            'revision_id': job.revision_id,
+            'title': page.title,
+        })
+    except Exception as e:
+        logger.exception('Publishing revision %s to release %s failed', job.revision_id,
+                         job.content_release.uuid)
+        PublishJob.objects.filter(id=job.id, revision_id=job.revision_id).update(
+            attempts=models.F('attempts') + 1,
+            last_error=str(e),
+            updated_at=timezone.now(),
+        )
+        return False
+
+    PublishJob.objects.filter(id=job.id, revision_id=job.revision_id).delete()
+    return True
@@ -1,6 +1,7 @@
 from django import dispatch
 
 content_was_published = dispatch.Signal(providing_args=["site_id", "release_id", "title", "content", "page"])
+contents_were_published = dispatch.Signal(providing_args=["site_id", "release_id", "contents"])
 content_was_unpublsished = dispatch.Signal(providing_args=["site_id", "release_id", "title", "content", "page"])
 release_was_staged = dispatch.Signal(providing_args=["release"])
 reindex_release = dispatch.Signal(providing_args=["release"])
\ No newline at end of file
@@ -3,10 +3,33 @@ $(function() {
     function submitActions() {
         //publish action
         $("#wssp-actionrelease-publish-release").click(function (e) {
+            if($('#publish_recursively').is(':checked')){
+                //the saved version of the page and of its sub pages are published
+                e.preventDefault();
+                const releaseId = $('#id_content_release_publish').val()
+                const editFormAction = $('#id_content_release').closest("form").attr('action');
+                postToAdmin(editFormAction.replace('/edit/', `/publish/${releaseId}/recursively/`), {});
+                return;
+            }
             $('#id_content_release').val($('#id_content_release_publish').val());
             $('#id_content_release').closest("form").submit();
         });
 
+        //publish sub pages action
+        $("#wssp-actionrelease-publish-children-release").click(function (e) {
+            e.preventDefault();
+            const releaseId = $('#id_content_release_publish-children').val()
+            const pageIds = $('.publish-children-page:checked').map(function () {
+                return $(this).val();
+            }).get();
+            if(!releaseId || releaseId == '0' || !pageIds.length) {
+                return;
+            }
+            const editFormAction = $('#id_content_release').closest("form").attr('action');
+            const adminUrl = editFormAction.replace(/pages\/\d+\/edit\/.*$/, '');
+            postToAdmin(`${adminUrl}pages/publish/${releaseId}/`, {page_id: pageIds});
+        });
+
         //unpublish action
         $("#wssp-actionrelease-unpublish-release").click(function (e) {
             e.preventDefault();
@@ -44,6 +67,65 @@ $(function() {
         }); 
     }
 
+    function postToAdmin(url, parameters) {
+        //the publish views only accept POST requests
+        let form = $("<form />", {"method": "post", "action": url});
+        form.append($("<input />", {
+            "type": "hidden",
+            "name": "csrfmiddlewaretoken",
+            "value": $('input[name="csrfmiddlewaretoken"]').first().val(),
+        }));
+        form.append($("<input />", {"type": "hidden", "name": "next", "value": window.location.href}));
+        $.each(parameters, function (name, values) {
+            $.each([].concat(values), function (index, value) {
+                form.append($("<input />", {"type": "hidden", "name": name, "value": value}));
+            });
+        });
+        form.appendTo("body").submit();
+    }
+
+    function setUpChildPages(id) {
+        //add a checkbox per sub page to the popup, the sub pages are loaded a page at a time
+        //when the popup is opened
+        let childPagesComponent = $("<ul />", {"class": "publish-children-pages"});
+        let loadMoreButton = $("<button />", {"class": "button button-secondary", "text": "Load more sub pages"}).hide();
+        let nextPage = 1;
+
+        function loadChildPages() {
+            $.getJSON(childPagesUrl, {p: nextPage}, function (response) {
+                $.each(response.content.pages, function (index, childPage) {
+                    childPagesComponent.append($("<li />", {"class": "field boolean_field checkbox_input"}).append(
+                        $("<input />", {
+                                "type": "checkbox",
+                                "class": "publish-children-page",
+                                "id": `publish_children_page_${childPage.id}`,
+                                "value": childPage.id,
+                                "checked": true,
+                            }
+                        ),
+                        $("<label />", {
+                                "for": `publish_children_page_${childPage.id}`,
+                                "text": childPage.title,
+                            }
+                        ),
+                    ));
+                });
+                nextPage = response.content.next_page;
+                loadMoreButton.toggle(nextPage !== null);
+            });
+        }
+
+        loadMoreButton.click(function (e) {
+            e.preventDefault();
+            loadChildPages();
+        });
+        $(`#${id}-popup .popup > button`).first().before(childPagesComponent, loadMoreButton);
+
+        $(`button[name="${id}"]`).one('click', function () {
+            loadChildPages();
+        });
+    }
+
     function setUpReleasePopUp(action, show_release_dropdown, id, title, submitBtnCopy, recursively, recursivelyText) {
         //create popup
         const publishReleasePop = `<div id="${id}-popup" class="popup-cover"><div class="popup"></div></div>`;
@@ -153,7 +235,9 @@ $(function() {
 
             if(siteCode){
                 releaseFiltering('id_content_release');
-                setUpReleasePopUp('publish', true, 'wssp-actionrelease-publish-release', 'Publish to a release', 'Publish');
+                setUpReleasePopUp('publish', true, 'wssp-actionrelease-publish-release', 'Publish to a release', 'Publish', true, 'Publish the saved page and all sub pages');
+                setUpReleasePopUp('publish-children', true, 'wssp-actionrelease-publish-children-release', 'Publish sub pages to a release', 'Publish');
+                setUpChildPages('wssp-actionrelease-publish-children-release');
                 setUpReleasePopUp('unpublish', true, 'wssp-actionrelease-unpublish-release', 'Unpublish from a release', 'Unpublish', true, 'Unpublish all sub pages');
                 setUpReleasePopUp('remove', true, 'wssp-actionrelease-remove-release', 'Remove from a release', 'Remove', true, 'Remove all sub pages');
                 setUpReleasePopUp('publish-live', false, 'wssp-actionliverelease-publish-live-release', 'Publish the current live release', 'Publish');
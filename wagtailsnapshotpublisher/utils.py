@@ -3,6 +3,9 @@
 """
 
 from functools import reduce  # forward compatibility for Python 3
+from itertools import islice
+import hashlib
+import json
 import operator
 
 
@@ -21,26 +24,58 @@ def del_in_dict(data_dict, map_list):
     del get_from_dict(data_dict, map_list[:-1])[map_list[-1]]
 
 
-def get_dynamic_element_keys(data, keys=[], key=None, result=[]):
+def chunked(iterable, size):
+    """ chunked, yield lists of size items from iterable """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def get_content_hash(data):
+    """ get_content_hash from the canonical json of data """
+    canonical_json = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical_json.encode('utf-8')).hexdigest()
+
+
+def get_path_from_node(path_node):
+    """ get_path_from_node, path_node is a (parent path_node, key) linked list """
+    keys = []
+    while path_node is not None:
+        path_node, key = path_node
+        keys.append(key)
+    keys.reverse()
+    return keys
+
+
+def iter_dynamic_element_keys(data):
+    """
+    iter_dynamic_element_keys
+    yield lazily the path of the dict of each dynamic element of data, walking it depth first
+    with a stack. The nodes of the stack share the path of their parent, a path is only built
+    when a dynamic element is found, scalars and empty containers are never pushed.
+    """
+    container_types = (dict, list, tuple)
+    stack = [(data, None)]
+    pop = stack.pop
+    extend = stack.extend
+    while stack:
+        node, path_node = pop()
+        children = []
+        for key, value in (node.items() if isinstance(node, dict) else enumerate(node)):
+            if isinstance(value, container_types):
+                if value:
+                    children.append((value, (path_node, key)))
+            elif key == 'dynamic' and value:
+                yield get_path_from_node(path_node)
+        if children:
+            children.reverse()
+            extend(children)
+
+
+def get_dynamic_element_keys(data):
     """ get_dynamic_element_keys """
-    keys_cp = keys.copy()
-
-    if key is None:
-        result = list()
-
-    if key is not None and (
-            isinstance(data, dict) or isinstance(data, list) or isinstance(data, tuple)):
-        keys_cp.append(key)
-
-    if isinstance(data, dict):
-        for k, item in data.items():
-            get_dynamic_element_keys(item, keys_cp, k, result)
-    elif isinstance(data, list) or isinstance(data, tuple):
-        for i, item in enumerate(data):
-            get_dynamic_element_keys(item, keys_cp, i, result)
-    else:
-        if key == 'dynamic' and data:
-            result.append(keys_cp)
-
-    if key is None:
-        return result
+    if not isinstance(data, (dict, list, tuple)):
+        return []
+    return list(iter_dynamic_element_keys(data))
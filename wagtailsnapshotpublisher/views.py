@@ -8,28 +8,54 @@ from datetime import datetime
 
 from django.apps import apps
 from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
 from django.forms.models import modelform_factory
-from django.http import JsonResponse, HttpResponseServerError, Http404
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, HttpResponseServerError, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.cache import get_conditional_response
+from django.urls import reverse
+from django.utils.http import http_date, url_has_allowed_host_and_scheme, urlencode
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 from django.core import serializers
 from django.db.models import Q
+from django.views.decorators.http import require_POST
 
-from wagtail.core.models import Page, PageRevision
+from wagtail.core.models import Page, PageRevision, UserPagePermissionsProxy
 from wagtail.admin import messages
 
 from djangosnapshotpublisher.publisher_api import PublisherAPI
-from djangosnapshotpublisher.models import ContentRelease
-
-from .models import WSSPContentRelease, document_load_dynamic_elements
+from djangosnapshotpublisher.models import ContentRelease, ReleaseDocument
+
+from .cache import (
+    cache_comparison, cache_document, get_cached_comparison, get_cached_document,
+    get_cached_documents, get_comparison_cache_key, get_document_cache, get_document_version,
+    get_document_versions, get_live_release, get_release_generation, get_release_pointer,
+    get_skipped_publishes, refresh_release_pointer,
+)
+from .models import (
+    WSSPContentRelease, WithRelease, document_load_dynamic_elements,
+    documents_load_dynamic_elements, get_documents_filter, get_overlay_documents, get_release_chain,
+    is_materialized_release, is_overlay_release, iter_release_document_refs, iter_release_documents,
+    materialize_release, publish_many_to_release,
+)
+from .diff import (
+    diff_release_documents, get_comparison_items, get_comparison_refs, get_release_document_ids,
+)
 from .forms import PublishReleaseForm, FrozenReleasesForm
-from .utils import get_dynamic_element_keys
+from .utils import chunked, get_content_hash, get_dynamic_element_keys
 from .signals import release_was_staged, reindex_release
 
 logger = logging.getLogger('django')
 
 DATETIME_FORMAT='%Y-%m-%d %H:%M'
+BATCH_MAX_DOCUMENTS = 50
+BATCH_WARM_DOCUMENTS = 500
+COMPARISON_PAGE_SIZE = 100
+CHILD_PAGES_PAGE_SIZE = 50
+COMPARISON_DIFF_CHOICES = ('Added', 'Changed', 'Removed')
 
 #
 # Return upcoming scheduled releases.
@@ -48,22 +74,20 @@ def get_releases(request, site_code):
 
     live_release = None
     stage_release = None
-    publisher_api = PublisherAPI()
+    release_pointer = get_release_pointer(site_code)
 
-    response = publisher_api.get_live_content_release(site_code)
-    if response['status'] == 'success':
+    if release_pointer['live'] is not None:
         live_release = {
-            'uuid': response['content'].uuid,
-            'title': response['content'].title,
-            'publish_datetime': response['content'].publish_datetime,
+            'uuid': release_pointer['live'].uuid,
+            'title': release_pointer['live'].title,
+            'publish_datetime': release_pointer['live'].publish_datetime,
         }
 
-    response = publisher_api.get_stage_content_release(site_code)
-    if response['status'] == 'success':
+    if release_pointer['stage'] is not None:
         stage_release = {
-            'uuid': response['content'].uuid,
-            'title': response['content'].title,
-            'publish_datetime': response['content'].publish_datetime,
+            'uuid': release_pointer['stage'].uuid,
+            'title': release_pointer['stage'].title,
+            'publish_datetime': release_pointer['stage'].publish_datetime,
         }
 
     return JsonResponse({
@@ -72,6 +96,13 @@ def get_releases(request, site_code):
     }, safe=False)
 
 
+def get_publish_stats(request, site_code):
+    """ get_publish_stats, counters of the publishing of the site for monitoring """
+    return JsonResponse({
+        'skipped_publishes': get_skipped_publishes(site_code),
+    })
+
+
 def list_live_and_upcoming_content_releases(site_code, status=None, after=None):
     """ list_content_releases """
     try:
@@ -86,10 +117,8 @@ def list_live_and_upcoming_content_releases(site_code, status=None, after=None):
         return { 'status': 'failed', 'content': 'Unable to fetch upcoming content releases' }
 
 
-def get_content_details(site_code, release_uuid, content_type, content_key):
-    """ get_content_details """
-    publisher_api = PublisherAPI()
-
+def get_content_release(site_code, release_uuid):
+    """ get_content_release """
     content_release = None
 
     try:
@@ -101,16 +130,70 @@ def get_content_details(site_code, release_uuid, content_type, content_key):
             )
         else:
             # get live ContentRelease
-            response = publisher_api.get_live_content_release(site_code)
-            if response['status'] == 'error':
-                return response
-            else:
-                release = response['content']
-                content_release = WSSPContentRelease.objects.get(id=release.id)
-                release_uuid = content_release.uuid
+            content_release = get_live_release(site_code)
+            if content_release is None:
+                publisher_api = PublisherAPI()
+                response = publisher_api.get_live_content_release(site_code)
+                if response['status'] == 'error':
+                    return response
+                content_release = WSSPContentRelease.objects.get(id=response['content'].id)
+            release_uuid = content_release.uuid
     except WSSPContentRelease.DoesNotExist:
         pass
 
+    return {
+        'status': 'success',
+        'content': content_release,
+        'release_uuid': release_uuid,
+    }
+
+
+def is_content_release_cacheable(content_release):
+    """ is_content_release_cacheable """
+    # documents of preview releases can fall back to the base release so they are not cached
+    return content_release is not None and content_release.status != 0
+
+
+def get_content_document(site_code, content_release, release_uuid, content_type, content_key):
+    """ get_content_document """
+    publisher_api = PublisherAPI()
+
+    cacheable = is_content_release_cacheable(content_release)
+    generation = None
+    version = None
+    if cacheable:
+        generation = get_release_generation(release_uuid)
+        version = get_document_version(site_code, release_uuid, content_type, content_key)
+        cached_document = get_cached_document(site_code, release_uuid, content_type, content_key)
+        if cached_document is not None:
+            return {
+                'status': 'success',
+                'content': cached_document['data'],
+                'etag': get_document_etag(release_uuid, cached_document['data'], version,
+                                          generation),
+            }
+
+    if is_overlay_release(content_release):
+        # the documents of the overlay releases can come from their base releases
+        responses = get_content_documents(
+            site_code, content_release, release_uuid, [(content_type, content_key)])
+        return responses[(content_type, str(content_key))]
+
+    if is_materialized_release(content_release):
+        document_json = content_release.materialized_documents.filter(
+            document_key=str(content_key),
+            content_type=content_type,
+        ).values_list('document_json', flat=True).first()
+        if document_json is not None:
+            data = json.loads(document_json)
+            cache_document(site_code, release_uuid, content_type, content_key, data,
+                           dynamic=True, generation=generation, version=version)
+            return {
+                'status': 'success',
+                'content': data,
+                'etag': get_document_etag(release_uuid, data, version, generation),
+            }
+
     # Fetch document from the content release.
     response = publisher_api.get_document_from_content_release(
         site_code,
@@ -124,10 +207,7 @@ def get_content_details(site_code, release_uuid, content_type, content_key):
         # Release doc not found, try in the base release for preview releases.
         if content_release.status == 0:
             if content_release.use_current_live_as_base_release:
-                response = publisher_api.get_live_content_release(site_code)
-                if response['status'] == 'success':
-                    release = response['content']
-                    base_content_release = WSSPContentRelease.objects.get(id=release.id)
+                base_content_release = get_live_release(site_code)
             else:
                 base_content_release = content_release.base_release
 
@@ -149,16 +229,292 @@ def get_content_details(site_code, release_uuid, content_type, content_key):
             content_key,
             content_type,
         )
+        have_dynamic_elements = False
+        content_hash = None
         if response_extra['status'] == 'success':
             try:
                 dynamic_element_keys = json.loads(response_extra['content'].get(key='dynamic_element_keys').content)
-                data, updated = document_load_dynamic_elements(content_release, data, dynamic_element_keys)
+                have_dynamic_elements = True
+                data = document_load_dynamic_elements(content_release, data, dynamic_element_keys)
             except:
                 pass
+            if not have_dynamic_elements:
+                content_hash = response_extra['content'].filter(
+                    key='content_hash').values_list('content', flat=True).first()
     else:
         return response
 
-    return data
+    if cacheable:
+        cache_document(site_code, release_uuid, content_type, content_key, data,
+                       dynamic=have_dynamic_elements, generation=generation, version=version)
+
+    return {
+        'status': 'success',
+        'content': data,
+        'etag': get_document_etag(release_uuid, data, version, generation, content_hash),
+    }
+
+
+def get_content_details(site_code, release_uuid, content_type, content_key):
+    """ get_content_details """
+    response = get_content_release(site_code, release_uuid)
+    if response['status'] == 'error':
+        return response
+
+    response = get_content_document(site_code, response['content'], response['release_uuid'],
+                                    content_type, content_key)
+    if response['status'] == 'error':
+        return response
+
+    return response['content']
+
+
+def get_content_documents(site_code, content_release, release_uuid, document_refs):
+    """
+    get_content_documents
+    document_refs is a list of (content_type, content_key), return a dict with the response of
+    get_content_document for each of them, the documents are fetched together.
+    """
+    document_refs = [(content_type, str(content_key)) for content_type, content_key in document_refs]
+    responses = {}
+
+    cacheable = is_content_release_cacheable(content_release)
+    generation = None
+    versions = {}
+    if cacheable:
+        generation = get_release_generation(release_uuid)
+        versions = get_document_versions(site_code, release_uuid, document_refs)
+        cached_documents = get_cached_documents(site_code, release_uuid, document_refs)
+        for document_ref, cached_document in cached_documents.items():
+            responses[document_ref] = {
+                'status': 'success',
+                'content': cached_document['data'],
+                'etag': get_document_etag(release_uuid, cached_document['data'],
+                                          versions.get(document_ref), generation),
+            }
+
+    def add_document(content_type, content_key, data, dynamic, content_hash=None):
+        """ add_document """
+        version = versions.get((content_type, content_key))
+        if cacheable:
+            cache_document(site_code, release_uuid, content_type, content_key, data,
+                           dynamic=dynamic, generation=generation, version=version)
+        responses[(content_type, content_key)] = {
+            'status': 'success',
+            'content': data,
+            'etag': get_document_etag(release_uuid, data, version, generation, content_hash),
+        }
+
+    missing_refs = [document_ref for document_ref in document_refs if document_ref not in responses]
+    if missing_refs and is_materialized_release(content_release):
+        materialized_documents = content_release.materialized_documents.filter(
+            get_documents_filter(missing_refs),
+        ).values_list('content_type', 'document_key', 'document_json')
+        for content_type, content_key, document_json in materialized_documents:
+            add_document(content_type, content_key, json.loads(document_json), True)
+        missing_refs = [document_ref for document_ref in missing_refs if document_ref not in responses]
+
+    if missing_refs and is_overlay_release(content_release):
+        release_documents = get_overlay_documents(content_release, missing_refs)
+    elif missing_refs and content_release is not None:
+        content_releases = [content_release]
+        # documents not found in preview releases are fetched from the base release
+        if content_release.status == 0:
+            live_release = get_live_release(site_code)
+            if content_release.use_current_live_as_base_release and live_release is not None:
+                content_releases.append(live_release)
+            elif not content_release.use_current_live_as_base_release and \
+                    content_release.base_release:
+                content_releases.append(content_release.base_release)
+
+        release_documents = {}
+        for release in content_releases:
+            refs_to_fetch = [
+                document_ref for document_ref in missing_refs if document_ref not in release_documents]
+            if not refs_to_fetch:
+                break
+            documents = release.release_documents.filter(
+                get_documents_filter(refs_to_fetch),
+                deleted=False,
+            ).prefetch_related('parameters')
+            for release_document in documents:
+                release_documents.setdefault(
+                    (release_document.content_type, release_document.document_key), release_document)
+
+    if missing_refs and content_release is not None:
+        dynamic_documents = []
+        for document_ref, release_document in release_documents.items():
+            data = json.loads(release_document.document_json)
+            parameters = {
+                parameter.key: parameter.content for parameter in release_document.parameters.all()}
+            if 'dynamic_element_keys' in parameters:
+                dynamic_documents.append(
+                    (document_ref, data, json.loads(parameters['dynamic_element_keys'])))
+            else:
+                add_document(document_ref[0], document_ref[1], data, False,
+                             parameters.get('content_hash'))
+
+        loaded_documents = documents_load_dynamic_elements(content_release, [
+            (data, dynamic_element_keys) for document_ref, data, dynamic_element_keys in dynamic_documents
+        ])
+        for (document_ref, data, dynamic_element_keys), loaded_data in zip(
+                dynamic_documents, loaded_documents):
+            add_document(document_ref[0], document_ref[1], loaded_data, True)
+
+    for document_ref in document_refs:
+        if document_ref not in responses:
+            responses[document_ref] = {
+                'status': 'error',
+                'error_code': 'release_document_does_not_exist',
+                'error_msg': _('Document does not exist in the release'),
+            }
+    return responses
+
+
+def get_document_etag(release_uuid, data, version=None, generation=None, content_hash=None):
+    """
+    get_document_etag
+    When the document cache is enabled the ETag is built from the version of the document and the
+    generation of the release, otherwise from the content_hash stored when the document was
+    published, so it can be checked before loading the document. The ETag of the documents with
+    dynamic elements or published without content_hash is built from the hash of the document.
+    """
+    if version is not None:
+        return '"{}-{}-{}"'.format(release_uuid, version, generation)
+    if content_hash is not None:
+        return '"{}-{}"'.format(release_uuid, content_hash)
+    return '"{}-{}"'.format(release_uuid, get_content_hash(data))
+
+
+def get_published_content_hash(content_release, content_type, content_key):
+    """
+    get_published_content_hash
+    return the content_hash parameter of the document, None if the document has dynamic elements
+    (its content depends on the documents it embeds) or was published without content_hash
+    """
+    document_ids = get_release_document_ids(content_release, [(content_type, str(content_key))])
+    if not document_ids:
+        return None
+    parameters = dict(ReleaseDocument.objects.filter(
+        id__in=document_ids.values(),
+        parameters__key__in=('content_hash', 'dynamic_element_keys'),
+    ).values_list('parameters__key', 'parameters__content'))
+    if 'dynamic_element_keys' in parameters:
+        return None
+    return parameters.get('content_hash')
+
+
+def get_document_not_modified_response(request, site_code, content_release, release_uuid,
+                                       content_type, content_key):
+    """
+    get_document_not_modified_response
+    return a 304 response if If-None-Match matches the ETag of the document, None if it doesn't or
+    if the ETag isn't known before loading the document
+    """
+    if 'HTTP_IF_NONE_MATCH' not in request.META or \
+            not is_content_release_cacheable(content_release):
+        return None
+
+    version = get_document_version(site_code, release_uuid, content_type, content_key)
+    if version is not None:
+        etag = get_document_etag(release_uuid, None, version, get_release_generation(release_uuid))
+    else:
+        content_hash = get_published_content_hash(content_release, content_type, content_key)
+        if content_hash is None:
+            return None
+        etag = get_document_etag(release_uuid, None, content_hash=content_hash)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+        if content_release.publish_datetime:
+            response['Last-Modified'] = http_date(content_release.publish_datetime.timestamp())
+    return response
+
+
+def conditional_document_response(request, etag, last_modified, data):
+    """
+    conditional_document_response
+    Only the ETag is used to validate the requests, documents can be published directly to the
+    live release after its publish datetime.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(data)
+
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def get_redirect_url(request, default_url):
+    """ get_redirect_url, the next parameter if it is safe """
+    next_url = request.POST.get('next') or request.GET.get('next')
+    if next_url and url_has_allowed_host_and_scheme(
+            next_url, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+        return next_url
+    return default_url
+
+
+def check_can_publish_pages(request, pages):
+    """ check_can_publish_pages, raise PermissionDenied if the user can't publish one of them """
+    user_permissions = UserPagePermissionsProxy(request.user)
+    for page in pages:
+        if not user_permissions.for_page(page).can_publish():
+            raise PermissionDenied
+
+
+def page_children(request, page_id):
+    """
+    page_children, return the id and title of a page of the children of the page as JSON, loaded
+    by the publish sub pages popup of the page editor
+    """
+    page = get_object_or_404(Page, id=page_id)
+    if not page.permissions_for_user(request.user).can_edit():
+        raise PermissionDenied
+
+    children_page = Paginator(
+        page.get_children().values('id', 'title'), CHILD_PAGES_PAGE_SIZE,
+    ).get_page(request.GET.get('p'))
+    return JsonResponse({
+        'status': 'success',
+        'content': {
+            'pages': list(children_page.object_list),
+            'next_page': children_page.next_page_number() if children_page.has_next() else None,
+        },
+    })
+
+
+@require_POST
+def publish_pages(request, release_id):
+    """ publish_pages, publish the pages of the page_id parameters to the release at once """
+    release = get_object_or_404(WSSPContentRelease, id=release_id)
+    pages = [
+        page for page in Page.objects.filter(id__in=request.POST.getlist('page_id')).specific()
+        if isinstance(page, WithRelease)
+    ]
+    check_can_publish_pages(request, pages)
+
+    response = publish_many_to_release(pages, release)
+    messages.success(request, _('{} documents published to {}, {} unchanged').format(
+        response['content']['published'], release.title, response['content']['skipped']))
+    return redirect(get_redirect_url(request, reverse(
+        'wagtailsnapshotpublisher_admin:release_detail', args=[release.id])))
+
+
+@require_POST
+def publish_recursively_page(request, page_id, release_id):
+    """ publish_recursively_page, publish the page and all its descendants to the release """
+    page = get_object_or_404(Page, id=page_id)
+    release = get_object_or_404(WSSPContentRelease, id=release_id)
+    check_can_publish_pages(request, page.get_descendants(inclusive=True))
+
+    response = page.specific.publish_recursively_to_release(release)
+    messages.success(request, _('{} documents published to {}, {} unchanged').format(
+        response['content']['published'], release.title, response['content']['skipped']))
+    return redirect(get_redirect_url(request, reverse(
+        'wagtailadmin_explore', args=[page.get_parent().id])))
 
 
 def unpublish_page(request, page_id, release_id, recursively=False):
@@ -216,7 +572,7 @@ def preview_model(request, content_app, content_class, content_id, preview_mode=
         if load_dynamic_element:
             dynamic_element_keys = get_dynamic_element_keys(data)
             if dynamic_element_keys:
-                data, updated = document_load_dynamic_elements(instance.live_release, data, dynamic_element_keys)
+                data = document_load_dynamic_elements(instance.live_release, data, dynamic_element_keys)
         return JsonResponse(data)
     else:
         if not settings.TESTING:
@@ -236,10 +592,34 @@ def preview_instance(request, content_app, content_class, content_id, preview_mo
     if load_dynamic_element:
         dynamic_element_keys = get_dynamic_element_keys(data)
         if dynamic_element_keys:
-            data, updated = document_load_dynamic_elements(instance.live_release, data, dynamic_element_keys)
+            data = document_load_dynamic_elements(instance.live_release, data, dynamic_element_keys)
     return JsonResponse(data)
 
 
+def get_release_comparison(release, release_to_compare_to):
+    """
+    get_release_comparison
+    return the refs of the comparison (see get_comparison_refs), they are cached until a document
+    of one of the releases (or of the base releases of an overlay release) is published,
+    unpublished or removed.
+    """
+    release_ids = {release.id, release_to_compare_to.id}
+    if is_overlay_release(release):
+        release_ids.update(get_release_chain(release))
+    if is_overlay_release(release_to_compare_to):
+        release_ids.update(get_release_chain(release_to_compare_to))
+    release_uuids = ContentRelease.objects.filter(id__in=release_ids).values_list('uuid', flat=True)
+    cache_key = get_comparison_cache_key(release.uuid, release_to_compare_to.uuid, release_uuids)
+
+    comparison_refs = get_cached_comparison(cache_key)
+    if comparison_refs is not None:
+        return comparison_refs
+
+    comparison_refs = get_comparison_refs(release, release_to_compare_to)
+    cache_comparison(cache_key, comparison_refs)
+    return comparison_refs
+
+
 def compare_release(request, release_id, release_id_to_compare_to=None, set_live_button=False, set_stage_button=False):
     """ compare_release """
     publisher_api = PublisherAPI()
@@ -272,59 +652,63 @@ def compare_release(request, release_id, release_id_to_compare_to=None, set_live
 
     # get current live release
     compare_with_live = True
-    response = publisher_api.get_live_content_release(release.site_code)
-    if response['status'] == 'error':
-        return {
-            'release': release,
-            'error_msg': response['error_msg'],
-            'publish_release_form': publish_release_form,
-        }
+    release_to_compare_to = get_live_release(release.site_code)
+    if release_to_compare_to is None:
+        response = publisher_api.get_live_content_release(release.site_code)
+        if response['status'] == 'error':
+            return {
+                'release': release,
+                'error_msg': response['error_msg'],
+                'publish_release_form': publish_release_form,
+            }
+        release_to_compare_to = WSSPContentRelease.objects.get(id=response['content'].id)
+
+    if release_id_to_compare_to is None and request.GET.get('compare_to', '').isdigit():
+        release_id_to_compare_to = int(request.GET['compare_to'])
 
-    release_to_compare_to = response['content']
     if release_id_to_compare_to and release_to_compare_to.id != release_id_to_compare_to:
         compare_with_live = False
         release_to_compare_to = WSSPContentRelease.objects.get(id=release_id_to_compare_to)
-    else:
-        release_to_compare_to = WSSPContentRelease.objects.get(id=release_to_compare_to.id)
 
-    response = publisher_api.compare_content_releases(release.site_code, release.uuid,
-                                                      release_to_compare_to.uuid)
-    comparison = response['content']
+    comparison_refs = get_release_comparison(release, release_to_compare_to)
 
-    added_pages = []
-    removed_pages = []
-    changed_pages = []
-    extra_contents = []
-    for item  in comparison:
-        if item['content_type'] == 'page':
-            if item['diff'] == 'Added':
-                page_revision = PageRevision.objects.get(id=item['parameters']['revision_id'])
-                item['page_revision'] = page_revision
-                item['title'] = json.loads(page_revision.content_json)['title']
-                added_pages.append(item)
-            if item['diff'] == 'Removed':
-                page_revision = PageRevision.objects.get(id=item['parameters']['revision_id'])
-                item['title'] = json.loads(page_revision.content_json)['title']
-                item['page_revision'] = page_revision
-                removed_pages.append(item)
-            if item['diff'] == 'Changed' and 'revision_id' in item['parameters']['release_from']:
-                page_revision = PageRevision.objects.get(
-                    id=item['parameters']['release_from']['revision_id'])
-                item['page_revision_from'] = page_revision
-                item['page_revision_compare_to'] = PageRevision.objects.get(
-                    id=item['parameters']['release_compare_to']['revision_id'])
-                item['title'] = json.loads(page_revision.content_json)['title']
-                changed_pages.append(item)
-        else:
-            extra_contents.append(item)
+    show_extra_contents = request.user.has_perm('wagtailadmin.access_dev')
+    diff_filter = request.GET.get('diff') or None
+    content_type_filter = request.GET.get('content_type') or None
+    content_types = sorted({
+        comparison_ref[1] for comparison_ref in comparison_refs
+        if show_extra_contents or comparison_ref[1] == 'page'
+    })
+    # only the items of the requested page are built
+    comparison_page = Paginator(
+        list(filter_comparison(
+            comparison_refs, diff_filter, content_type_filter, show_extra_contents)),
+        COMPARISON_PAGE_SIZE,
+    ).get_page(request.GET.get('p'))
+    comparison_page.object_list = get_comparison_items(comparison_page.object_list)
+
+    query = {}
+    if not compare_with_live:
+        query['compare_to'] = release_to_compare_to.id
+    if diff_filter:
+        query['diff'] = diff_filter
+    if content_type_filter:
+        query['content_type'] = content_type_filter
+
+    added_pages, changed_pages, removed_pages, extra_contents = get_comparison_rows(
+        comparison_page.object_list)
 
     return {
-        'comparison': comparison,
+        'comparison_page': comparison_page,
+        'comparison_query': urlencode(query),
+        'diff_filter': diff_filter,
+        'content_type_filter': content_type_filter,
+        'diff_choices': COMPARISON_DIFF_CHOICES,
+        'content_types': content_types,
         'added_pages': added_pages,
         'changed_pages': changed_pages,
         'removed_pages': removed_pages,
-        'extra_contents': json.dumps(extra_contents, indent=4) if extra_contents and \
-            request.user.has_perm('wagtailadmin.access_dev') else None,
+        'extra_contents': extra_contents if show_extra_contents else None,
         'release': release,
         'release_to_compare_to': release_to_compare_to,
         'publish_release_form': publish_release_form,
@@ -333,6 +717,150 @@ def compare_release(request, release_id, release_id_to_compare_to=None, set_live
     }
 
 
+def filter_comparison(comparison_refs, diff=None, content_type=None, show_extra_contents=True):
+    """ filter_comparison, yield the refs of the comparison matching the filters """
+    for comparison_ref in comparison_refs:
+        if diff is not None and comparison_ref[0] != diff:
+            continue
+        if content_type is not None and comparison_ref[1] != content_type:
+            continue
+        if not show_extra_contents and comparison_ref[1] != 'page':
+            continue
+        yield comparison_ref
+
+
+def get_comparison_rows(items):
+    """
+    get_comparison_rows
+    return the added, changed and removed pages and the extra contents of a page of the
+    comparison, the page revisions are loaded together and the titles are read from the title
+    parameter published with the pages
+    """
+    revision_ids = set()
+    for item in items:
+        if item['content_type'] != 'page':
+            continue
+        if item['diff'] in ('Added', 'Removed') and 'revision_id' in item['parameters']:
+            revision_ids.add(int(item['parameters']['revision_id']))
+        if item['diff'] == 'Changed':
+            for parameters in item['parameters'].values():
+                if 'revision_id' in parameters:
+                    revision_ids.add(int(parameters['revision_id']))
+    page_revisions = PageRevision.objects.select_related('page', 'user').in_bulk(revision_ids)
+
+    def get_page_revision(parameters):
+        """ get_page_revision """
+        if 'revision_id' not in parameters:
+            return None
+        return page_revisions.get(int(parameters['revision_id']))
+
+    def get_title(item, parameters, page_revision):
+        """
+        get_title, fall back to the current title of the page for the older documents and to the
+        document key when the revision doesn't exist anymore
+        """
+        if 'title' in parameters:
+            return parameters['title']
+        if page_revision is not None:
+            return page_revision.page.title
+        return item['document_key']
+
+    added_pages = []
+    removed_pages = []
+    changed_pages = []
+    extra_contents = []
+    for item in items:
+        item = dict(item)
+        if item['content_type'] == 'page':
+            # the rows of the pages whose revision doesn't exist anymore are kept without the
+            # revision links
+            if item['diff'] in ('Added', 'Removed'):
+                page_revision = get_page_revision(item['parameters'])
+                item['page_revision'] = page_revision
+                item['title'] = get_title(item, item['parameters'], page_revision)
+                if item['diff'] == 'Added':
+                    added_pages.append(item)
+                else:
+                    removed_pages.append(item)
+            if item['diff'] == 'Changed':
+                page_revision = get_page_revision(item['parameters']['release_from'])
+                item['page_revision_from'] = page_revision
+                item['page_revision_compare_to'] = get_page_revision(
+                    item['parameters']['release_compare_to'])
+                item['title'] = get_title(item, item['parameters']['release_from'], page_revision)
+                changed_pages.append(item)
+        else:
+            extra_contents.append(item)
+    return added_pages, changed_pages, removed_pages, extra_contents
+
+
+def release_document_diff(request, release_id, release_id_to_compare_to, content_type,
+                          document_key):
+    """ release_document_diff, changes of a document shown by the release detail page """
+    if not request.user.has_perm('wagtailadmin.access_dev'):
+        raise PermissionDenied
+
+    release = get_object_or_404(WSSPContentRelease, id=release_id)
+    release_to_compare_to = get_object_or_404(WSSPContentRelease, id=release_id_to_compare_to)
+    return JsonResponse(diff_release_documents(
+        release, release_to_compare_to, content_type, document_key), encoder=DjangoJSONEncoder)
+
+
+def get_document_diff(request, site_code, content_release_uuid, content_type, content_key,
+                      compare_to_uuid=None):
+    """
+    get_document_diff
+    return the changes of a document of a release compared to another release of the site, the
+    live release if compare_to_uuid isn't set
+    """
+    response = get_content_release(site_code, content_release_uuid)
+    if response['status'] == 'error':
+        return JsonResponse(response)
+    content_release = response['content']
+
+    response = get_content_release(site_code, compare_to_uuid)
+    if response['status'] == 'error':
+        return JsonResponse(response)
+    content_release_compare_to = response['content']
+
+    if content_release is None or content_release_compare_to is None:
+        return JsonResponse({
+            'status': 'error',
+            'error_code': 'content_release_does_not_exist',
+            'error_msg': _('ContentRelease does not exist'),
+        })
+
+    return JsonResponse(diff_release_documents(
+        content_release, content_release_compare_to, content_type, content_key),
+        encoder=DjangoJSONEncoder)
+
+
+def release_compare_document(request, release_id, release_id_to_compare_to, content_type,
+                             document_key):
+    """
+    release_compare_document
+    return the comparison item of a document as JSON, loaded on demand by the release detail
+    page for the extra contents
+    """
+    if not request.user.has_perm('wagtailadmin.access_dev'):
+        raise PermissionDenied
+
+    release = get_object_or_404(WSSPContentRelease, id=release_id)
+    release_to_compare_to = get_object_or_404(WSSPContentRelease, id=release_id_to_compare_to)
+    for comparison_ref in get_release_comparison(release, release_to_compare_to):
+        if comparison_ref[1] == content_type and str(comparison_ref[2]) == document_key:
+            return JsonResponse({
+                'status': 'success',
+                'content': get_comparison_items([comparison_ref])[0],
+            }, encoder=DjangoJSONEncoder)
+
+    return JsonResponse({
+        'status': 'error',
+        'error_code': 'release_document_does_not_exist',
+        'error_msg': _('The document is the same in both releases'),
+    })
+
+
 def release_detail(request, release_id, set_live_button=False, set_stage_button=False, release_id_to_compare_to=None):
     details = compare_release(request, release_id, release_id_to_compare_to, set_live_button, set_stage_button)
     details.update({
@@ -387,6 +915,12 @@ def release_set_live(request, release_id, publish_datetime=None, set_live_button
     # if response['status'] != 'success':
     #     raise Http404(response['error_msg'])
 
+    if response['status'] == 'success':
+        release.refresh_from_db()
+        if is_materialized_release(release) and not release.materialized_documents.exists():
+            materialize_release(release)
+        refresh_release_pointer(release.site_code)
+
     return redirect(absolute_path(request, 'wagtailsnapshotpublisher', 'wsspcontentrelease'))
 
 
@@ -424,12 +958,13 @@ def release_set_stage(request, release_id, publish_datetime=None, set_stage_butt
     if response['status'] != 'success':
         raise Http404(response['error_msg'])
 
+    # the release was loaded before being staged
+    release.refresh_from_db()
+
     # Send release_was_staged signal.
     release_was_staged.send(sender=release.__class__, release=release)
 
-    WSSPContentRelease.objects.stage(
-        site_code=release.site_code,
-    )
+    refresh_release_pointer(release.site_code)
     return redirect(absolute_path(request, 'wagtailsnapshotpublisher', 'wsspcontentrelease'))
 
 
@@ -449,6 +984,8 @@ def release_unset_stage(request, release_id):
     if response['status'] != 'success':
         raise Http404(response['error_msg'])
 
+    refresh_release_pointer(release.site_code)
+
     return redirect(absolute_path(request, 'wagtailsnapshotpublisher', 'wsspcontentrelease'))
 
 
@@ -459,14 +996,130 @@ def release_archive(request, release_id):
     response = publisher_api.archive_content_release(release.site_code, release.uuid)
     if response['status'] != 'success':
         raise Http404(response['error_msg'])
+    refresh_release_pointer(release.site_code)
     return redirect(absolute_path(request, 'wagtailsnapshotpublisher', 'wsspcontentrelease'))
 
 
 def get_document_release(request, site_code, content_release_uuid=None, content_type='content',
                          content_key=None):
     """ get_document_release """
-    return JsonResponse(
-        get_content_details(site_code, content_release_uuid, content_type, content_key)
+    response = get_content_release(site_code, content_release_uuid)
+    if response['status'] == 'error':
+        return JsonResponse(response)
+
+    content_release = response['content']
+    last_modified = content_release.publish_datetime if content_release else None
+
+    not_modified_response = get_document_not_modified_response(
+        request, site_code, content_release, response['release_uuid'], content_type, content_key)
+    if not_modified_response is not None:
+        return not_modified_response
+
+    response = get_content_document(site_code, content_release, response['release_uuid'],
+                                    content_type, content_key)
+    if response['status'] == 'error':
+        return JsonResponse(response)
+
+    return conditional_document_response(request, response['etag'], last_modified,
+                                         response['content'])
+
+
+def get_documents_release(request, site_code, content_release_uuid=None):
+    """
+    get_documents_release
+    return several documents of a release, each one is passed as a document parameter with the
+    format content_type:content_key, i.e. ?document=page:3&document=site_settings:site_settings
+    """
+    document_refs = []
+    for document in request.GET.getlist('document'):
+        content_type, separator, content_key = document.partition(':')
+        if not separator or not content_type or not content_key:
+            return JsonResponse({
+                'status': 'error',
+                'error_code': 'wrong_document_parameter',
+                'error_msg': _('document must have the format content_type:content_key'),
+            })
+        document_refs.append((content_type, content_key))
+
+    max_documents = getattr(settings, 'WSSP_BATCH_MAX_DOCUMENTS', BATCH_MAX_DOCUMENTS)
+    if not document_refs or len(document_refs) > max_documents:
+        return JsonResponse({
+            'status': 'error',
+            'error_code': 'wrong_number_of_documents',
+            'error_msg': _('Between 1 and {} documents can be requested').format(max_documents),
+        })
+
+    response = get_content_release(site_code, content_release_uuid)
+    if response['status'] == 'error':
+        return JsonResponse(response)
+
+    responses = get_content_documents(site_code, response['content'], response['release_uuid'],
+                                      document_refs)
+
+    documents = []
+    for content_type, content_key in document_refs:
+        document_response = dict(responses[(content_type, content_key)])
+        document_response.pop('etag', None)
+        document_response.update({
+            'content_type': content_type,
+            'content_key': content_key,
+        })
+        documents.append(document_response)
+
+    return JsonResponse({
+        'status': 'success',
+        'content': documents,
+    })
+
+
+def get_release_document_lines(content_release):
+    """ get_release_document_lines, yield the documents of the release as NDJSON lines """
+    for release_document, parameters, data in iter_release_documents(content_release):
+        yield json.dumps({
+            'key': release_document.document_key,
+            'type': release_document.content_type,
+            'parameters': parameters,
+            'document': data,
+        }, cls=DjangoJSONEncoder) + '\n'
+
+
+def warm_release_cache(content_release):
+    """
+    warm_release_cache
+    Put all the documents of the release, with their dynamic elements resolved, in the document
+    cache. return the number of cached documents.
+    """
+    if not is_content_release_cacheable(content_release):
+        return 0
+
+    if get_document_cache() is None:
+        return 0
+
+    count = 0
+    for document_refs in chunked(iter_release_document_refs(content_release), BATCH_WARM_DOCUMENTS):
+        responses = get_content_documents(
+            content_release.site_code, content_release, content_release.uuid, document_refs)
+        count += sum(1 for response in responses.values() if response['status'] == 'success')
+    return count
+
+
+def export_release(request, site_code, content_release_uuid=None):
+    """ export_release, stream all the documents of a release as NDJSON """
+    response = get_content_release(site_code, content_release_uuid)
+    if response['status'] == 'error':
+        return JsonResponse(response)
+
+    content_release = response['content']
+    if content_release is None:
+        return JsonResponse({
+            'status': 'error',
+            'error_code': 'content_release_does_not_exist',
+            'error_msg': _('ContentRelease does not exist'),
+        })
+
+    return StreamingHttpResponse(
+        get_release_document_lines(content_release),
+        content_type='application/x-ndjson',
     )
 
 
@@ -513,6 +1166,8 @@ def release_unfreeze(request, release_id):
     except WSSPContentRelease.DoesNotExist:
         raise Http404(_('This release cannot be restore'))
 
+    refresh_release_pointer(release_to_restore.site_code)
+
     return redirect(absolute_path(request, 'wagtailsnapshotpublisher', 'wsspcontentrelease'))
 
 def absolute_path(request, content_app, content_class):
@@ -3,6 +3,8 @@
 """
 
 from django.contrib.auth.models import Permission
+from django.db.models import F, Func, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.templatetags.static import static
 from django.urls import reverse
 from django.utils.html import format_html, format_html_join
@@ -10,14 +12,43 @@ from django.utils.translation import ugettext_lazy as _
 
 from wagtail.admin.action_menu import ActionMenuItem
 from wagtail.contrib.modeladmin.helpers import ButtonHelper
-from wagtail.contrib.modeladmin.options import ModelAdmin, modeladmin_register, CreateView
+from wagtail.contrib.modeladmin.options import (
+    ModelAdmin, modeladmin_register, CreateView, IndexView,
+)
 from wagtail.core import hooks
 
-from .models import WSSPContentRelease
+from djangosnapshotpublisher.models import ReleaseDocument
+
+from .models import WSSPContentRelease, get_release_documents_query_name
+
+
+def get_stage_releases():
+    """ get_stage_releases, return a site_code => stage release dict loaded with one query """
+    return {
+        content_release.site_code: content_release
+        for content_release in WSSPContentRelease.objects.filter(is_stage=True)
+    }
 
 
 class ReleaseButtonHelper(ButtonHelper):
-    """ ReleaseButtonHelper """
+    """
+    ReleaseButtonHelper
+    The stage releases of all the sites are loaded with one query, by the view if it has a
+    get_stage_releases method, a site_code => stage release dict can be passed as
+    stage_releases when it is already known.
+    """
+
+    def __init__(self, view, request, stage_releases=None):
+        super(ReleaseButtonHelper, self).__init__(view, request)
+        if stage_releases is None and hasattr(view, 'get_stage_releases'):
+            stage_releases = view.get_stage_releases()
+        self.stage_releases = stage_releases
+
+    def get_stage_release(self, site_code):
+        """ get_stage_release, return None if the site doesn't have a stage release """
+        if self.stage_releases is None:
+            self.stage_releases = get_stage_releases()
+        return self.stage_releases.get(site_code)
 
     def get_buttons_for_obj(self, obj, exclude=None, classnames_add=None,
                             classnames_exclude=None):
@@ -28,9 +59,7 @@ class ReleaseButtonHelper(ButtonHelper):
         if obj.status == 0:
             btns.insert(1, self.detail_revision_button(obj, ['button'], classnames_exclude))
             btns.insert(2, self.reindex_button(obj, ['button'], classnames_exclude))
-            try:
-                WSSPContentRelease.objects.stage(obj.site_code)
-            except WSSPContentRelease.DoesNotExist:
+            if self.get_stage_release(obj.site_code) is None:
                 btns.insert(3, self.set_stage_revision_button(obj, ['button'], classnames_exclude))
         elif obj.status == 1:
             btns.insert(1, self.unset_stage_revision_button(obj, ['button'], classnames_exclude))
@@ -139,6 +168,49 @@ class ReleaseAdminCreateView(CreateView):
         return super().form_valid(form, *args, **kwargs)
 
 
+class ReleaseAdminIndexView(IndexView):
+    """
+    ReleaseAdminIndexView
+    admin_order_field can be a tuple of fields, the rows are sorted by the first one then by the
+    next ones in the same direction.
+    """
+
+    def get_stage_releases(self):
+        """ get_stage_releases, loaded once for all the rows of the listing """
+        if not hasattr(self, '_stage_releases'):
+            self._stage_releases = get_stage_releases()
+        return self._stage_releases
+
+    def get_ordering_fields(self, field_name):
+        """ get_ordering_fields, return the tuple of fields to sort the column by """
+        order_field = super(ReleaseAdminIndexView, self).get_ordering_field(field_name)
+        if isinstance(order_field, (list, tuple)):
+            return tuple(order_field)
+        return (order_field,) if order_field else ()
+
+    def get_ordering_field(self, field_name):
+        """ get_ordering_field """
+        order_fields = self.get_ordering_fields(field_name)
+        return order_fields[0] if order_fields else None
+
+    def get_ordering(self, request, queryset):
+        """ get_ordering """
+        next_fields = {}
+        for field_name in self.list_display:
+            order_fields = self.get_ordering_fields(field_name)
+            if len(order_fields) > 1:
+                next_fields[order_fields[0]] = order_fields[1:]
+
+        ordering = []
+        for field in super(ReleaseAdminIndexView, self).get_ordering(request, queryset):
+            ordering.append(field)
+            if isinstance(field, str):
+                prefix = '-' if field.startswith('-') else ''
+                ordering.extend(
+                    prefix + next_field for next_field in next_fields.get(field.lstrip('-'), ()))
+        return ordering
+
+
 class ReleaseAdmin(ModelAdmin):
     """ ReleaseAdmin """
     model = WSSPContentRelease
@@ -146,12 +218,14 @@ class ReleaseAdmin(ModelAdmin):
     menu_icon = 'date'
     menu_order = 900
 
-    list_display = ('site_code', 'title', 'uuid', 'status', 'publish_datetime', 'version', 'author')
+    list_display = ('site_code', 'title', 'uuid', 'status', 'publish_datetime', 'version_number',
+                    'author', 'document_count', 'pages_changed')
     list_filter = ('status', 'site_code',)
     search_fields = ('title',)
     ordering = ('status', '-publish_datetime')
     index_view_extra_css = ('wagtailadmin/css/list-release.css',)
     create_view_class = ReleaseAdminCreateView
+    index_view_class = ReleaseAdminIndexView
 
     def get_extra_attrs_for_row(self, obj, context):
         """ get_extra_attrs_for_row """
@@ -183,8 +257,49 @@ class ReleaseAdmin(ModelAdmin):
         return ReleaseButtonHelper
 
     def get_queryset(self, request):
-        """ get_queryset """
-        return super(ReleaseAdmin, self).get_queryset(request)
+        """
+        get_queryset
+        The number of documents and of pages changed from the base release (the page documents
+        not shared with it) are counted in the listing query.
+        """
+        query_name = get_release_documents_query_name()
+        release_documents = ReleaseDocument.objects.filter(
+            **{query_name: OuterRef('pk')}
+        ).order_by()
+
+        document_count = release_documents.filter(deleted=False).annotate(
+            count=Func(F('id'), function='COUNT'),
+        ).values('count')
+        pages_changed = release_documents.filter(content_type='page').exclude(
+            **{query_name: OuterRef('base_release_id')}
+        ).annotate(
+            count=Func(F('id'), function='COUNT'),
+        ).values('count')
+
+        return super(ReleaseAdmin, self).get_queryset(request).select_related(
+            'author', 'publisher', 'base_release',
+        ).annotate(
+            document_count=Coalesce(Subquery(document_count, output_field=IntegerField()), 0),
+            pages_changed=Coalesce(Subquery(pages_changed, output_field=IntegerField()), 0),
+        )
+
+    def document_count(self, obj):
+        """ document_count """
+        return obj.document_count
+    document_count.short_description = _('Documents')
+    document_count.admin_order_field = 'document_count'
+
+    def version_number(self, obj):
+        """ version_number """
+        return obj.version
+    version_number.short_description = _('Version')
+    version_number.admin_order_field = ('version_major', 'version_minor')
+
+    def pages_changed(self, obj):
+        """ pages_changed """
+        return obj.pages_changed
+    pages_changed.short_description = _('Pages changed')
+    pages_changed.admin_order_field = 'pages_changed'
 
     def get_edit_handler(self, instance, request):
         """ get_edit_handler """
@@ -219,6 +334,17 @@ class PublishToReleaseMenuItem(ReleaseActionMenuItem):
     name = 'wssp-actionrelease-publish-release'
 
 
+class PublishChildrenToReleaseMenuItem(ReleaseActionMenuItem):
+    """ PublishChildrenToReleaseMenuItem """
+    label = _('Publish Sub Pages To A Release')
+    name = 'wssp-actionrelease-publish-children-release'
+
+    def is_shown(self, request, context):
+        """ is_shown """
+        return super(PublishChildrenToReleaseMenuItem, self).is_shown(request, context) and \
+            context['page'].get_children().exists()
+
+
 class UnpublishToReleaseMenuItem(ReleaseActionMenuItem):
     """ UnpublishToReleaseMenuItem """
     label = _('Unpublish From A Release')
@@ -242,6 +368,11 @@ def register_publish_to_release_menu_item():
     """ register_publish_to_release_menu_item """
     return PublishToReleaseMenuItem(order=30)
 
+@hooks.register('register_page_action_menu_item')
+def register_publish_children_to_release_menu_item():
+    """ register_publish_children_to_release_menu_item """
+    return PublishChildrenToReleaseMenuItem(order=25)
+
 @hooks.register('register_page_action_menu_item')
 def register_unpublish_to_release_menu_item():
     """ register_unpublish_to_release_menu_item """